@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+@File    :   bench_import.py
+@Time    :   2026/10/16 18:22:47
+@Author  :   tyqqj
+@Version :   1.0
+@Contact :   tyqqj0@163.com
+@Desc    :   Cold import time of utils/main, lazy versus eagerly touching every client class
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("oss2", "numpy", "PIL", "volcenginesdkarkruntime", "requests", "aiohttp")
+
+# 每个场景在全新解释器中执行，打印耗时与已加载的重量级模块
+SCENARIOS = {
+    "import utils": "import utils",
+    "import main": "import main",
+    "prefix action": "import tempfile\nimport main\nmain.prefix_output_images(tempfile.mkdtemp())",
+    "eager (all clients)": (
+        "import utils\n"
+        "for name in ('AliyunOSSImageHost', 'ImageToTextGenerator', 'TextToImageGenerator', 'default_ark_api_key'):\n"
+        "    getattr(utils, name)"
+    ),
+}
+
+_PROBE = """
+import sys, time, json
+started = time.perf_counter()
+{body}
+elapsed = time.perf_counter() - started
+print("IMPORT_RESULT " + json.dumps({{"seconds": elapsed, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def run_probe(body, env):
+    code = _PROBE.format(body=body, heavy=HEAVY_MODULES)
+    proc = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+    for line in proc.stdout.splitlines():
+        if line.startswith("IMPORT_RESULT "):
+            return json.loads(line[len("IMPORT_RESULT "):]), None
+    error = (proc.stderr.strip().splitlines() or ["unknown error"])[-1]
+    return None, error
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=7, help="fresh interpreters per scenario")
+    parser.add_argument(
+        "--keys",
+        help="keys.json to use; by default a missing path, which shows that lazy imports need no credentials",
+    )
+    args = parser.parse_args()
+
+    env = dict(os.environ, IMG_TEXT_IMG_KEYS=args.keys or os.path.join(REPO_ROOT, "no-such-keys.json"))
+    for name, body in SCENARIOS.items():
+        timings, loaded, error = [], [], None
+        for _ in range(args.repeat):
+            result, error = run_probe(body, env)
+            if result is None:
+                break
+            timings.append(result["seconds"])
+            loaded = result["loaded"]
+        if not timings:
+            print(f"{name:<26} failed: {error}")
+            continue
+        print(
+            f"{name:<26} median={statistics.median(timings) * 1000:7.1f} ms "
+            f"min={min(timings) * 1000:7.1f} ms heavy modules: {', '.join(loaded) or 'none'}"
+        )
+
+
+if __name__ == "__main__":
+    main_cli()
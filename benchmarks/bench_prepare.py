@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+@File    :   bench_prepare.py
+@Time    :   2026/10/16 15:40:12
+@Author  :   tyqqj
+@Version :   1.0
+@Contact :   tyqqj0@163.com
+@Desc    :   Caption throughput with thread vs process-pool image preparation
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+def build_dataset(root, large_count, small_count, large_size, small_size):
+    from PIL import Image
+
+    large_paths = []
+    for idx in range(large_count):
+        # 噪声图几乎无法压缩，保证同时超过像素与字节上限
+        noise = Image.effect_noise(large_size, 64).convert("RGB")
+        path = os.path.join(root, f"large_{idx}.jpg")
+        noise.save(path, format="JPEG", quality=95)
+        large_paths.append(path)
+    small_paths = []
+    small = Image.effect_noise(small_size, 32).convert("RGB")
+    for idx in range(small_count):
+        path = os.path.join(root, f"small_{idx}.jpg")
+        small.save(path, format="JPEG", quality=90)
+        small_paths.append(path)
+    # 大图均匀插在小图之间，模拟真实目录顺序：线程模式下处理大图时同批的小图请求会被拖住
+    paths = list(small_paths)
+    step = max(1, len(small_paths) // (len(large_paths) + 1))
+    for offset, path in enumerate(large_paths, 1):
+        paths.insert(min(len(paths), offset * step + offset - 1), path)
+    return paths
+
+
+def run_once(paths, workers, latency):
+    def caption(path):
+        main._encode_image_for_upload(path)
+        time.sleep(latency)  # 模拟上传 + 图片理解请求
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(caption, paths))
+    return time.perf_counter() - started
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--large", type=int, default=4, help="number of ~41 MP images")
+    parser.add_argument("--small", type=int, default=200, help="number of small images")
+    parser.add_argument("--workers", type=int, default=main.config["max_workers"])
+    parser.add_argument("--latency", type=float, default=0.3, help="simulated network seconds per image")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_prepare_") as root:
+        print("Building synthetic dataset...")
+        paths = build_dataset(root, args.large, args.small, (8000, 5200), (1024, 768))
+        for executor in ("thread", "process"):
+            main.config["prep_executor"] = executor
+            if executor == "process":
+                # 预热进程池，避免把进程启动时间计入吞吐
+                main._get_prep_pool().submit(os.getpid).result()
+            elapsed = run_once(paths, args.workers, args.latency)
+            print(
+                f"prep_executor={executor:<8} images={len(paths)} workers={args.workers} "
+                f"wall={elapsed:.2f}s throughput={len(paths) / elapsed:.1f} img/s"
+            )
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,491 @@
+# -*- coding: utf-8 -*-
+"""
+@File    :   mock_servers.py
+@Time    :   2026/10/16 17:05:40
+@Author  :   tyqqj
+@Version :   1.0
+@Contact :   tyqqj0@163.com
+@Desc    :   Local stand-ins for Ark, OSS and the image CDN used by the offline benchmarks
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+
+class LatencyProfile:
+    """
+    Fault model of one mock service.
+
+    Latency is log-normal around ``median_ms`` (``sigma`` = 0 gives a fixed
+    delay). Each request fails with HTTP 500 with probability ``error_rate`` or
+    is throttled with HTTP 429 with probability ``throttle_rate``; requests
+    beyond ``max_inflight`` concurrent ones are always throttled (0 = unlimited).
+    """
+
+    def __init__(
+        self,
+        median_ms: float = 50.0,
+        sigma: float = 0.5,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        max_inflight: int = 0,
+    ) -> None:
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.max_inflight = max_inflight
+
+    def sample_seconds(self, rng: random.Random) -> float:
+        if self.median_ms <= 0:
+            return 0.0
+        if self.sigma <= 0:
+            return self.median_ms / 1000.0
+        return rng.lognormvariate(math.log(self.median_ms / 1000.0), self.sigma)
+
+
+class _ServiceState:
+    def __init__(self, name: str, profile: LatencyProfile, seed: Optional[int]) -> None:
+        self.name = name
+        self.profile = profile
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self.counters = {"requests": 0, "ok": 0, "errors": 0, "throttled": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def admit(self) -> Tuple[Optional[int], float]:
+        """Decide the fate of one request: ``(error_status or None, delay_seconds)``."""
+        with self._lock:
+            self.counters["requests"] += 1
+            self._inflight += 1
+            profile = self.profile
+            if profile.max_inflight and self._inflight > profile.max_inflight:
+                return 429, 0.0
+            roll = self._rng.random()
+            delay = profile.sample_seconds(self._rng)
+        if roll < profile.throttle_rate:
+            return 429, delay * 0.1
+        if roll < profile.throttle_rate + profile.error_rate:
+            return 500, delay
+        return None, delay
+
+    def done(self, status: int, bytes_in: int = 0, bytes_out: int = 0) -> None:
+        with self._lock:
+            self._inflight -= 1
+            if status == 429:
+                self.counters["throttled"] += 1
+            elif status >= 500:
+                self.counters["errors"] += 1
+            else:
+                self.counters["ok"] += 1
+            self.counters["bytes_in"] += bytes_in
+            self.counters["bytes_out"] += bytes_out
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counters)
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real endpoints
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002 - BaseHTTPRequestHandler API
+        pass
+
+    @property
+    def service(self) -> "_MockServer":
+        return self.server  # type: ignore[return-value]
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status: int, body: bytes = b"", content_type: str = "application/json",
+              headers: Optional[Dict[str, str]] = None, head_only: bool = False) -> int:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if body and not head_only:
+            self.wfile.write(body)
+            return len(body)
+        return 0
+
+    def _handle(self, method: str) -> None:
+        state = self.service.state_for(self.path)
+        body = self._read_body() if method in ("POST", "PUT") else b""
+        failure, delay = state.admit()
+        status, sent = 500, 0
+        try:
+            if delay:
+                time.sleep(delay)
+            if failure is not None:
+                status = failure
+                sent = self.service.send_failure(self, failure, head_only=method == "HEAD")
+            else:
+                status, sent = self.service.route(self, method, body)
+        finally:
+            state.done(status, len(body), sent)
+
+    def do_GET(self) -> None:
+        self._handle("GET")
+
+    def do_HEAD(self) -> None:
+        self._handle("HEAD")
+
+    def do_POST(self) -> None:
+        self._handle("POST")
+
+    def do_PUT(self) -> None:
+        self._handle("PUT")
+
+    def do_DELETE(self) -> None:
+        self._handle("DELETE")
+
+
+class _MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, name: str, profile: LatencyProfile, seed: Optional[int] = None) -> None:
+        super().__init__(("127.0.0.1", 0), _MockHandler)
+        self.state = _ServiceState(name, profile, seed)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "_MockServer":
+        self._thread = threading.Thread(target=self.serve_forever, name=f"mock-{self.state.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def state_for(self, path: str) -> _ServiceState:
+        return self.state
+
+    def send_failure(self, handler: _MockHandler, status: int, head_only: bool = False) -> int:
+        if status == 429:
+            error = {"code": "RateLimitExceeded", "message": "mock throttle", "type": "TooManyRequests"}
+            return handler._send(status, json.dumps({"error": error}).encode(), headers={"Retry-After": "1"},
+                                 head_only=head_only)
+        error = {"code": "InternalServiceError", "message": "mock failure", "type": "InternalServerError"}
+        return handler._send(status, json.dumps({"error": error}).encode(), head_only=head_only)
+
+    def route(self, handler: _MockHandler, method: str, body: bytes) -> Tuple[int, int]:
+        raise NotImplementedError
+
+
+class MockArkServer(_MockServer):
+    """
+    ``POST .../chat/completions`` and ``POST .../images/generations`` in the
+    shape the Ark SDK parses. Generated image URLs point at ``cdn``.
+    """
+
+    def __init__(self, profile: LatencyProfile, cdn: "MockCDNServer", seed: Optional[int] = None,
+                 generation_profile: Optional[LatencyProfile] = None) -> None:
+        super().__init__("ark", profile, seed)
+        self.cdn = cdn
+        # 生成图片通常比图片理解慢一个数量级，可单独设置
+        self.generation_state = _ServiceState("ark-images", generation_profile or profile, seed)
+
+    def state_for(self, path: str) -> _ServiceState:
+        if urlparse(path).path.rstrip("/").endswith("/images/generations"):
+            return self.generation_state
+        return self.state
+
+    def _handle_generation(self, handler: _MockHandler, body: bytes) -> Tuple[int, int]:
+        request = json.loads(body or b"{}")
+        payload = {
+            "model": request.get("model", "mock"),
+            "created": int(time.time()),
+            "data": [{"url": f"{self.cdn.base_url}/images/{uuid.uuid4().hex}.jpeg", "size": request.get("size")}],
+            "usage": {"generated_images": 1, "output_tokens": 4096, "total_tokens": 4096},
+        }
+        return 200, handler._send(200, json.dumps(payload).encode())
+
+    def route(self, handler: _MockHandler, method: str, body: bytes) -> Tuple[int, int]:
+        path = urlparse(handler.path).path.rstrip("/")
+        if method == "POST" and path.endswith("/chat/completions"):
+            request = json.loads(body or b"{}")
+            content = (
+                "Art style: synthetic benchmark rendering with neutral tones.\n"
+                f"Subject description: mock caption {uuid.uuid4().hex[:12]} for load testing."
+            )
+            prompt_tokens = max(1, len(body) // 4)
+            payload = {
+                "id": f"mock-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "mock"),
+                "choices": [
+                    {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+                ],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 64, "total_tokens": prompt_tokens + 64},
+            }
+            return 200, handler._send(200, json.dumps(payload).encode())
+        if method == "POST" and path.endswith("/images/generations"):
+            return self._handle_generation(handler, body)
+        return 404, handler._send(404, b'{"error": {"code": "NotFound", "message": "unknown route"}}')
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        return {"ark-chat": self.state.snapshot(), "ark-images": self.generation_state.snapshot()}
+
+
+class MockOSSServer(_MockServer):
+    """
+    Path-style OSS endpoint (``/<bucket>/<key>``), which is what oss2 uses for
+    an IP endpoint. Supports PUT, HEAD, GET, DELETE, the ``POST ?delete``
+    batch delete, prefix listing (``GET /<bucket>/?prefix=``) and multipart
+    uploads (initiate, upload part, list parts, complete, abort). Only object
+    sizes and ETags are kept, not the bytes.
+    """
+
+    def __init__(self, profile: LatencyProfile, seed: Optional[int] = None) -> None:
+        super().__init__("oss", profile, seed)
+        self._objects: Dict[str, Tuple[int, str]] = {}
+        # upload_id -> (object_path, {part_number: (size, etag)})
+        self._uploads: Dict[str, Tuple[str, Dict[int, Tuple[int, str]]]] = {}
+        self._objects_lock = threading.Lock()
+
+    @staticmethod
+    def _xml(handler: _MockHandler, body: str, headers: Dict[str, str]) -> int:
+        xml = ("<?xml version=\"1.0\" encoding=\"UTF-8\"?>" + body).encode()
+        return handler._send(200, xml, content_type="application/xml", headers=headers)
+
+    def _no_such_upload(self, handler: _MockHandler, headers: Dict[str, str]) -> int:
+        xml = (
+            "<?xml version=\"1.0\" encoding=\"UTF-8\"?><Error><Code>NoSuchUpload</Code>"
+            "<Message>The specified upload does not exist.</Message></Error>"
+        ).encode()
+        return handler._send(404, xml, content_type="application/xml", headers=headers)
+
+    def _list_objects(self, handler: _MockHandler, bucket: str, query, headers: Dict[str, str]) -> int:
+        prefix = query.get("prefix", [""])[0]
+        marker = query.get("marker", [""])[0]
+        max_keys = int(query.get("max-keys", ["100"])[0])
+        with self._objects_lock:
+            keys = sorted(
+                path.split("/", 1)[1]
+                for path in self._objects
+                if path.startswith(bucket + "/") and path.split("/", 1)[1].startswith(prefix)
+            )
+            keys = [key for key in keys if key > marker]
+            page = [(key, self._objects[f"{bucket}/{key}"]) for key in keys[:max_keys]]
+        truncated = len(keys) > max_keys
+        contents = "".join(
+            f"<Contents><Key>{key}</Key><LastModified>2026-01-01T00:00:00.000Z</LastModified><ETag>{etag}</ETag>"
+            f"<Type>Normal</Type><Size>{size}</Size><StorageClass>Standard</StorageClass></Contents>"
+            for key, (size, etag) in page
+        )
+        next_marker = page[-1][0] if truncated else ""
+        return self._xml(
+            handler,
+            f"<ListBucketResult><Name>{bucket}</Name><Prefix>{prefix}</Prefix><Marker>{marker}</Marker>"
+            f"<MaxKeys>{max_keys}</MaxKeys><Delimiter></Delimiter><IsTruncated>{str(truncated).lower()}</IsTruncated>"
+            f"<NextMarker>{next_marker}</NextMarker>{contents}</ListBucketResult>",
+            headers,
+        )
+
+    def _multipart(self, handler: _MockHandler, method: str, body: bytes, object_path: str, query, headers):
+        bucket, _, key = object_path.partition("/")
+        if method == "POST" and "uploads" in query:
+            upload_id = uuid.uuid4().hex.upper()
+            with self._objects_lock:
+                self._uploads[upload_id] = (object_path, {})
+            return 200, self._xml(
+                handler,
+                f"<InitiateMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>",
+                headers,
+            )
+        upload_id = query["uploadId"][0]
+        with self._objects_lock:
+            upload = self._uploads.get(upload_id)
+            if upload is not None and method in ("POST", "DELETE"):
+                del self._uploads[upload_id]
+        if upload is None:
+            return 404, self._no_such_upload(handler, headers)
+        parts = upload[1]
+        if method == "PUT":
+            etag = '"' + hashlib.md5(body).hexdigest().upper() + '"'
+            with self._objects_lock:
+                parts[int(query["partNumber"][0])] = (len(body), etag)
+            return 200, handler._send(200, headers={"ETag": etag, **headers})
+        if method == "GET":
+            listed = "".join(
+                f"<Part><PartNumber>{number}</PartNumber><LastModified>2026-01-01T00:00:00.000Z</LastModified>"
+                f"<ETag>{etag}</ETag><Size>{size}</Size></Part>"
+                for number, (size, etag) in sorted(parts.items())
+            )
+            return 200, self._xml(
+                handler,
+                f"<ListPartsResult><Bucket>{bucket}</Bucket><Key>{key}</Key><UploadId>{upload_id}</UploadId>"
+                f"<PartNumberMarker>0</PartNumberMarker><NextPartNumberMarker>{max(parts, default=0)}"
+                f"</NextPartNumberMarker><MaxParts>1000</MaxParts><IsTruncated>false</IsTruncated>"
+                f"{listed}</ListPartsResult>",
+                headers,
+            )
+        if method == "DELETE":
+            return 204, handler._send(204, headers=headers)
+        # 完成上传：对象大小为各分片之和，ETag 与 OSS 一样带分片数后缀
+        numbers = [int(number) for number in re.findall(r"<PartNumber>(\d+)</PartNumber>", body.decode("utf-8"))]
+        size = sum(parts[number][0] for number in numbers if number in parts)
+        etag = f'"{uuid.uuid4().hex.upper()}-{len(numbers)}"'
+        with self._objects_lock:
+            self._objects[object_path] = (size, etag)
+        return 200, self._xml(
+            handler,
+            f"<CompleteMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key>"
+            f"<ETag>{etag}</ETag></CompleteMultipartUploadResult>",
+            {"ETag": etag, **headers},
+        )
+
+    @staticmethod
+    def _split(path: str) -> str:
+        return unquote(urlparse(path).path.lstrip("/"))
+
+    def _not_found(self, handler: _MockHandler, object_path: str, head_only: bool) -> int:
+        xml = (
+            "<?xml version=\"1.0\" encoding=\"UTF-8\"?><Error><Code>NoSuchKey</Code>"
+            f"<Message>The specified key does not exist.</Message><Key>{object_path}</Key></Error>"
+        ).encode()
+        headers = {"x-oss-request-id": uuid.uuid4().hex}
+        if head_only:
+            # HEAD 响应没有 body，oss2 从该头部解析错误码
+            headers["x-oss-err"] = base64.b64encode(xml).decode()
+        return handler._send(404, xml, content_type="application/xml", headers=headers, head_only=head_only)
+
+    def route(self, handler: _MockHandler, method: str, body: bytes) -> Tuple[int, int]:
+        parsed = urlparse(handler.path)
+        object_path = self._split(handler.path)
+        request_id = {"x-oss-request-id": uuid.uuid4().hex}
+        query = parse_qs(parsed.query, keep_blank_values=True)
+        if "uploads" in query or "uploadId" in query:
+            return self._multipart(handler, method, body, object_path, query, request_id)
+        if method == "GET" and "/" not in object_path.rstrip("/"):
+            return 200, self._list_objects(handler, object_path.rstrip("/"), query, request_id)
+        if method == "PUT":
+            etag = '"' + hashlib.md5(body).hexdigest().upper() + '"'
+            with self._objects_lock:
+                self._objects[object_path] = (len(body), etag)
+            return 200, handler._send(200, headers={"ETag": etag, **request_id})
+        if method == "POST" and "delete" in query:
+            bucket = object_path.split("/", 1)[0]
+            keys = [unquote(key) for key in re.findall(r"<Key>(.*?)</Key>", body.decode("utf-8"))]
+            url_encoded = parse_qs(parsed.query).get("encoding-type") == ["url"]
+            with self._objects_lock:
+                for key in keys:
+                    self._objects.pop(f"{bucket}/{key}", None)
+            deleted = "".join(
+                f"<Deleted><Key>{quote(key) if url_encoded else key}</Key></Deleted>" for key in keys
+            )
+            xml = f"<?xml version=\"1.0\" encoding=\"UTF-8\"?><DeleteResult>{deleted}</DeleteResult>".encode()
+            return 200, handler._send(200, xml, content_type="application/xml", headers=request_id)
+        with self._objects_lock:
+            stored = self._objects.get(object_path)
+        if method == "DELETE":
+            with self._objects_lock:
+                self._objects.pop(object_path, None)
+            return 204, handler._send(204, headers=request_id)
+        if method in ("HEAD", "GET"):
+            if stored is None:
+                return 404, self._not_found(handler, object_path, head_only=method == "HEAD")
+            size, etag = stored
+            headers = {"ETag": etag, "Last-Modified": handler.date_time_string(), **request_id}
+            payload = bytes(size)
+            return 200, handler._send(200, payload, content_type="application/octet-stream", headers=headers,
+                                      head_only=method == "HEAD")
+        return 405, handler._send(405, headers=request_id)
+
+    def object_count(self) -> int:
+        with self._objects_lock:
+            return len(self._objects)
+
+
+class MockCDNServer(_MockServer):
+    """
+    Serves a fixed ``payload_bytes``-sized body for any ``GET /images/<name>``
+    and honours ``Range: bytes=N-`` so resumed downloads can be exercised.
+    """
+
+    def __init__(self, profile: LatencyProfile, payload_bytes: int = 512 * 1024, seed: Optional[int] = None) -> None:
+        super().__init__("cdn", profile, seed)
+        # 流水线不会解码下载结果，随机字节即可代表“不可压缩”的 JPEG
+        self.payload = b"\xff\xd8\xff\xe0" + os.urandom(max(0, payload_bytes - 6)) + b"\xff\xd9"
+
+    def route(self, handler: _MockHandler, method: str, body: bytes) -> Tuple[int, int]:
+        if method not in ("GET", "HEAD") or not urlparse(handler.path).path.startswith("/images/"):
+            return 404, handler._send(404)
+        total = len(self.payload)
+        match = re.match(r"bytes=(\d+)-$", handler.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            if start >= total:
+                return 416, handler._send(416, headers={"Content-Range": f"bytes */{total}"})
+            headers = {"Content-Range": f"bytes {start}-{total - 1}/{total}", "Accept-Ranges": "bytes"}
+            return 206, handler._send(206, self.payload[start:], content_type="image/jpeg", headers=headers,
+                                      head_only=method == "HEAD")
+        return 200, handler._send(200, self.payload, content_type="image/jpeg", headers={"Accept-Ranges": "bytes"},
+                                  head_only=method == "HEAD")
+
+
+class MockServices:
+    """Start the CDN, OSS and Ark mocks together; use as a context manager."""
+
+    def __init__(
+        self,
+        vision: LatencyProfile,
+        generation: LatencyProfile,
+        oss: LatencyProfile,
+        cdn: LatencyProfile,
+        cdn_payload_bytes: int = 512 * 1024,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.cdn = MockCDNServer(cdn, cdn_payload_bytes, seed)
+        self.oss = MockOSSServer(oss, seed)
+        self.ark = MockArkServer(vision, self.cdn, seed, generation_profile=generation)
+
+    def __enter__(self) -> "MockServices":
+        for server in (self.cdn, self.oss, self.ark):
+            server.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        for server in (self.ark, self.oss, self.cdn):
+            server.stop()
+        return False
+
+    @property
+    def ark_base_url(self) -> str:
+        return self.ark.base_url + "/api/v3"
+
+    @property
+    def oss_endpoint(self) -> str:
+        return self.oss.base_url
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        counters = self.ark.snapshot()
+        counters["oss"] = self.oss.state.snapshot()
+        counters["cdn"] = self.cdn.state.snapshot()
+        return counters
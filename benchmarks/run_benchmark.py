@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+"""
+@File    :   run_benchmark.py
+@Time    :   2026/10/16 17:20:18
+@Author  :   tyqqj
+@Version :   1.0
+@Contact :   tyqqj0@163.com
+@Desc    :   Offline throughput benchmark of the pipeline against local mock services
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from mock_servers import LatencyProfile, MockServices  # noqa: E402
+
+SCENARIOS = ("text", "image", "full")
+RESULT_PREFIX = "BENCH_RESULT "
+# 逐任务计时的 main.py 函数，按名称归为一个阶段
+TIMED_FUNCTIONS = {
+    "_process_metadata_task": "metadata",
+    "_process_image_to_text_task": "caption",
+    "_process_image_to_text_task_async": "caption",
+    "_process_text_to_image_task": "generate+download",
+    "_process_text_to_image_task_async": "generate+download",
+    "_stream_metadata_stage": "metadata",
+    "_caption_prep_step": "prep",
+    "_caption_upload_step": "upload",
+    "_caption_inference_step": "inference",
+    "_stream_generate_stage": "generate",
+    "_stream_download_stage": "download",
+}
+
+
+def build_dataset(root, count, image_size, per_dir=50):
+    """Synthetic source images plus matching prompt files, split into sub-directories."""
+    from PIL import Image
+
+    real_root = os.path.join(root, "real")
+    text_root = os.path.join(root, "text")
+    base = Image.effect_noise(image_size, 48).convert("RGB")
+    for idx in range(count):
+        group = f"group_{idx // per_dir:03d}"
+        os.makedirs(os.path.join(real_root, group), exist_ok=True)
+        os.makedirs(os.path.join(text_root, group), exist_ok=True)
+        # 每张图片内容不同，避免被上传/描述缓存命中
+        image = base.rotate(idx % 360) if idx % 2 else base.transpose(Image.FLIP_LEFT_RIGHT).rotate(idx % 360)
+        image.save(os.path.join(real_root, group, f"img_{idx:05d}.jpg"), format="JPEG", quality=90)
+        with open(os.path.join(text_root, group, f"img_{idx:05d}.txt"), "w", encoding="utf-8") as f:
+            f.write(f"Art style: benchmark rendering.\nSubject description: synthetic scene number {idx}.")
+    return real_root, text_root
+
+
+def write_keys_file(path, services):
+    keys = {
+        "oss": {
+            "access_key_id": "mock-ak",
+            "access_key_secret": "mock-sk",
+            "bucket_name": "bench",
+            "endpoint": services.oss_endpoint,
+        },
+        "ark": {"api_key": "mock-ark-key"},
+        "volc": {"ak": "mock-ak", "sk": "mock-sk"},
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(keys, f)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def count_files(root, extensions):
+    total = 0
+    for _, _, files in os.walk(root):
+        total += sum(1 for name in files if name.lower().endswith(extensions))
+    return total
+
+
+def _instrument(main, samples, failures):
+    def record(stage, started, ok):
+        samples.setdefault(stage, []).append(time.perf_counter() - started)
+        if not ok:
+            failures[stage] = failures.get(stage, 0) + 1
+
+    def timed(stage, fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    result = await fn(*args, **kwargs)
+                except BaseException:
+                    record(stage, started, False)
+                    raise
+                record(stage, started, not (isinstance(result, tuple) and result and result[0] is False))
+                return result
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException:
+                record(stage, started, False)
+                raise
+            record(stage, started, not (isinstance(result, tuple) and result and result[0] is False))
+            return result
+        return wrapper
+
+    for name, stage in TIMED_FUNCTIONS.items():
+        fn = getattr(main, name, None)
+        if fn is not None:
+            setattr(main, name, timed(stage, fn))
+
+
+def run_child(spec):
+    """Run one scenario in this (fresh) process and print its result as a JSON line."""
+    import main
+
+    work = spec["work_dir"]
+    main.config.update(spec["config"])
+    main.config.update(
+        {
+            "real_image_path": spec["real_root"],
+            "text_image_path": os.path.join(work, "text"),
+            "output_path": os.path.join(work, "output"),
+            "meta_path": os.path.join(work, "meta"),
+            "job_ledger_path": os.path.join(work, "cache", "jobs.sqlite3"),
+            "caption_cache_path": os.path.join(work, "cache", "caption_cache.json"),
+            "upload_cache_path": os.path.join(work, "cache", "upload_cache.json"),
+            "dataset_index_dir": os.path.join(work, "cache"),
+            "enable_progress_bar": False,
+        }
+    )
+    os.makedirs(os.path.join(work, "cache"), exist_ok=True)
+    scenario = spec["scenario"]
+    if scenario == "image":
+        shutil.copytree(spec["text_root"], main.config["text_image_path"])
+
+    samples, failures = {}, {}
+    _instrument(main, samples, failures)
+    started = time.perf_counter()
+    if scenario == "text":
+        main.generate_text_from_images(main.config["real_image_path"])
+    elif scenario == "image":
+        main.generate_images_from_text(main.config["text_image_path"])
+    else:
+        main.run_full_pipeline()
+    elapsed = time.perf_counter() - started
+
+    if scenario == "text":
+        completed = count_files(main.config["text_image_path"], (".txt",))
+    else:
+        completed = count_files(main.config["output_path"], main.SUPPORTED_IMAGE_EXTENSIONS)
+    stages = {
+        stage: {
+            "count": len(values),
+            "failed": failures.get(stage, 0),
+            "p50": percentile(values, 0.50),
+            "p99": percentile(values, 0.99),
+        }
+        for stage, values in samples.items()
+    }
+    result = {
+        "completed": completed,
+        "seconds": elapsed,
+        "files_per_second": completed / elapsed if elapsed > 0 else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": stages,
+        "stage_metrics": main._get_metrics().summary(),
+    }
+    sys.stdout.flush()
+    print(RESULT_PREFIX + json.dumps(result))
+
+
+def _parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def _format_ms(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.0f}"
+
+
+def _diff_counters(before, after):
+    return {name: {key: after[name][key] - before[name].get(key, 0) for key in after[name]} for name in after}
+
+
+def _check_regressions(results, baseline_path, tolerance):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(entry["scenario"], entry["workers"]): entry for entry in json.load(f)}
+    regressions = []
+    for entry in results:
+        previous = baseline.get((entry["scenario"], entry["workers"]))
+        if previous is None or not previous.get("files_per_second"):
+            continue
+        ratio = entry["files_per_second"] / previous["files_per_second"]
+        if ratio < 1.0 - tolerance:
+            regressions.append(
+                f"{entry['scenario']} workers={entry['workers']}: "
+                f"{entry['files_per_second']:.1f} files/s vs baseline {previous['files_per_second']:.1f} "
+                f"({(ratio - 1) * 100:+.0f}%)"
+            )
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=int, default=200, help="number of synthetic source images")
+    parser.add_argument("--image-size", type=_parse_size, default=(1024, 768), help="WIDTHxHEIGHT of source images")
+    parser.add_argument("--scenario", choices=SCENARIOS + ("all",), default="all")
+    parser.add_argument("--workers", default="8,16,32", help="comma separated max_workers values to sweep")
+    parser.add_argument("--engine", choices=("threads", "asyncio", "resource_pools"), default="threads")
+    parser.add_argument("--pipeline-mode", choices=("staged", "streaming"), default="staged")
+    parser.add_argument("--transport", choices=("auto", "inline", "hosted"), default="auto")
+    parser.add_argument("--no-rate-limit", action="store_true", help="disable the client-side adaptive limiter")
+    parser.add_argument("--oss-cleanup", action="store_true", help="batch-delete the run's uploads after captioning")
+    parser.add_argument("--vision-ms", type=float, default=300.0, help="median chat-completions latency")
+    parser.add_argument("--generate-ms", type=float, default=1500.0, help="median images-generate latency")
+    parser.add_argument("--oss-ms", type=float, default=30.0, help="median OSS PUT/HEAD latency")
+    parser.add_argument("--cdn-ms", type=float, default=30.0, help="median CDN GET latency")
+    parser.add_argument("--sigma", type=float, default=0.5, help="log-normal spread of every latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of Ark/OSS/CDN requests failing with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of Ark requests answered with 429")
+    parser.add_argument("--max-inflight", type=int, default=0, help="Ark concurrency above which requests get 429")
+    parser.add_argument("--cdn-bytes", type=int, default=512 * 1024, help="size of each generated image")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="write the results as JSON (usable as a later --baseline)")
+    parser.add_argument("--baseline", help="previous --output file; exit 1 on a throughput regression")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed files/sec drop versus --baseline")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's own output")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        with open(args.child, "r", encoding="utf-8") as f:
+            run_child(json.load(f))
+        return
+
+    scenarios = SCENARIOS if args.scenario == "all" else (args.scenario,)
+    worker_counts = [int(value) for value in args.workers.split(",") if value.strip()]
+    ark_profile = dict(
+        sigma=args.sigma, error_rate=args.error_rate, throttle_rate=args.throttle_rate, max_inflight=args.max_inflight
+    )
+    services = MockServices(
+        vision=LatencyProfile(args.vision_ms, **ark_profile),
+        generation=LatencyProfile(args.generate_ms, **ark_profile),
+        oss=LatencyProfile(args.oss_ms, args.sigma, args.error_rate),
+        cdn=LatencyProfile(args.cdn_ms, args.sigma, args.error_rate),
+        cdn_payload_bytes=args.cdn_bytes,
+        seed=args.seed,
+    )
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench_pipeline_") as root, services:
+        print(f"Building {args.images} synthetic images ({args.image_size[0]}x{args.image_size[1]})...")
+        real_root, text_root = build_dataset(os.path.join(root, "dataset"), args.images, args.image_size)
+        keys_path = os.path.join(root, "keys.json")
+        write_keys_file(keys_path, services)
+        env = dict(os.environ, IMG_TEXT_IMG_KEYS=keys_path, ARK_API_KEY="mock-ark-key")
+
+        for scenario in scenarios:
+            for workers in worker_counts:
+                work_dir = os.path.join(root, f"run_{scenario}_{workers}")
+                spec = {
+                    "scenario": scenario,
+                    "work_dir": work_dir,
+                    "real_root": real_root,
+                    "text_root": text_root,
+                    "config": {
+                        "max_workers": workers,
+                        "ark_base_url": services.ark_base_url,
+                        "execution_engine": args.engine,
+                        "pipeline_mode": args.pipeline_mode,
+                        "image_transport": args.transport,
+                        "rate_limit_enabled": not args.no_rate_limit,
+                        "oss_cleanup_run_folder": args.oss_cleanup,
+                    },
+                }
+                spec_path = os.path.join(root, f"spec_{scenario}_{workers}.json")
+                with open(spec_path, "w", encoding="utf-8") as f:
+                    json.dump(spec, f)
+
+                before = services.snapshot()
+                # 每次运行使用新进程：模块级缓存/连接池互不影响，峰值 RSS 也只属于该次运行
+                proc = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--child", spec_path],
+                    env=env, cwd=os.path.dirname(BENCH_DIR), capture_output=True, text=True,
+                )
+                if args.verbose or proc.returncode != 0:
+                    sys.stdout.write(proc.stdout)
+                    sys.stderr.write(proc.stderr)
+                lines = [line for line in proc.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+                if proc.returncode != 0 or not lines:
+                    print(f"scenario={scenario} workers={workers}: run failed (exit code {proc.returncode})")
+                    continue
+                entry = json.loads(lines[-1][len(RESULT_PREFIX):])
+                entry.update(scenario=scenario, workers=workers, requests=_diff_counters(before, services.snapshot()))
+                results.append(entry)
+
+                print(
+                    f"scenario={scenario:<5} workers={workers:<3} files={entry['completed']:<5} "
+                    f"wall={entry['seconds']:.2f}s throughput={entry['files_per_second']:.1f} files/s "
+                    f"peak_rss={entry['peak_rss_mb']:.0f} MB"
+                )
+                for stage, stats in entry["stages"].items():
+                    print(
+                        f"    {stage:<18} n={stats['count']:<5} failed={stats['failed']:<4} "
+                        f"p50={_format_ms(stats['p50'])} ms p99={_format_ms(stats['p99'])} ms"
+                    )
+                served = ", ".join(
+                    f"{name} {counts['requests']} req/{counts['throttled']} 429/{counts['errors']} 5xx"
+                    for name, counts in entry["requests"].items()
+                    if counts["requests"]
+                )
+                print(f"    server: {served}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.baseline:
+        regressions = _check_regressions(results, args.baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
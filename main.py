@@ -9,17 +9,18 @@
 """
 
 
-import io
+import asyncio
+import contextlib
 import json
-import math
+import multiprocessing
 import os
-import tempfile
+import socket
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Any, Callable, Dict, Optional, Tuple
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Optional, Tuple
 
 import utils
-from utils.download_image import download_image
 
 try:
     from tqdm import tqdm  # type: ignore[import]
@@ -39,6 +40,7 @@ config: Dict[str, Any] = {
     "image_size_mode": "match_metadata",  # options: "fixed", "match_metadata"
     "ark_fixed_size": "2K",
     "ark_model_name": "doubao-seedream-4-0-250828",
+    "vision_model_name": "doubao-seed-1-6-flash-250828",
     "ark_base_url": "https://ark.cn-beijing.volces.com/api/v3",
     "ark_sequential_mode": "auto",
     "ark_sequential_max_images": 1,
@@ -54,7 +56,100 @@ config: Dict[str, Any] = {
         "and some low green plants in the distance."
     ),
     "max_workers": min(8, (os.cpu_count() or 4)),
+    # 超限图片解码/缩放同时占用内存的上限（MB），按图片头预估后预占，超出时排队等待，
+    # 以便为网络吞吐调大并发而不 OOM；"auto" 为容器（cgroup）或物理内存的一半，None 表示不限制
+    "prep_memory_budget_mb": "auto",
+    "prep_executor": "process",  # options: "process", "thread"（超限图片的解码/缩放/重编码在哪里执行）
+    "prep_process_workers": None,  # None 表示物理核心数
+    "caption_max_pixels": None,  # 例如 4_000_000：描述用图片缩放到该像素数以下，None 表示只按 Ark 上限缩放
     "enable_progress_bar": True,
+    "metrics_enabled": True,  # 记录各阶段耗时（缩放/上传/图片理解/元数据/生成/下载），每次运行结束时打印汇总
+    "metrics_export_path": None,  # 例如 ./data/cache/img_text_img.prom，None 表示不导出
+    "metrics_export_format": "prometheus",  # options: "prometheus"（textfile collector）, "jsonl"（每次运行追加一行）
+    "image_transport": "auto",  # options: "auto", "inline", "hosted"
+    "inline_image_max_bytes": 4 * 1024 * 1024,  # auto 模式下不超过该大小的图片以 base64 data URL 内联发送
+    "execution_engine": "threads",  # options: "threads", "asyncio", "resource_pools"（Images -> Text / Text -> Images）
+    # resource_pools 引擎与流式流水线把每个阶段拆成 缩放/上传/图片理解/生成/下载 子步骤，各自使用独立线程池，
+    # 慢速下载不会占用生成并发，反之亦然。None 表示按 max_workers 推算，例如
+    # {"prep": 4, "upload": 16, "inference": 32, "generate": 16, "download": 8}
+    "resource_workers": None,
+    "async_max_concurrency": 256,  # asyncio 引擎下同时在途的任务数
+    "async_upload_workers": 16,  # oss2 仅支持同步上传，asyncio 引擎下用于上传的线程数
+    "download_pool_size": None,  # 每个下载主机的 keep-alive 连接池大小，None 表示与下载并发数一致
+    # 按端点的自适应限流：rpm/tpm 为令牌桶配额，并发上限按 AIMD 随 429/延迟自动调整。
+    # 线程引擎下实际并发同时受 max_workers 限制，启用后可适当调大 max_workers。
+    # latency_target_seconds：单次调用超过该耗时视为服务端过载信号，按 0.9 倍收缩并发；
+    # 取值远高于正常耗时（图片理解通常几秒，生成十几秒），只对持续排队变慢作出反应。
+    # oss / download 的耗时主要取决于文件大小，不设延迟目标。
+    "rate_limit_enabled": True,
+    "rate_limits": {
+        "vision": {
+            "rpm": 1000,
+            "tpm": 800_000,
+            "initial_concurrency": 8,
+            "max_concurrency": 64,
+            "latency_target_seconds": 30,
+        },
+        "image_generation": {
+            "rpm": 500,
+            "initial_concurrency": 4,
+            "max_concurrency": 32,
+            "latency_target_seconds": 90,
+        },
+        "oss": {"initial_concurrency": 16, "max_concurrency": 128},
+        "download": {"initial_concurrency": 16, "max_concurrency": 128},
+    },
+    "vision_estimated_tokens": 1500,  # 单次图片理解请求的预估 token 数，用于 TPM 预扣
+    "job_ledger_enabled": True,  # 用 SQLite 记录各阶段任务状态，替代逐文件的存在性检查，中断后可续跑
+    "job_ledger_path": "./data/cache/jobs.sqlite3",  # 多节点时每个节点使用 jobs.<node_id>.sqlite3
+    "metadata_store_path": None,  # None 表示 <meta_path>/metadata.jsonl
+    "metadata_export_per_image_json": False,  # 额外逐图写出 <meta_path>/**/<name>.json（旧格式）
+    "metadata_export_index_json": False,  # 额外写出 <meta_path>/all_metadata.json
+    "metadata_refresh_seconds": 30,  # 多节点时查找未命中最多每隔多少秒重新读取其他节点的分片，None 表示只在启动时读取
+    "dataset_index_dir": "./data/cache",  # 目录扫描结果缓存位置，用于检测新增/修改/删除的文件；None 表示不缓存
+    # 多节点共享同一 data/ 目录：按相对路径哈希静态分片，可选租约认领以便空闲节点接手其他分片的任务。
+    # 多节点时每个节点只写自己的元数据分片 <metadata>.part-<node_id>.jsonl，全部结束后用 action 7 合并；
+    # 任务账本（SQLite WAL）不能跨主机共享，多节点时自动按节点拆分为 <job_ledger_path 主干>.<node_id>.sqlite3。
+    "shard_count": 1,
+    "shard_index": 0,
+    "node_id": None,  # None 表示主机名（分片时追加 -s<shard_index>）
+    "lease_mode": None,  # options: None, "sqlite", "lockfile"
+    "lease_path": None,  # None 表示 ./data/cache/leases.sqlite3 或 ./data/cache/leases/（需位于共享存储）
+    "lease_ttl_seconds": 900,  # 节点崩溃后其租约过期、可被其他节点接手的时间；运行中的任务每 ttl/3 自动续期
+    "lease_steal": True,  # 租约模式下处理完本分片后继续认领其他分片中尚未被认领的任务
+    "watch_debounce_seconds": 2.0,  # action 8：文件大小/修改时间保持不变这么久才认为写入完成
+    "watch_poll_interval_seconds": 5.0,  # 未安装 inotify_simple 时的轮询间隔
+    "watch_rescan_interval_seconds": 300.0,  # inotify 模式下的兜底全量扫描间隔
+    "watch_use_inotify": True,
+    # 任务派发顺序：lpt 按预估耗时（源图大小/像素数、生成尺寸）从大到小派发，避免大任务落在最后拖长收尾时间
+    "schedule_policy": "lpt",  # options: "lpt", "fifo"（目录遍历顺序）
+    "schedule_priority_paths": [],  # 例如 ["urgent", "2024/05"]：这些子目录（相对数据集根目录）中的任务最先派发
+    "pipeline_mode": "staged",  # options: "staged", "streaming"（action 5 的执行方式）
+    "stream_queue_size": 64,
+    "stream_stage_workers": None,  # 流式流水线中覆盖 resource_workers，例如 {"metadata": 2, "inference": 8}
+    "caption_cache_enabled": True,  # 按 (图片内容哈希, 提示词, 模型, 语言) 缓存描述结果，命中时不上传也不调用模型
+    "caption_cache_path": "./data/cache/caption_cache.json",
+    "caption_cache_max_age_days": 90,
+    "caption_cache_max_entries": 500_000,
+    "caption_cache_max_total_bytes": None,
+    "near_duplicate_dedup": False,  # 描述前按感知哈希聚类近似重复图片，每组只描述一张并复用其文本
+    "near_duplicate_max_distance": 4,  # 64 位感知哈希的最大汉明距离
+    "retry_backoff_seconds": 5.0,  # auto_retry 中单个样本的初始退避时间，按重试次数指数增长
+    "retry_backoff_max_seconds": 300.0,
+    # 不小于该大小（MB）的上传改为分片并行上传（每个文件 oss_multipart_threads 个连接），None 表示始终单次 PUT
+    "oss_multipart_threshold_mb": 8,
+    "oss_multipart_part_size_mb": 2,
+    "oss_multipart_threads": 4,
+    "oss_checkpoint_dir": "./data/cache/oss_checkpoints",  # 分片上传断点记录（按内容哈希），中断后任一次运行上传相同内容时续传
+    "oss_checkpoint_max_age_days": 7,  # 超过该天数未续传的分片上传会被取消，并删除其断点记录
+    "oss_connection_pool_size": None,  # 所有上传共享的 OSS 连接池大小，None 表示按上传线程数 * oss_multipart_threads
+    # 描述完成后用批量删除清理本次运行上传的图片（<start_time>/ 文件夹）；上传缓存中对应的条目会在下次查询时失效
+    "oss_cleanup_run_folder": False,
+    "upload_cache_enabled": True,
+    "upload_cache_path": "./data/cache/upload_cache.json",  # JSON Lines 追加日志（PersistentCache），每次刷新只写变更的条目
+    "upload_cache_max_age_days": 30,  # OSS 生命周期规则清理对象前应过期
+    "upload_cache_max_entries": 200_000,
+    "upload_cache_max_total_bytes": None,  # 例如 50 * 1024**3，None 表示不限制
 }
 
 SUPPORTED_IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".webp")
@@ -64,6 +159,19 @@ ARK_MIN_LONG_SIDE = 1280
 ARK_MIN_SHORT_SIDE = 720
 ARK_MAX_SIDE = 4096
 _THREAD_LOCAL = threading.local()
+_SHARED_LOCK = threading.Lock()
+_upload_cache = None
+_caption_cache = None
+_rate_limit_controller = None
+_job_ledger = None
+_metadata_store = None
+_prep_pool = None
+_image_host = None
+_memory_budget = None
+_metrics = None
+_lease_coordinator = None
+_dataset_snapshots: Dict[Tuple[str, Tuple[str, ...]], Any] = {}
+_stale_keys: Dict[str, set] = {}
 
 
 class _DummyProgress:
@@ -84,18 +192,497 @@ class _DummyProgress:
         return None
 
 
+def _get_upload_cache():
+    global _upload_cache
+    if not config.get("upload_cache_enabled", False):
+        return None
+    with _SHARED_LOCK:
+        if _upload_cache is None:
+            max_age_days = config.get("upload_cache_max_age_days")
+            _upload_cache = utils.PersistentCache(
+                config["upload_cache_path"],
+                max_entries=config.get("upload_cache_max_entries"),
+                max_total_bytes=config.get("upload_cache_max_total_bytes"),
+                max_age_seconds=max_age_days * 86400 if max_age_days else None,
+            )
+        return _upload_cache
+
+
+def _get_rate_limit_controller():
+    global _rate_limit_controller
+    with _SHARED_LOCK:
+        if _rate_limit_controller is None:
+            endpoints = config.get("rate_limits") if config.get("rate_limit_enabled", False) else None
+            _rate_limit_controller = utils.RateLimitController(endpoints)
+        return _rate_limit_controller
+
+
+def _get_rate_limiter(endpoint: str):
+    return _get_rate_limit_controller().get(endpoint)
+
+
+def _get_metrics():
+    global _metrics
+    with _SHARED_LOCK:
+        if _metrics is None:
+            _metrics = utils.MetricsRegistry(enabled=config.get("metrics_enabled", True))
+        return _metrics
+
+
+def _image_to_text_generator_kwargs() -> Dict[str, Any]:
+    return dict(
+        base_url=config["ark_base_url"],
+        model_name=config["vision_model_name"],
+        rate_limiter=_get_rate_limiter("vision"),
+        estimated_tokens=config.get("vision_estimated_tokens", 0),
+    )
+
+
+def _get_job_ledger():
+    global _job_ledger
+    if not config.get("job_ledger_enabled", False):
+        return None
+    with _SHARED_LOCK:
+        if _job_ledger is None:
+            ledger_path = config["job_ledger_path"]
+            if _multi_node():
+                # WAL 依赖共享内存，共享文件系统上的多个主机不能同时打开同一个账本；
+                # 其他节点完成的任务在本节点账本中未登记，首次遇到时按输出文件是否存在登记
+                stem, ext = os.path.splitext(ledger_path)
+                safe_node = "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in _node_id())
+                ledger_path = f"{stem}.{safe_node}{ext or '.sqlite3'}"
+            os.makedirs(os.path.dirname(os.path.abspath(ledger_path)), exist_ok=True)
+            _job_ledger = utils.JobLedger(ledger_path)
+        return _job_ledger
+
+
+def _job_key(path: str, base_path: str) -> str:
+    return os.path.splitext(os.path.relpath(path, base_path))[0].replace(os.sep, "/")
+
+
+def _file_fingerprint(path: str) -> str:
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _text_content_hash(text_content: str) -> str:
+    """图片生成任务的输入指纹：去除首尾空白后的提示词内容哈希。"""
+    return utils.persistent_cache.hash_bytes(text_content.strip().encode("utf-8"))
+
+
+def _node_id() -> str:
+    if config.get("node_id"):
+        return str(config["node_id"])
+    if int(config.get("shard_count", 1)) > 1:
+        return f"{socket.gethostname()}-s{int(config.get('shard_index', 0))}"
+    return socket.gethostname()
+
+
+def _multi_node() -> bool:
+    return int(config.get("shard_count", 1)) > 1 or bool(config.get("lease_mode"))
+
+
+def _get_lease_coordinator():
+    global _lease_coordinator
+    mode = config.get("lease_mode")
+    if not mode:
+        return None
+    with _SHARED_LOCK:
+        if _lease_coordinator is None:
+            default_path = "./data/cache/leases.sqlite3" if mode == "sqlite" else "./data/cache/leases"
+            # 同一主机上可能有多个进程，租约持有者需精确到进程
+            _lease_coordinator = utils.work_lease.create_lease_coordinator(
+                mode,
+                config.get("lease_path") or default_path,
+                f"{_node_id()}:{os.getpid()}",
+                float(config.get("lease_ttl_seconds", 900)),
+            )
+        return _lease_coordinator
+
+
+def _order_by_shard(candidates):
+    """
+    只保留本节点分片内的 (key, task)；租约模式且允许接手时，其他分片的任务排在本分片之后，
+    由租约保证同一任务只被一个节点处理。
+    """
+    shard_count = int(config.get("shard_count", 1))
+    if shard_count <= 1:
+        return list(candidates)
+    shard_index = int(config.get("shard_index", 0))
+    own, others = [], []
+    for key, task in candidates:
+        (own if utils.work_lease.shard_of(key, shard_count) == shard_index else others).append((key, task))
+    if _get_lease_coordinator() is not None and config.get("lease_steal", True):
+        return own + others
+    return own
+
+
+@contextlib.contextmanager
+def _track_job(stage: str, key: str, input_hash: Optional[str] = None):
+    """
+    在任务账本中记录任务状态；启用租约时先认领任务，
+    被其他节点持有时抛出 LeaseUnavailable，调用方应跳过该任务。
+    """
+    leases = _get_lease_coordinator()
+    if leases is not None and not leases.try_claim(stage, key):
+        raise utils.work_lease.LeaseUnavailable(f"{stage} job {key} is claimed by another node")
+    ledger = _get_job_ledger()
+    try:
+        with ledger.track(stage, key, input_hash) if ledger is not None else contextlib.nullcontext():
+            yield
+    except BaseException:
+        if leases is not None:
+            leases.release(stage, key, done=False)
+        raise
+    if leases is not None:
+        leases.release(stage, key, done=True)
+
+
+@contextlib.asynccontextmanager
+async def _track_job_async(stage: str, key: str, input_hash: Optional[str] = None):
+    """
+    _track_job 的 asyncio 版本：租约认领、账本的 SQLite 写入与租约释放都放到线程中执行，
+    不在事件循环上阻塞。
+    """
+    leases = _get_lease_coordinator()
+    if leases is not None and not await asyncio.to_thread(leases.try_claim, stage, key):
+        raise utils.work_lease.LeaseUnavailable(f"{stage} job {key} is claimed by another node")
+    ledger = _get_job_ledger()
+    try:
+        if ledger is not None:
+            await asyncio.to_thread(ledger.mark_running, stage, key, input_hash)
+        try:
+            yield
+        except Exception as exc:
+            if ledger is not None:
+                await asyncio.to_thread(ledger.mark_finished, stage, key, str(exc) or type(exc).__name__)
+            raise
+        if ledger is not None:
+            await asyncio.to_thread(ledger.mark_finished, stage, key)
+    except BaseException:
+        if leases is not None:
+            await asyncio.to_thread(leases.release, stage, key, done=False)
+        raise
+    if leases is not None:
+        await asyncio.to_thread(leases.release, stage, key, done=True)
+
+
+def _begin_split_job(stage: str, key: str, input_hash: Optional[str] = None) -> bool:
+    """
+    _track_job 的分步版本：任务跨越多个线程池的子步骤时，先认领租约并标记为运行中，
+    由 _end_split_job 在最后一步完成或任一步失败时结束。被其他节点持有时返回 False。
+    """
+    leases = _get_lease_coordinator()
+    if leases is not None and not leases.try_claim(stage, key):
+        return False
+    ledger = _get_job_ledger()
+    if ledger is not None:
+        ledger.mark_running(stage, key, input_hash)
+    return True
+
+
+def _end_split_job(stage: str, key: str, error: Optional[str] = None) -> None:
+    ledger = _get_job_ledger()
+    if ledger is not None:
+        ledger.mark_finished(stage, key, error=error)
+    leases = _get_lease_coordinator()
+    if leases is not None:
+        leases.release(stage, key, done=error is None)
+
+
+@contextlib.contextmanager
+def _split_job_step(stage: str, key: str):
+    """子步骤失败时结束该任务（账本记为失败、释放租约）后继续抛出。"""
+    try:
+        yield
+    except Exception as exc:
+        _end_split_job(stage, key, error=str(exc))
+        raise
+
+
+def _get_metadata_store():
+    global _metadata_store
+    with _SHARED_LOCK:
+        if _metadata_store is None:
+            store_path = _metadata_store_base_path()
+            if _multi_node():
+                # 每个节点只追加写自己的分片，合并后的主文件与其他节点的分片只读加载；
+                # 查找未命中时按 metadata_refresh_seconds 增量读取其他节点之后写入的记录
+                part_path = utils.metadata_store.part_path(store_path, _node_id())
+                _metadata_store = utils.MetadataStore(
+                    part_path,
+                    read_paths=lambda: [store_path] + utils.metadata_store.list_part_paths(store_path),
+                    refresh_interval=config.get("metadata_refresh_seconds", 30),
+                )
+            else:
+                _metadata_store = utils.MetadataStore(store_path)
+        return _metadata_store
+
+
+def _metadata_store_base_path() -> str:
+    return config.get("metadata_store_path") or os.path.join(config["meta_path"], "metadata.jsonl")
+
+
+def merge_metadata_parts():
+    """把各节点写出的元数据分片合并进主元数据文件（需在所有节点结束后执行）。"""
+    global _metadata_store
+    store_path = _metadata_store_base_path()
+    parts = utils.metadata_store.list_part_paths(store_path)
+    if not parts:
+        print(f"No metadata parts found next to {store_path}.")
+        return 0
+    with _SHARED_LOCK:
+        if _metadata_store is not None:
+            _metadata_store.close()
+            _metadata_store = None
+    count = utils.metadata_store.merge_parts(store_path)
+    print(f"Merged {len(parts)} metadata part(s) into {store_path} ({count} items).")
+    if config.get("metadata_export_index_json", False):
+        index_path = os.path.join(config["meta_path"], "all_metadata.json")
+        store = utils.MetadataStore(store_path)
+        try:
+            store.export_json(index_path, key_suffix=".json")
+        finally:
+            store.close()
+        print(f"Metadata index written to {index_path}.")
+    return count
+
+
+def _dataset_index_cache_path(root: str) -> Optional[str]:
+    index_dir = config.get("dataset_index_dir")
+    if not index_dir:
+        return None
+    root_hash = utils.persistent_cache.hash_bytes(os.path.abspath(root).encode("utf-8"))[:16]
+    return os.path.join(index_dir, f"index_{root_hash}.json")
+
+
+def _scan_dataset(root: str, extensions, downstream_stages=(), reuse: bool = False, content_hash=None):
+    """
+    用共享的 DatasetIndexer 扫描目录，并使发生变化的源文件在下游阶段的输出失效。
+
+    reuse=True 时同一进程内复用上一次扫描结果（用于流水线不会修改的源图片目录）。
+    content_hash(absolute_path) 给出时，只有内容哈希与账本中下游任务记录的 input_hash 不同的文件
+    才会使下游失效：流水线自己重写但内容未变（或下游已用新内容完成）的文件不会被重复处理。
+    """
+    snapshot_key = (os.path.abspath(root), tuple(extensions))
+    with _SHARED_LOCK:
+        if reuse and snapshot_key in _dataset_snapshots:
+            return _dataset_snapshots[snapshot_key]
+
+    indexer = utils.DatasetIndexer(root, extensions, cache_path=_dataset_index_cache_path(root))
+    snapshot = indexer.scan()
+    if snapshot.changed or snapshot.deleted:
+        print(
+            f"Dataset changes under {root}: {len(snapshot.added)} added, "
+            f"{len(snapshot.changed)} changed, {len(snapshot.deleted)} deleted."
+        )
+
+    changed_keys = [os.path.splitext(path)[0] for path in snapshot.changed]
+    if changed_keys:
+        ledger = _get_job_ledger()
+        for stage in downstream_stages:
+            if ledger is None:
+                _stale_keys.setdefault(stage, set()).update(changed_keys)
+                continue
+            stale_keys = changed_keys
+            if content_hash is not None:
+                recorded = ledger.input_hashes(stage)
+                stale_keys = []
+                for path in snapshot.changed:
+                    key = os.path.splitext(path)[0]
+                    current = _content_hash_or_none(content_hash, snapshot.absolute_path(path))
+                    if current is None or recorded.get(key) != current:
+                        stale_keys.append(key)
+                if len(stale_keys) < len(changed_keys):
+                    print(f"{len(changed_keys) - len(stale_keys)} rewritten file(s) under {root} are unchanged for {stage}.")
+            ledger.reset(stage, stale_keys)
+
+    with _SHARED_LOCK:
+        _dataset_snapshots[snapshot_key] = snapshot
+    return snapshot
+
+
+def _content_hash_or_none(content_hash, path: str) -> Optional[str]:
+    try:
+        return content_hash(path)
+    except OSError:
+        return None
+
+
+def _read_text_file(path: str) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def _text_file_hash(path: str) -> str:
+    return _text_content_hash(_read_text_file(path))
+
+
+def _priority_rank(key: str) -> int:
+    """key 位于 schedule_priority_paths 中第几个子目录下；不在其中时排在所有优先目录之后。"""
+    priority_paths = config.get("schedule_priority_paths") or []
+    for rank, prefix in enumerate(priority_paths):
+        prefix = prefix.replace(os.sep, "/").strip("/")
+        if not prefix or key == prefix or key.startswith(prefix + "/"):
+            return rank
+    return len(priority_paths)
+
+
+def _schedule_tasks(candidates, estimate_cost=None):
+    """
+    确定 (key, task) 的派发顺序：优先目录在前；多节点时本分片在其他分片之前；
+    同一组内 lpt 策略按 estimate_cost(key, task) 从大到小排列（最长处理时间优先），
+    线程池按提交顺序执行，耗时最长的任务因此不会在最后才开始。
+    """
+    candidates = list(candidates)
+    lpt = config.get("schedule_policy", "lpt") == "lpt" and estimate_cost is not None
+    if not lpt and not config.get("schedule_priority_paths"):
+        return [task for _key, task in candidates]
+
+    shard_count = int(config.get("shard_count", 1))
+    shard_index = int(config.get("shard_index", 0))
+
+    def sort_key(candidate):
+        key, task = candidate
+        shard_rank = 0
+        if shard_count > 1 and utils.work_lease.shard_of(key, shard_count) != shard_index:
+            shard_rank = 1
+        return _priority_rank(key), shard_rank, -estimate_cost(key, task) if lpt else 0
+
+    # sorted 是稳定排序，预估耗时相同的任务保持目录遍历顺序
+    return [task for _key, task in sorted(candidates, key=sort_key)]
+
+
+def _existing_output_keys(root: str, extensions) -> set:
+    """
+    一次目录遍历得到输出目录中已有文件对应的 key（去掉扩展名；prefix_output_images 加上的 F_ 前缀
+    同时以原名登记），用于发现账本中已完成但输出被删除的任务。
+    """
+    if not os.path.isdir(root):
+        return set()
+    keys = set()
+    for relative_file in utils.DatasetIndexer(root, extensions).scan().paths():
+        key = os.path.splitext(relative_file)[0]
+        keys.add(key)
+        directory, _, name = key.rpartition("/")
+        if name.startswith("F_"):
+            keys.add(f"{directory}/{name[2:]}" if directory else name[2:])
+    return keys
+
+
+def _filter_pending_tasks(
+    stage: str, candidates, override: bool, output_exists, estimate_cost=None, existing_outputs=None
+):
+    """
+    从 (key, task) 候选中筛选待处理任务，并按 _schedule_tasks 排好派发顺序。
+
+    启用任务账本时，已登记的任务直接按账本状态判断，无需逐个检查输出文件；
+    未登记的任务（首次运行或新增文件）只检查一次输出是否存在并写入账本。
+    源文件发生变化的任务即使已有输出也会重新处理。
+    existing_outputs 为输出目录扫描得到的 key 集合时，账本中已完成但输出已被删除的任务重新排队。
+    """
+    candidates = _order_by_shard(candidates)
+    if override:
+        return _schedule_tasks(candidates, estimate_cost)
+    ledger = _get_job_ledger()
+    if ledger is None:
+        stale = _stale_keys.pop(stage, set())
+        return _schedule_tasks(
+            [(key, task) for key, task in candidates if key in stale or not output_exists(task)], estimate_cost
+        )
+
+    statuses = ledger.statuses(stage)
+    pending = []
+    new_pending_keys = []
+    new_done_keys = []
+    missing_keys = []
+    for key, task in candidates:
+        status = statuses.get(key)
+        if status is None:
+            if output_exists(task):
+                new_done_keys.append(key)
+                continue
+            new_pending_keys.append(key)
+        elif status == utils.job_ledger.STATUS_DONE:
+            if existing_outputs is None or key in existing_outputs:
+                continue
+            missing_keys.append(key)
+        pending.append((key, task))
+    ledger.register(stage, new_pending_keys)
+    ledger.register(stage, new_done_keys, status=utils.job_ledger.STATUS_DONE)
+    if missing_keys:
+        print(f"{len(missing_keys)} completed {stage} output(s) are missing on disk and will be regenerated.")
+        ledger.reset(stage, missing_keys)
+    return _schedule_tasks(pending, estimate_cost)
+
+
+def _get_caption_cache():
+    global _caption_cache
+    if not config.get("caption_cache_enabled", False):
+        return None
+    with _SHARED_LOCK:
+        if _caption_cache is None:
+            max_age_days = config.get("caption_cache_max_age_days")
+            _caption_cache = utils.PersistentCache(
+                config["caption_cache_path"],
+                max_entries=config.get("caption_cache_max_entries"),
+                max_total_bytes=config.get("caption_cache_max_total_bytes"),
+                max_age_seconds=max_age_days * 86400 if max_age_days else None,
+            )
+        return _caption_cache
+
+
+def _image_host_kwargs() -> Dict[str, Any]:
+    megabyte = 1024 * 1024
+    threshold = config.get("oss_multipart_threshold_mb")
+    multipart_threads = max(1, int(config.get("oss_multipart_threads", 4)))
+    pool_size = config.get("oss_connection_pool_size")
+    if not pool_size:
+        # 所有上传线程（线程引擎/resource_pools/asyncio）同时进行分片上传时所需的连接数，连接按需建立
+        upload_workers = max(
+            int(config.get("max_workers", 1)),
+            _resource_workers()["upload"],
+            int(config.get("async_upload_workers", 16)),
+        )
+        pool_size = upload_workers * multipart_threads
+    return {
+        "upload_cache": _get_upload_cache(),
+        "rate_limiter": _get_rate_limiter("oss"),
+        "multipart_threshold": None if threshold is None else int(float(threshold) * megabyte),
+        "multipart_part_size": int(float(config.get("oss_multipart_part_size_mb", 2)) * megabyte),
+        "multipart_threads": multipart_threads,
+        "checkpoint_dir": config.get("oss_checkpoint_dir"),
+        "checkpoint_max_age_seconds": float(config.get("oss_checkpoint_max_age_days", 7)) * 86400,
+        "pool_size": int(pool_size),
+    }
+
+
 def _get_image_host():
-    host = getattr(_THREAD_LOCAL, "image_host", None)
-    if host is None:
-        host = utils.AliyunOSSImageHost()
-        _THREAD_LOCAL.image_host = host
-    return host
+    """所有线程与 asyncio 引擎共享一个 AliyunOSSImageHost（及其连接池），本次运行的上传都位于同一 start_time 文件夹。"""
+    global _image_host
+    if _image_host is None:
+        kwargs = _image_host_kwargs()
+        with _SHARED_LOCK:
+            if _image_host is None:
+                _image_host = utils.AliyunOSSImageHost(**kwargs)
+    return _image_host
+
+
+def _cleanup_uploaded_images() -> None:
+    """oss_cleanup_run_folder 启用时，用批量删除清理本次运行上传到 start_time 文件夹的图片。"""
+    if not config.get("oss_cleanup_run_folder", False) or _image_host is None:
+        return
+    try:
+        deleted = _image_host.delete_folder()
+        print(f"Deleted {deleted} uploaded image(s) from OSS folder {_image_host.start_time}/.")
+    except Exception as exc:
+        print(f"Failed to clean up OSS folder {_image_host.start_time}/: {exc}")
 
 
 def _get_image_to_text_generator():
     generator = getattr(_THREAD_LOCAL, "image_to_text_generator", None)
     if generator is None:
-        generator = utils.ImageToTextGenerator()
+        generator = utils.ImageToTextGenerator(**_image_to_text_generator_kwargs())
         _THREAD_LOCAL.image_to_text_generator = generator
     return generator
 
@@ -112,23 +699,73 @@ def _get_image_to_text_prompt() -> str:
     return config.get("text_prompt", zh_default)
 
 
+def _text_to_image_generator_kwargs() -> Dict[str, Any]:
+    return dict(
+        base_url=config["ark_base_url"],
+        model_name=config["ark_model_name"],
+        default_size=config.get("ark_fixed_size") or f'{config["width"]}x{config["height"]}',
+        sequential_mode=config.get("ark_sequential_mode", "auto"),
+        sequential_max_images=config.get("ark_sequential_max_images", 1),
+        watermark=config.get("ark_watermark", False),
+        rate_limiter=_get_rate_limiter("image_generation"),
+    )
+
+
 def _get_text_to_image_generator():
     generator = getattr(_THREAD_LOCAL, "text_to_image_generator", None)
     if generator is None:
-        generator = utils.TextToImageGenerator(
-            base_url=config["ark_base_url"],
-            model_name=config["ark_model_name"],
-            default_size=config.get("ark_fixed_size") or f'{config["width"]}x{config["height"]}',
-            sequential_mode=config.get("ark_sequential_mode", "auto"),
-            sequential_max_images=config.get("ark_sequential_max_images", 1),
-            watermark=config.get("ark_watermark", False),
-        )
+        generator = utils.TextToImageGenerator(**_text_to_image_generator_kwargs())
         _THREAD_LOCAL.text_to_image_generator = generator
     return generator
 
 
-def _normalize_relative_path(relative_path: str) -> str:
-    return "" if relative_path == "." else relative_path
+class _AsyncClients:
+    """asyncio 引擎在一次事件循环内共享的客户端，按需创建，结束时统一关闭。"""
+
+    def __init__(self):
+        self._image_host = None
+        self._image_to_text = None
+        self._text_to_image = None
+        self._http_session = None
+        self._http_session_created = False
+
+    @property
+    def image_host(self):
+        if self._image_host is None:
+            self._image_host = utils.AsyncAliyunOSSImageHost(
+                host=_get_image_host(), max_concurrency=config.get("async_upload_workers", 16)
+            )
+        return self._image_host
+
+    @property
+    def image_to_text(self):
+        if self._image_to_text is None:
+            self._image_to_text = utils.AsyncImageToTextGenerator(**_image_to_text_generator_kwargs())
+        return self._image_to_text
+
+    @property
+    def text_to_image(self):
+        if self._text_to_image is None:
+            self._text_to_image = utils.AsyncTextToImageGenerator(**_text_to_image_generator_kwargs())
+        return self._text_to_image
+
+    @property
+    def http_session(self):
+        if not self._http_session_created:
+            self._http_session = utils.download_image.create_async_download_session(
+                config.get("async_max_concurrency", 256)
+            )
+            self._http_session_created = True
+        return self._http_session
+
+    async def close(self):
+        for client in (self._image_host, self._image_to_text, self._text_to_image, self._http_session):
+            if client is None:
+                continue
+            try:
+                await client.close()
+            except Exception as exc:
+                print(f"Failed to close async client {type(client).__name__}: {exc}")
 
 
 def _normalize_description(description) -> str:
@@ -145,59 +782,81 @@ def _normalize_description(description) -> str:
     return "" if description is None else str(description)
 
 
-def _prepare_image_for_upload(image_path: str) -> Tuple[str, Optional[Callable[[], None]]]:
-    file_size = os.path.getsize(image_path)
-    try:
-        from PIL import Image  # type: ignore[import]
-    except ImportError:
-        if file_size > MAX_IMAGE_FILE_SIZE_BYTES:
-            print(
-                "Install Pillow to automatically downscale oversized images for text generation "
-                "(pip install pillow)."
+def _get_prep_pool():
+    global _prep_pool
+    with _SHARED_LOCK:
+        if _prep_pool is None:
+            workers = config.get("prep_process_workers") or utils.image_prep.physical_cpu_count()
+            # spawn 避免在已有大量线程的进程中 fork
+            _prep_pool = ProcessPoolExecutor(
+                max_workers=max(1, int(workers)), mp_context=multiprocessing.get_context("spawn")
             )
-        return image_path, None
-
-    with Image.open(image_path) as img:
-        width, height = img.size
-        total_pixels = width * height
-        needs_resize = total_pixels > MAX_IMAGE_TOTAL_PIXELS
-        needs_reencode = file_size > MAX_IMAGE_FILE_SIZE_BYTES
-
-        if not needs_resize and not needs_reencode:
-            return image_path, None
-
-        scale_factor = 1.0
-        if needs_resize:
-            scale_factor = math.sqrt(MAX_IMAGE_TOTAL_PIXELS / float(total_pixels))
-        new_width = max(1, int(width * min(1.0, scale_factor)))
-        new_height = max(1, int(height * min(1.0, scale_factor)))
-
-        resized = img.convert("RGB")
-        if new_width != width or new_height != height:
-            resample_filter = getattr(getattr(Image, "Resampling", Image), "LANCZOS", getattr(Image, "LANCZOS"))
-            resized = resized.resize((new_width, new_height), resample_filter)
-
-        buffer = io.BytesIO()
-        quality = 95
-        while True:
-            buffer.seek(0)
-            buffer.truncate(0)
-            resized.save(buffer, format="JPEG", optimize=True, quality=quality)
-            if buffer.tell() <= MAX_IMAGE_FILE_SIZE_BYTES or quality <= 50:
-                break
-            quality -= 5
-
-        fd, temp_path = tempfile.mkstemp(prefix="img2txt_", suffix=".jpg")
-        with os.fdopen(fd, "wb") as tmp_file:
-            tmp_file.write(buffer.getvalue())
-
-    def cleanup():
-        try:
-            os.remove(temp_path)
-        except FileNotFoundError:
-            pass
+        return _prep_pool
+
+
+def _shutdown_prep_pool() -> None:
+    """阶段结束时关闭 prep 进程池（下次使用时重新创建），其峰值 RSS 才会计入 RUSAGE_CHILDREN。"""
+    global _prep_pool
+    with _SHARED_LOCK:
+        pool, _prep_pool = _prep_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
 
-    return temp_path, cleanup
+def _get_memory_budget():
+    global _memory_budget
+    budget_mb = config.get("prep_memory_budget_mb", "auto")
+    if not budget_mb:
+        return None
+    with _SHARED_LOCK:
+        if _memory_budget is None:
+            if budget_mb == "auto":
+                limit = utils.memory_budget.detect_memory_limit()
+                if not limit:
+                    return None
+                budget_bytes = limit // 2
+            else:
+                budget_bytes = int(float(budget_mb) * 1024 * 1024)
+            _memory_budget = utils.memory_budget.MemoryBudget(budget_bytes)
+        return _memory_budget
+
+
+def _encode_image_for_upload(image_path: str) -> Optional[bytes]:
+    """
+    Downscale/re-encode an image that exceeds the Ark limits.
+
+    Returns the JPEG bytes, or None when the original file can be sent as is.
+    With prep_executor = "process" the CPU-heavy work runs in a process pool
+    so it does not hold the GIL shared with the network threads. Decoding
+    first reserves its estimated peak memory from the prep memory budget.
+    """
+    max_pixels = MAX_IMAGE_TOTAL_PIXELS
+    if config.get("caption_max_pixels"):
+        max_pixels = min(max_pixels, int(config["caption_max_pixels"]))
+    limits = (max_pixels, MAX_IMAGE_FILE_SIZE_BYTES)
+    # 无需处理的图片不计入 prep 耗时分布
+    if not utils.image_prep.needs_reencode(image_path, *limits):
+        return None
+    metrics = _get_metrics()
+    with metrics.span("prep") as span:
+        budget = _get_memory_budget()
+        reservation = 0
+        if budget is not None:
+            reservation = utils.image_prep.estimate_peak_bytes(image_path, *limits)
+            with metrics.span("memory_wait"):
+                budget.acquire(reservation)
+        try:
+            if config.get("prep_executor", "process") == "process":
+                encoded = _get_prep_pool().submit(
+                    utils.image_prep.encode_image_for_upload, image_path, *limits
+                ).result()
+            else:
+                encoded = utils.image_prep.encode_image_for_upload(image_path, *limits)
+        finally:
+            if budget is not None:
+                budget.release(reservation)
+        span.bytes = len(encoded)
+    return encoded
 
 
 def _record_image_metadata(image_path: str, meta_output_path: str) -> None:
@@ -208,23 +867,34 @@ def _record_image_metadata(image_path: str, meta_output_path: str) -> None:
         return
 
     try:
-        with Image.open(image_path) as img:
+        with _get_metrics().span("metadata"), Image.open(image_path) as img:
             width, height = img.size
     except Exception as exc:
         raise RuntimeError(f"Failed to read image metadata for {image_path}: {exc}") from exc
 
-    os.makedirs(os.path.dirname(meta_output_path), exist_ok=True)
     metadata = {"width": width, "height": height}
-    with open(meta_output_path, "w", encoding="utf-8") as meta_file:
-        json.dump(metadata, meta_file, ensure_ascii=False)
+    _get_metadata_store().put(_job_key(meta_output_path, config["meta_path"]), metadata)
+    if config.get("metadata_export_per_image_json", False):
+        os.makedirs(os.path.dirname(meta_output_path), exist_ok=True)
+        with open(meta_output_path, "w", encoding="utf-8") as meta_file:
+            json.dump(metadata, meta_file, ensure_ascii=False)
+
+
+def _metadata_exists(meta_path: str) -> bool:
+    return _job_key(meta_path, config["meta_path"]) in _get_metadata_store() or os.path.exists(meta_path)
 
 
 def _load_metadata_dimensions(meta_path: Optional[str]) -> Optional[Tuple[int, int]]:
-    if not meta_path or not os.path.exists(meta_path):
+    if not meta_path:
+        return None
+    metadata = _get_metadata_store().get(_job_key(meta_path, config["meta_path"]))
+    # 兼容旧版本逐图写出的 JSON 文件
+    if metadata is None and not os.path.exists(meta_path):
         return None
     try:
-        with open(meta_path, "r", encoding="utf-8") as meta_file:
-            metadata = json.load(meta_file)
+        if metadata is None:
+            with open(meta_path, "r", encoding="utf-8") as meta_file:
+                metadata = json.load(meta_file)
         width = int(metadata.get("width", 0))
         height = int(metadata.get("height", 0))
         if width > 0 and height > 0:
@@ -290,6 +960,47 @@ def _resolve_generation_size(meta_path: Optional[str]) -> str:
     return f"{width}x{height}"
 
 
+def _size_pixels(size: str) -> int:
+    """"2048x1536" 或 "2K" 形式的生成尺寸对应的像素数，无法解析时返回 0。"""
+    size = str(size).strip().lower()
+    try:
+        if size.endswith("k"):
+            side = int(float(size[:-1]) * 1024)
+            return side * side
+        width, height = size.split("x")
+        return int(width) * int(height)
+    except ValueError:
+        return 0
+
+
+def _estimate_caption_cost(key: str, task) -> float:
+    """描述任务的相对耗时：文件字节数（读取/上传）加解码像素数（缩放），元数据尚未生成时只看文件大小。"""
+    real_image_path, _text_path = task
+    try:
+        cost = float(os.path.getsize(real_image_path))
+    except OSError:
+        return 0.0
+    dimensions = _load_metadata_dimensions(os.path.join(config["meta_path"], *(key + ".json").split("/")))
+    if dimensions:
+        cost += dimensions[0] * dimensions[1]
+    return cost
+
+
+def _estimate_generation_cost(_key: str, task) -> float:
+    """生成任务的相对耗时：请求的输出像素数（与 _resolve_generation_size 一致，但不打印回退提示）。"""
+    _text_file_path, _image_path, meta_path = task
+    fallback_size = config.get("ark_fixed_size") or f'{config["width"]}x{config["height"]}'
+    if config.get("image_size_mode", "fixed") == "match_metadata":
+        dimensions = _load_metadata_dimensions(meta_path)
+        if dimensions:
+            try:
+                width, height = _normalize_metadata_dimensions(*dimensions)
+                return float(width * height)
+            except ValueError:
+                pass
+    return float(_size_pixels(fallback_size))
+
+
 def _get_progress_bar(total: int, desc: str):
     if config.get("enable_progress_bar", True) and tqdm is not None:
         return tqdm(total=total, desc=desc, unit="file")
@@ -316,6 +1027,107 @@ def _run_tasks_concurrently(tasks, worker, desc: str):
                     errors.append((identifier, message))
                 progress.update(1)
 
+    _report_errors(errors, desc)
+    return errors
+
+
+async def _run_tasks_async(tasks, worker, desc: str):
+    """
+    _run_tasks_concurrently 的 asyncio 版本：async_max_concurrency 个工作协程依次从 tasks 中取任务，
+    保持 _schedule_tasks 排好的派发顺序，同时存在的协程数与任务总数无关。
+    worker 为 ``async def worker(task, clients)``。
+    """
+    total = len(tasks)
+    concurrency = min(max(1, int(config.get("async_max_concurrency", 256))), max(1, total))
+    clients = _AsyncClients()
+    errors = []
+    remaining = iter(tasks)
+
+    async def run_worker(progress):
+        # 单线程事件循环中共享迭代器是安全的
+        for task in remaining:
+            try:
+                success, identifier, message = await worker(task, clients)
+            except Exception as exc:
+                success, identifier, message = False, task, str(exc)
+            if not success:
+                errors.append((identifier, message))
+            progress.update(1)
+
+    try:
+        with _get_progress_bar(total, desc) as progress:
+            await asyncio.gather(*(run_worker(progress) for _ in range(concurrency)))
+    finally:
+        await clients.close()
+
+    _report_errors(errors, desc)
+    return errors
+
+
+def _run_tasks(tasks, worker, async_worker, desc: str, pooled_runner=None):
+    engine = config.get("execution_engine", "threads")
+    if engine in ("asyncio", "resource_pools") and len(tasks) == 0:
+        print(f"No pending tasks for {desc}.")
+        return
+    if engine == "asyncio" and async_worker is not None:
+        return asyncio.run(_run_tasks_async(tasks, async_worker, desc))
+    if engine == "resource_pools" and pooled_runner is not None:
+        return pooled_runner(tasks, desc)
+    return _run_tasks_concurrently(tasks, worker, desc)
+
+
+def _report_cache(name: str, cache) -> None:
+    if cache is None:
+        return
+    cache.save()
+    stats = cache.stats()
+    print(f"{name}: {stats['hits']} hit(s), {stats['misses']} miss(es), {stats['entries']} entries.")
+
+
+def _report_metrics(desc: str) -> None:
+    """打印本进程累计的各阶段耗时，并按配置导出。"""
+    metrics = _get_metrics()
+    if not metrics.enabled:
+        return
+    metrics.report(desc)
+    export_path = config.get("metrics_export_path")
+    if not export_path:
+        return
+    try:
+        if config.get("metrics_export_format", "prometheus") == "jsonl":
+            metrics.write_jsonl(export_path, labels={"run": desc})
+        else:
+            metrics.write_prometheus(export_path)
+    except OSError as exc:
+        print(f"Failed to export metrics to {export_path}: {exc}")
+
+
+def _report_memory() -> None:
+    megabyte = 1024 * 1024
+    _shutdown_prep_pool()
+    peak = utils.memory_budget.peak_rss_bytes()
+    if peak["self"] is not None:
+        line = f"Peak RSS: {peak['self'] / megabyte:.0f} MB"
+        if peak["children"]:
+            line += f" (finished child processes: {peak['children'] / megabyte:.0f} MB)"
+        print(line)
+    if _memory_budget is not None:
+        stats = _memory_budget.stats()
+        print(
+            f"Prep memory budget: peak {stats['peak_bytes'] / megabyte:.0f} of {stats['limit_bytes'] / megabyte:.0f} MB "
+            f"reserved, {stats['waits']}/{stats['reservations']} decode(s) waited {stats['wait_seconds']:.1f}s."
+        )
+
+
+def _report_errors(errors, desc: str) -> None:
+    if config.get("rate_limit_enabled", False):
+        _get_rate_limit_controller().report()
+    _report_metrics(desc)
+    _report_memory()
+    leases = _get_lease_coordinator()
+    if leases is not None:
+        stats = leases.stats()
+        print(f"Leases ({_node_id()}): {stats['claimed']} claimed, {stats['skipped']} skipped (held by other nodes).")
     if errors:
         print(f"{len(errors)} task(s) failed during {desc}:")
         for identifier, message in errors:
@@ -323,45 +1135,163 @@ def _run_tasks_concurrently(tasks, worker, desc: str):
     else:
         print(f"All {desc} tasks completed successfully.")
 
-    return errors
 
+def _use_inline_image(payload_size: int) -> bool:
+    transport = config.get("image_transport", "auto")
+    if transport == "inline":
+        return True
+    if transport == "hosted":
+        return False
+    return payload_size <= int(config.get("inline_image_max_bytes", 0))
 
-def generate_text_from_image(image_path: str) -> str:
-    prepared_path, cleanup = _prepare_image_for_upload(image_path)
-    try:
-        image_host = _get_image_host()
-        image_url = image_host.upload_image(prepared_path, folder=True)
-        if not image_url:
-            raise RuntimeError(f"Failed to upload image: {image_path}")
-        image_to_text = _get_image_to_text_generator()
-        prompt = _get_image_to_text_prompt()
+
+def _prepare_caption_input(image_path: str):
+    """
+    本地准备（CPU）：缩放/编码图片并决定发送方式。
+
+    :return: (payload_size, data_url, encoded)；内联发送时 data_url 非空，
+             否则 encoded 为待上传的 JPEG 字节（None 表示上传原文件）
+    """
+    encoded = _encode_image_for_upload(image_path)
+    payload_size = len(encoded) if encoded is not None else os.path.getsize(image_path)
+    if not _use_inline_image(payload_size):
+        return payload_size, None, encoded
+    if encoded is None:
+        with open(image_path, "rb") as f:
+            return payload_size, utils.ImageToTextGenerator.to_data_url(f.read(), image_path), None
+    return payload_size, utils.ImageToTextGenerator.to_data_url(encoded, mime_type="image/jpeg"), None
+
+
+def _upload_caption_input(image_path: str, encoded: Optional[bytes], payload_size: int) -> str:
+    image_host = _get_image_host()
+    with _get_metrics().span("upload") as span:
+        span.bytes = payload_size
+        if encoded is None:
+            image_url = image_host.upload_image(image_path, folder=True)
+        else:
+            upload_name = os.path.splitext(os.path.basename(image_path))[0] + ".jpg"
+            image_url = image_host.upload_bytes(encoded, upload_name, folder=True)
+    if not image_url:
+        raise RuntimeError(f"Failed to upload image: {image_path}")
+    return image_url
+
+
+def _generate_text_from_image_uncached(image_path: str) -> str:
+    image_to_text = _get_image_to_text_generator()
+    prompt = _get_image_to_text_prompt()
+    payload_size, data_url, encoded = _prepare_caption_input(image_path)
+
+    metrics = _get_metrics()
+
+    if data_url is not None:
+        with metrics.span("vision") as span:
+            span.bytes = payload_size
+            return image_to_text.generate(data_url, prompt)
+
+    image_url = _upload_caption_input(image_path, encoded, payload_size)
+    with metrics.span("vision"):
         return image_to_text.generate(image_url, prompt)
-    finally:
-        if cleanup is not None:
-            cleanup()
+
+
+def _read_file_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def _generate_text_from_image_uncached_async(image_path: str, clients: _AsyncClients) -> str:
+    prompt = _get_image_to_text_prompt()
+    # 本地编码是 CPU 密集操作，放到线程中避免阻塞事件循环
+    encoded = await asyncio.to_thread(_encode_image_for_upload, image_path)
+    payload_size = len(encoded) if encoded is not None else os.path.getsize(image_path)
+
+    metrics = _get_metrics()
+
+    if _use_inline_image(payload_size):
+        if encoded is None:
+            raw = await asyncio.to_thread(_read_file_bytes, image_path)
+            data_url = utils.ImageToTextGenerator.to_data_url(raw, image_path)
+        else:
+            data_url = utils.ImageToTextGenerator.to_data_url(encoded, mime_type="image/jpeg")
+        with metrics.span("vision") as span:
+            span.bytes = payload_size
+            return await clients.image_to_text.generate(data_url, prompt)
+
+    with metrics.span("upload") as span:
+        span.bytes = payload_size
+        if encoded is None:
+            image_url = await clients.image_host.upload_image(image_path, folder=True)
+        else:
+            upload_name = os.path.splitext(os.path.basename(image_path))[0] + ".jpg"
+            image_url = await clients.image_host.upload_bytes(encoded, upload_name, folder=True)
+    if not image_url:
+        raise RuntimeError(f"Failed to upload image: {image_path}")
+    with metrics.span("vision"):
+        return await clients.image_to_text.generate(image_url, prompt)
+
+
+def _caption_cache_key(image_path: str) -> str:
+    parts = (
+        utils.persistent_cache.hash_file(image_path),
+        utils.persistent_cache.hash_bytes(_get_image_to_text_prompt().encode("utf-8")),
+        config.get("vision_model_name", ""),
+        config.get("text_prompt_language", "zh"),
+    )
+    return utils.persistent_cache.hash_bytes("\0".join(parts).encode("utf-8"))
+
+
+def _remember_caption(cache_key: str, description) -> str:
+    text = _normalize_description(description)
+    if text:
+        _get_caption_cache().set(cache_key, {"text": text, "size": len(text.encode("utf-8"))})
+    return text
+
+
+def generate_text_from_image(image_path: str) -> str:
+    caption_cache = _get_caption_cache()
+    if caption_cache is None:
+        return _generate_text_from_image_uncached(image_path)
+    cache_key = _caption_cache_key(image_path)
+    cached = caption_cache.get(cache_key)
+    if cached:
+        return cached["text"]
+    return _remember_caption(cache_key, _generate_text_from_image_uncached(image_path))
+
+
+async def generate_text_from_image_async(image_path: str, clients: _AsyncClients) -> str:
+    caption_cache = _get_caption_cache()
+    if caption_cache is None:
+        return await _generate_text_from_image_uncached_async(image_path, clients)
+    cache_key = await asyncio.to_thread(_caption_cache_key, image_path)
+    cached = caption_cache.get(cache_key)
+    if cached:
+        return cached["text"]
+    description = await _generate_text_from_image_uncached_async(image_path, clients)
+    # set 每 flush_every 次会追加写缓存日志，放到线程中执行
+    return await asyncio.to_thread(_remember_caption, cache_key, description)
 
 
 def _collect_metadata_tasks(base_real_path: str):
-    tasks = []
-    for root, _, files in os.walk(base_real_path):
-        for file in files:
-            if not file.lower().endswith(SUPPORTED_IMAGE_EXTENSIONS):
-                continue
-            real_image_path = os.path.join(root, file)
-            relative_path = _normalize_relative_path(os.path.relpath(root, base_real_path))
-            meta_dir = os.path.join(config["meta_path"], relative_path)
-            meta_filename = os.path.splitext(file)[0] + ".json"
-            meta_path = os.path.join(meta_dir, meta_filename)
-            if os.path.exists(meta_path) and not config["override_metadata"]:
-                continue
-            tasks.append((real_image_path, meta_path))
-    return tasks
+    snapshot = _scan_dataset(
+        base_real_path, SUPPORTED_IMAGE_EXTENSIONS, ("metadata", "text", "image"), reuse=True
+    )
+    candidates = []
+    for relative_file in snapshot.paths():
+        key = os.path.splitext(relative_file)[0]
+        real_image_path = snapshot.absolute_path(relative_file)
+        meta_path = os.path.join(config["meta_path"], *(key + ".json").split("/"))
+        candidates.append((key, (real_image_path, meta_path)))
+    return _filter_pending_tasks(
+        "metadata", candidates, config["override_metadata"], lambda task: _metadata_exists(task[1])
+    )
 
 
 def _process_metadata_task(task):
     real_image_path, meta_path = task
     try:
-        _record_image_metadata(real_image_path, meta_path)
+        with _track_job("metadata", _job_key(meta_path, config["meta_path"]), _file_fingerprint(real_image_path)):
+            _record_image_metadata(real_image_path, meta_path)
+        return True, meta_path, None
+    except utils.work_lease.LeaseUnavailable:
         return True, meta_path, None
     except Exception as exc:
         return False, real_image_path, str(exc)
@@ -373,31 +1303,19 @@ def _build_metadata_index():
         print(f"Metadata root directory does not exist: {meta_root}")
         return
 
-    index = {}
-    for root, _, files in os.walk(meta_root):
-        for file in files:
-            if not file.lower().endswith(".json"):
-                continue
-            if file == "all_metadata.json":
-                continue
-
-            meta_path = os.path.join(root, file)
-            try:
-                with open(meta_path, "r", encoding="utf-8") as meta_file:
-                    data = json.load(meta_file)
-            except Exception as exc:
-                print(f"Failed to include metadata file {meta_path} in index: {exc}")
-                continue
-
-            relative_meta_path = os.path.relpath(meta_path, meta_root)
-            relative_meta_path = _normalize_relative_path(relative_meta_path)
-            index[relative_meta_path] = data
+    store = _get_metadata_store()
+    store.compact()
+    if _multi_node():
+        print(f"Metadata part {store.path} written; run merge_metadata_parts once every node has finished.")
+        return
+    if not config.get("metadata_export_index_json", False):
+        print(f"Metadata store {store.path} holds {len(store)} items.")
+        return
 
     index_path = os.path.join(meta_root, "all_metadata.json")
     try:
-        with open(index_path, "w", encoding="utf-8") as index_file:
-            json.dump(index, index_file, ensure_ascii=False, indent=2)
-        print(f"Metadata index written to {index_path} ({len(index)} items).")
+        count = store.export_json(index_path, key_suffix=".json")
+        print(f"Metadata index written to {index_path} ({count} items).")
     except Exception as exc:
         print(f"Failed to write metadata index file {index_path}: {exc}")
 
@@ -414,70 +1332,155 @@ def generate_metadata_for_images(base_real_path: str):
 
 
 def _collect_image_tasks(base_real_path: str):
-    tasks = []
-    for root, _, files in os.walk(base_real_path):
-        for file in files:
-            if not file.lower().endswith(SUPPORTED_IMAGE_EXTENSIONS):
-                continue
-            real_image_path = os.path.join(root, file)
-            relative_path = _normalize_relative_path(os.path.relpath(root, base_real_path))
-            text_dir = os.path.join(config["text_image_path"], relative_path)
-            text_filename = os.path.splitext(file)[0] + ".txt"
-            text_path = os.path.join(text_dir, text_filename)
-            if os.path.exists(text_path) and not config["override_text_prompt"]:
-                continue
-            tasks.append((real_image_path, text_path))
-    return tasks
+    snapshot = _scan_dataset(
+        base_real_path, SUPPORTED_IMAGE_EXTENSIONS, ("metadata", "text", "image"), reuse=True
+    )
+    candidates = []
+    for relative_file in snapshot.paths():
+        key = os.path.splitext(relative_file)[0]
+        real_image_path = snapshot.absolute_path(relative_file)
+        text_path = os.path.join(config["text_image_path"], *(key + ".txt").split("/"))
+        candidates.append((key, (real_image_path, text_path)))
+    return _filter_pending_tasks(
+        "text",
+        candidates,
+        config["override_text_prompt"],
+        lambda task: os.path.exists(task[1]),
+        estimate_cost=_estimate_caption_cost,
+        existing_outputs=_existing_output_keys(config["text_image_path"], (".txt",)),
+    )
+
+
+def _write_text_output(text_path: str, description) -> None:
+    normalized_description = _normalize_description(description)
+    os.makedirs(os.path.dirname(text_path), exist_ok=True)
+    with open(text_path, "w", encoding="utf-8") as f:
+        f.write(normalized_description)
 
 
 def _process_image_to_text_task(task):
     real_image_path, text_path = task
     try:
-        description = generate_text_from_image(real_image_path)
-        normalized_description = _normalize_description(description)
-        os.makedirs(os.path.dirname(text_path), exist_ok=True)
-        with open(text_path, "w", encoding="utf-8") as f:
-            f.write(normalized_description)
+        with _track_job("text", _job_key(text_path, config["text_image_path"]), _file_fingerprint(real_image_path)):
+            description = generate_text_from_image(real_image_path)
+            _write_text_output(text_path, description)
+        return True, text_path, None
+    except utils.work_lease.LeaseUnavailable:
         return True, text_path, None
     except Exception as exc:
         return False, text_path, str(exc)
 
 
+async def _process_image_to_text_task_async(task, clients):
+    real_image_path, text_path = task
+    try:
+        fingerprint = await asyncio.to_thread(_file_fingerprint, real_image_path)
+        async with _track_job_async("text", _job_key(text_path, config["text_image_path"]), fingerprint):
+            description = await generate_text_from_image_async(real_image_path, clients)
+            await asyncio.to_thread(_write_text_output, text_path, description)
+        return True, text_path, None
+    except utils.work_lease.LeaseUnavailable:
+        return True, text_path, None
+    except Exception as exc:
+        return False, text_path, str(exc)
+
+
+def _group_near_duplicate_tasks(tasks):
+    """
+    感知哈希预处理：把近似重复的图片分组，只保留每组的代表图片进入描述阶段。
+
+    :return: (代表任务列表, {代表任务: [同组其他任务]})
+    """
+    image_paths = [real_image_path for real_image_path, _text_path in tasks]
+    chunk_size = 256
+    chunks = [image_paths[idx:idx + chunk_size] for idx in range(0, len(image_paths), chunk_size)]
+    if config.get("prep_executor", "process") == "process":
+        hashed_chunks = list(_get_prep_pool().map(utils.perceptual_hash.phash_batch, chunks))
+    else:
+        hashed_chunks = [utils.perceptual_hash.phash_batch(chunk) for chunk in chunks]
+    hashes = [value for chunk in hashed_chunks for value in chunk]
+
+    groups = utils.perceptual_hash.cluster_near_duplicates(
+        list(zip(tasks, hashes)), int(config.get("near_duplicate_max_distance", 4))
+    )
+    representatives = list(groups)
+    print(
+        f"Near-duplicate pre-pass: {len(tasks)} image(s) -> {len(representatives)} to caption, "
+        f"{len(tasks) - len(representatives)} reuse a representative's text."
+    )
+    return representatives, {rep: members for rep, members in groups.items() if members}
+
+
+def _propagate_duplicate_captions(duplicate_groups, errors):
+    failed_text_paths = {identifier for identifier, _message in errors}
+    member_errors = []
+    for (rep_image_path, rep_text_path), members in duplicate_groups.items():
+        for real_image_path, text_path in members:
+            if rep_text_path in failed_text_paths:
+                member_errors.append((text_path, f"representative {rep_image_path} failed"))
+                continue
+            try:
+                key = _job_key(text_path, config["text_image_path"])
+                with _track_job("text", key, _file_fingerprint(real_image_path)):
+                    with open(rep_text_path, "r", encoding="utf-8") as f:
+                        _write_text_output(text_path, f.read())
+            except utils.work_lease.LeaseUnavailable:
+                continue
+            except Exception as exc:
+                member_errors.append((text_path, str(exc)))
+    if member_errors:
+        _report_errors(member_errors, "Near-duplicate text reuse")
+    return member_errors
+
+
 def generate_text_from_images(base_real_path: str):
     if not os.path.isdir(base_real_path):
         print(f"Directory does not exist: {base_real_path}")
         return []
     tasks = _collect_image_tasks(base_real_path)
     print(f"Images requiring text prompts: {len(tasks)}")
-    errors = _run_tasks_concurrently(tasks, _process_image_to_text_task, "Images -> Text")
+    duplicate_groups = {}
+    if config.get("near_duplicate_dedup", False) and len(tasks) > 1:
+        tasks, duplicate_groups = _group_near_duplicate_tasks(tasks)
+    errors = _run_tasks(
+        tasks,
+        _process_image_to_text_task,
+        _process_image_to_text_task_async,
+        "Images -> Text",
+        pooled_runner=_run_caption_tasks_pooled,
+    )
+    if duplicate_groups:
+        errors = (errors or []) + _propagate_duplicate_captions(duplicate_groups, errors or [])
+    _report_cache("Caption cache", _get_caption_cache())
+    _report_cache("Upload cache", _get_upload_cache())
+    _cleanup_uploaded_images()
     # 返回失败的文本文件路径列表，方便外部脚本做自动重试或清理
     return [identifier for (identifier, _message) in (errors or [])]
 
 
+def _output_image_exists(image_path: str) -> bool:
+    output_dir, image_filename = os.path.split(image_path)
+    prefixed_image_filename = image_filename if image_filename.startswith("F_") else f"F_{image_filename}"
+    return os.path.exists(image_path) or os.path.exists(os.path.join(output_dir, prefixed_image_filename))
+
+
 def _collect_text_tasks(base_text_path: str):
-    tasks = []
-    for root, _, files in os.walk(base_text_path):
-        for file in files:
-            if not file.lower().endswith(".txt"):
-                continue
-            text_file_path = os.path.join(root, file)
-            relative_path = _normalize_relative_path(os.path.relpath(root, base_text_path))
-            output_dir = os.path.join(config["output_path"], relative_path)
-            base_name = os.path.splitext(file)[0]
-            image_filename = base_name + ".jpg"
-            image_path = os.path.join(output_dir, image_filename)
-            prefixed_image_filename = image_filename if image_filename.startswith("F_") else f"F_{image_filename}"
-            prefixed_image_path = os.path.join(output_dir, prefixed_image_filename)
-            meta_dir = os.path.join(config["meta_path"], relative_path)
-            meta_filename = base_name + ".json"
-            meta_path = os.path.join(meta_dir, meta_filename)
-            if (
-                (os.path.exists(image_path) or os.path.exists(prefixed_image_path))
-                and not config["override_output_image"]
-            ):
-                continue
-            tasks.append((text_file_path, image_path, meta_path))
-    return tasks
+    snapshot = _scan_dataset(base_text_path, (".txt",), ("image",), content_hash=_text_file_hash)
+    candidates = []
+    for relative_file in snapshot.paths():
+        key = os.path.splitext(relative_file)[0]
+        text_file_path = snapshot.absolute_path(relative_file)
+        image_path = os.path.join(config["output_path"], *(key + ".jpg").split("/"))
+        meta_path = os.path.join(config["meta_path"], *(key + ".json").split("/"))
+        candidates.append((key, (text_file_path, image_path, meta_path)))
+    return _filter_pending_tasks(
+        "image",
+        candidates,
+        config["override_output_image"],
+        lambda task: _output_image_exists(task[1]),
+        estimate_cost=_estimate_generation_cost,
+        existing_outputs=_existing_output_keys(config["output_path"], SUPPORTED_IMAGE_EXTENSIONS),
+    )
 
 
 def _process_text_to_image_task(task):
@@ -485,82 +1488,519 @@ def _process_text_to_image_task(task):
     try:
         with open(text_file_path, "r", encoding="utf-8") as f:
             text_content = f.read().strip()
-        if not text_content:
-            raise ValueError("Text prompt is empty.")
-        text_to_image = _get_text_to_image_generator()
-        generation_size = _resolve_generation_size(meta_path)
-        image_url = text_to_image.generate(text_content, size=generation_size)
-        if download_image(image_url, image_path) != 0:
-            raise RuntimeError(f"Failed to download generated image from {image_url}")
+        key = _job_key(text_file_path, config["text_image_path"])
+        with _track_job("image", key, _text_content_hash(text_content)):
+            if not text_content:
+                raise ValueError("Text prompt is empty.")
+            text_to_image = _get_text_to_image_generator()
+            metrics = _get_metrics()
+            with metrics.span("metadata_lookup"):
+                generation_size = _resolve_generation_size(meta_path)
+            with metrics.span("generate"):
+                image_url = text_to_image.generate(text_content, size=generation_size)
+            with metrics.span("download") as span:
+                downloaded = utils.download_image.download_image(
+                    image_url, image_path, rate_limiter=_get_rate_limiter("download")
+                )
+                if downloaded != 0:
+                    raise RuntimeError(f"Failed to download generated image from {image_url}")
+                span.bytes = os.path.getsize(image_path)
+        return True, image_path, None
+    except utils.work_lease.LeaseUnavailable:
         return True, image_path, None
     except Exception as exc:
         return False, text_file_path, str(exc)
 
 
+async def _process_text_to_image_task_async(task, clients):
+    text_file_path, image_path, meta_path = task
+    try:
+        text_content = (await asyncio.to_thread(_read_text_file, text_file_path)).strip()
+        key = _job_key(text_file_path, config["text_image_path"])
+        async with _track_job_async("image", key, _text_content_hash(text_content)):
+            if not text_content:
+                raise ValueError("Text prompt is empty.")
+            metrics = _get_metrics()
+            with metrics.span("metadata_lookup"):
+                # 未命中时可能重新读取其他节点的元数据分片
+                generation_size = await asyncio.to_thread(_resolve_generation_size, meta_path)
+            with metrics.span("generate"):
+                image_url = await clients.text_to_image.generate(text_content, size=generation_size)
+            with metrics.span("download") as span:
+                if await utils.download_image.async_download_image(
+                    image_url, image_path, session=clients.http_session, rate_limiter=_get_rate_limiter("download")
+                ) != 0:
+                    raise RuntimeError(f"Failed to download generated image from {image_url}")
+                span.bytes = os.path.getsize(image_path)
+        return True, image_path, None
+    except utils.work_lease.LeaseUnavailable:
+        return True, image_path, None
+    except Exception as exc:
+        return False, text_file_path, str(exc)
+
+
+def _run_text_to_image_tasks(tasks):
+    utils.download_image.configure_download_pool(config.get("download_pool_size") or config.get("max_workers", 1))
+    errors = _run_tasks(
+        tasks,
+        _process_text_to_image_task,
+        _process_text_to_image_task_async,
+        "Text -> Images",
+        pooled_runner=_run_generation_tasks_pooled,
+    )
+    return errors or []
+
+
 def generate_images_from_text(base_text_path: str):
     if not os.path.isdir(base_text_path):
         print(f"Directory does not exist: {base_text_path}")
         return []
     tasks = _collect_text_tasks(base_text_path)
     print(f"Text files requiring image generation: {len(tasks)}")
-    errors = _run_tasks_concurrently(tasks, _process_text_to_image_task, "Text -> Images")
+    errors = _run_text_to_image_tasks(tasks)
     # 返回失败的文本文件路径列表（identifier 在 _process_text_to_image_task 中就是 text_file_path）
-    return [identifier for (identifier, _message) in (errors or [])]
+    return [identifier for (identifier, _message) in errors]
+
+
+_TRANSIENT_FAILURE_MARKERS = ("timeout", "timed out", "connection", "download", "temporarily", "503", "502")
+
+
+class _RetryItem:
+    """auto_retry_failed_text_to_image 中单个失败样本的重试状态。"""
+
+    def __init__(self, key: str, text_path: str, image_path: Optional[str]):
+        self.key = key
+        self.text_path = text_path
+        self.image_path = image_path
+        self.attempts = 0
+        self.next_attempt_at = 0.0
+        self.reason = ""
+        # 网络/限流类失败直接重新生成图片，其余失败（如提示词被拒）需要重新生成描述
+        self.needs_recaption = True
+
+    def record_failure(self, stage: str, message: str) -> None:
+        self.attempts += 1
+        self.reason = f"[{stage}] {message}"
+        if stage == "image":
+            self.needs_recaption = not (
+                utils.rate_limit.is_throttle_message(message)
+                or any(marker in message.lower() for marker in _TRANSIENT_FAILURE_MARKERS)
+            )
+        else:
+            # 描述阶段失败时文本已被删除，无论失败原因都必须先重新描述
+            self.needs_recaption = True
+        backoff = float(config.get("retry_backoff_seconds", 5.0)) * (2 ** (self.attempts - 1))
+        self.next_attempt_at = time.monotonic() + min(backoff, float(config.get("retry_backoff_max_seconds", 300.0)))
+
+    def text_task(self):
+        return self.image_path, self.text_path
+
+    def image_task(self):
+        return (
+            self.text_path,
+            os.path.join(config["output_path"], *(self.key + ".jpg").split("/")),
+            os.path.join(config["meta_path"], *(self.key + ".json").split("/")),
+        )
+
+
+def _build_retry_items(errors):
+    snapshot = _scan_dataset(
+        config["real_image_path"], SUPPORTED_IMAGE_EXTENSIONS, ("metadata", "text", "image"), reuse=True
+    )
+    sources = {os.path.splitext(path)[0]: snapshot.absolute_path(path) for path in snapshot.paths()}
+    items = []
+    for text_path, message in errors:
+        key = _job_key(text_path, config["text_image_path"])
+        item = _RetryItem(key, text_path, sources.get(key))
+        item.record_failure("image", message)
+        items.append(item)
+    return items
+
+
+def _retry_round(due_items):
+    """对到期的样本依次执行 重新描述(按需) -> 重新生成，返回仍失败的样本。"""
+    failed = []
+    recaption = [item for item in due_items if item.needs_recaption]
+    ready = [item for item in due_items if not item.needs_recaption]
+
+    if recaption:
+        caption_cache = _get_caption_cache()
+        ledger = _get_job_ledger()
+        for item in recaption:
+            try:
+                os.remove(item.text_path)
+            except FileNotFoundError:
+                pass
+            # 同一张图片若命中描述缓存会得到相同的提示词，重试前需失效
+            if caption_cache is not None and item.image_path:
+                caption_cache.delete(_caption_cache_key(item.image_path))
+        if ledger is not None:
+            ledger.reset("text", [item.key for item in recaption])
+
+        print(f"Regenerating text prompts for {len(recaption)} failed sample(s)...")
+        by_text_path = {item.text_path: item for item in recaption}
+        text_errors = _run_tasks(
+            [item.text_task() for item in recaption],
+            _process_image_to_text_task,
+            _process_image_to_text_task_async,
+            "Images -> Text (retry)",
+            pooled_runner=_run_caption_tasks_pooled,
+        ) or []
+        failed_text_paths = set()
+        for text_path, message in text_errors:
+            by_text_path[text_path].record_failure("text", message)
+            failed_text_paths.add(text_path)
+        failed.extend(by_text_path[path] for path in failed_text_paths)
+        ready.extend(item for item in recaption if item.text_path not in failed_text_paths)
+
+    if ready:
+        print(f"Re-running Text -> Images for {len(ready)} sample(s)...")
+        by_text_path = {item.text_path: item for item in ready}
+        for text_path, message in _run_text_to_image_tasks([item.image_task() for item in ready]):
+            by_text_path[text_path].record_failure("image", message)
+            failed.append(by_text_path[text_path])
+    return failed
 
 
 def auto_retry_failed_text_to_image(max_rounds: int = 5):
     """
-    运行 Text -> Images，并对失败样本做一次（或多轮）自动重试：
+    运行 Text -> Images，并对失败样本做定向重试：
     1. 先尝试根据现有文本生成图片；
-    2. 收集失败的文本文件路径并删除对应 .txt；
-    3. 重新从原始图片生成文本；
-    4. 再跑一轮 Text -> Images。
+    2. 只针对失败样本排队重试，不再重新遍历整个目录；
+    3. 因提示词等原因失败的样本删除 .txt 并从原始图片重新生成文本，
+       网络/限流类失败的样本直接重新生成图片；
+    4. 每个样本独立退避（retry_backoff_seconds 起指数增长），最多重试 max_rounds 次。
 
-    max_rounds 表示最多重试轮数（不含第一次），默认 2 轮一般够用。
+    返回各轮仍然失败的文本文件路径列表（最后一项是最终仍失败的）。
     """
     base_text_path = config["text_image_path"]
+    if not os.path.isdir(base_text_path):
+        print(f"Directory does not exist: {base_text_path}")
+        return []
 
     # 第一次尝试
-    failed_text_files = generate_images_from_text(base_text_path)
-    if not failed_text_files:
+    tasks = _collect_text_tasks(base_text_path)
+    print(f"Text files requiring image generation: {len(tasks)}")
+    first_errors = _run_text_to_image_tasks(tasks)
+    if not first_errors:
         print("Text -> Images: no failed tasks, nothing to retry.")
         return []
 
-    all_failed_rounds = [failed_text_files]
-
-    round_idx = 1
-    while failed_text_files and round_idx <= max_rounds:
-        print(f"Retry round {round_idx}: {len(failed_text_files)} failed text file(s) detected.")
-
-        # 1. 删除失败的文本文件
-        for text_path in failed_text_files:
-            try:
-                os.remove(text_path)
-                print(f"Deleted failed text file: {text_path}")
-            except FileNotFoundError:
-                print(f"Failed text file already missing (skip): {text_path}")
+    pending = _build_retry_items(first_errors)
+    all_failed_rounds = [[item.text_path for item in pending]]
+    exhausted = []
 
-        # 2. 重新从原始图片生成文本（只会对不存在 .txt 的图片生成）
-        print("Regenerating text prompts from images for failed samples...")
-        generate_text_from_images(config["real_image_path"])
-
-        # 3. 再跑一轮 Text -> Images
-        print("Re-running Text -> Images for regenerated text prompts...")
-        failed_text_files = generate_images_from_text(base_text_path)
-        if failed_text_files:
-            all_failed_rounds.append(failed_text_files)
+    for item in list(pending):
+        if item.image_path is None:
+            item.reason = "source image not found"
+            exhausted.append(item)
+            pending.remove(item)
 
+    round_idx = 1
+    while pending:
+        now = time.monotonic()
+        due = [item for item in pending if item.next_attempt_at <= now]
+        if not due:
+            time.sleep(max(0.0, min(item.next_attempt_at for item in pending) - now))
+            continue
+
+        print(f"Retry round {round_idx}: {len(due)} of {len(pending)} failed sample(s) due.")
+        due_keys = {item.key for item in due}
+        still_failed = _retry_round(due)
+        pending = [item for item in pending if item.key not in due_keys]
+        for item in still_failed:
+            if item.attempts > max_rounds:
+                exhausted.append(item)
+            else:
+                pending.append(item)
+        all_failed_rounds.append([item.text_path for item in still_failed])
         round_idx += 1
 
-    if failed_text_files:
-        print(f"After {max_rounds} retry round(s), still {len(failed_text_files)} failed text file(s).")
+    if exhausted:
+        print(f"After {max_rounds} retry attempt(s), still {len(exhausted)} failed sample(s):")
+        for item in exhausted:
+            print(f" - {item.text_path} (attempts: {item.attempts}): {item.reason}")
     else:
         print("Auto retry completed, no remaining failed Text -> Images tasks.")
 
-    # 返回各轮仍然失败的文本文件路径列表（最后一项是最终仍失败的）
     return all_failed_rounds
 
 
+def _iter_pipeline_items(base_real_path: str):
+    snapshot = _scan_dataset(
+        base_real_path, SUPPORTED_IMAGE_EXTENSIONS, ("metadata", "text", "image"), reuse=True
+    )
+    keyed_files = [(os.path.splitext(relative_file)[0], relative_file) for relative_file in snapshot.paths()]
+    for key, relative_file in _order_by_shard(keyed_files):
+        yield _pipeline_item(key, snapshot.absolute_path(relative_file))
+
+
+def _pipeline_item(key: str, image_path: str, force: bool = False):
+    """force=True 时忽略已有输出重新处理（源图片被修改）。"""
+    return {
+        "key": key,
+        "image_path": image_path,
+        "meta_path": os.path.join(config["meta_path"], *(key + ".json").split("/")),
+        "text_path": os.path.join(config["text_image_path"], *(key + ".txt").split("/")),
+        "output_path": os.path.join(config["output_path"], *(key + ".jpg").split("/")),
+        "force": force,
+    }
+
+
+def _stream_metadata_stage(item):
+    if config["override_metadata"] or item["force"] or not _metadata_exists(item["meta_path"]):
+        try:
+            with _track_job("metadata", item["key"], _file_fingerprint(item["image_path"])):
+                _record_image_metadata(item["image_path"], item["meta_path"])
+        except utils.work_lease.LeaseUnavailable:
+            return None  # 其他节点正在处理该图片的整条流水线
+    return item
+
+
+# 描述拆成 缩放(prep) -> 上传(upload) -> 图片理解(inference) 三个子步骤，账本状态与租约在最后一步才标记为 done；
+# 已有文本或命中描述缓存时 item["caption_pending"] 为 False，后续子步骤直接放行（流式流水线中继续进入生成）。
+def _caption_prep_step(item):
+    item["caption_pending"] = False
+    if not (config["override_text_prompt"] or item["force"]) and os.path.exists(item["text_path"]):
+        return item
+    if not _begin_split_job("text", item["key"], _file_fingerprint(item["image_path"])):
+        return None  # 其他节点正在处理该图片
+    with _split_job_step("text", item["key"]):
+        caption_cache = _get_caption_cache()
+        if caption_cache is not None:
+            item["cache_key"] = _caption_cache_key(item["image_path"])
+            cached = caption_cache.get(item["cache_key"])
+            if cached:
+                _write_text_output(item["text_path"], cached["text"])
+                _end_split_job("text", item["key"])
+                return item
+        item["payload_size"], item["image_ref"], item["encoded"] = _prepare_caption_input(item["image_path"])
+    item["caption_pending"] = True
+    return item
+
+
+def _caption_upload_step(item):
+    if not item["caption_pending"] or item["image_ref"] is not None:
+        return item
+    with _split_job_step("text", item["key"]):
+        item["image_ref"] = _upload_caption_input(item["image_path"], item.pop("encoded"), item["payload_size"])
+    return item
+
+
+def _caption_inference_step(item):
+    if not item["caption_pending"]:
+        return item
+    with _split_job_step("text", item["key"]):
+        with _get_metrics().span("vision") as span:
+            if item["image_ref"].startswith("data:"):
+                span.bytes = item["payload_size"]
+            description = _get_image_to_text_generator().generate(item.pop("image_ref"), _get_image_to_text_prompt())
+        if item.get("cache_key"):
+            description = _remember_caption(item["cache_key"], description)
+        _write_text_output(item["text_path"], description)
+    _end_split_job("text", item["key"])
+    item["caption_pending"] = False
+    return item
+
+
+def _stream_generate_stage(item):
+    if _output_image_exists(item["output_path"]) and not (config["override_output_image"] or item["force"]):
+        return None
+    with open(item["text_path"], "r", encoding="utf-8") as f:
+        text_content = f.read().strip()
+    # 生成与下载分属两个阶段，账本状态与租约在下载完成后才标记为 done
+    if not _begin_split_job("image", item["key"], _text_content_hash(text_content)):
+        return None
+    with _split_job_step("image", item["key"]):
+        if not text_content:
+            raise ValueError("Text prompt is empty.")
+        metrics = _get_metrics()
+        with metrics.span("metadata_lookup"):
+            generation_size = _resolve_generation_size(item["meta_path"])
+        with metrics.span("generate"):
+            item["image_url"] = _get_text_to_image_generator().generate(text_content, size=generation_size)
+    return item
+
+
+def _stream_download_stage(item):
+    with _split_job_step("image", item["key"]), _get_metrics().span("download") as span:
+        downloaded = utils.download_image.download_image(
+            item["image_url"], item["output_path"], rate_limiter=_get_rate_limiter("download")
+        )
+        if downloaded != 0:
+            raise RuntimeError(f"Failed to download generated image from {item['image_url']}")
+        span.bytes = os.path.getsize(item["output_path"])
+    _end_split_job("image", item["key"])
+    return item
+
+
+def run_streaming_pipeline(base_real_path: str):
+    """
+    Metadata -> Text -> Images 的流式版本：每张图片完成上一步后立即进入下一步，
+    各阶段之间用有界队列连接以实现背压，只遍历一次源目录。
+    """
+    if not os.path.isdir(base_real_path):
+        print(f"Directory does not exist: {base_real_path}")
+        return []
+
+    pipeline = _build_stream_pipeline()
+    desc = "Streaming pipeline"
+    with _get_progress_bar(None, desc) as progress:
+        errors = pipeline.run(
+            _iter_pipeline_items(base_real_path),
+            identify=lambda item: item["image_path"],
+            on_finished=lambda _item: progress.update(1),
+        )
+    _build_metadata_index()
+    _cleanup_uploaded_images()
+
+    _report_errors(errors, desc)
+    return errors
+
+
+def _resource_workers(overrides=None) -> Dict[str, int]:
+    """各资源子步骤的线程数：默认按 max_workers 推算，再依次应用 resource_workers 与 overrides。"""
+    max_workers = max(1, int(config.get("max_workers", 1)))
+    workers = {
+        "metadata": max(1, max_workers // 4),
+        "prep": max(1, min(max_workers, os.cpu_count() or 1)),
+        "upload": max_workers,
+        "inference": max_workers,
+        "generate": max_workers,
+        "download": max(1, max_workers // 2),
+    }
+    workers.update(config.get("resource_workers") or {})
+    overrides = dict(overrides or {})
+    if "caption" in overrides:  # 旧版 stream_stage_workers 中整个描述阶段的线程数
+        overrides.setdefault("inference", overrides.pop("caption"))
+    workers.update(overrides)
+    return workers
+
+
+def _caption_steps(workers):
+    return [
+        ("prep", _caption_prep_step, workers["prep"]),
+        ("upload", _caption_upload_step, workers["upload"]),
+        ("inference", _caption_inference_step, workers["inference"]),
+    ]
+
+
+def _generation_steps(workers):
+    utils.download_image.configure_download_pool(config.get("download_pool_size") or workers["download"])
+    return [
+        ("generate", _stream_generate_stage, workers["generate"]),
+        ("download", _stream_download_stage, workers["download"]),
+    ]
+
+
+def _run_resource_pools(steps, items, desc: str):
+    """resource_pools 引擎：把 (key, ...) 任务作为 item 送入按资源拆分的流水线，返回 (text_path, message) 错误列表。"""
+    pipeline = utils.StreamPipeline(steps, queue_size=config.get("stream_queue_size", 64))
+    with _get_progress_bar(len(items), desc) as progress:
+        errors = pipeline.run(
+            items, identify=lambda item: item["text_path"], on_finished=lambda _item: progress.update(1)
+        )
+    _report_errors(errors, desc)
+    return errors
+
+
+def _run_caption_tasks_pooled(tasks, desc: str):
+    items = [
+        {
+            "key": _job_key(text_path, config["text_image_path"]),
+            "image_path": real_image_path,
+            "text_path": text_path,
+            "force": True,  # 任务已由 _filter_pending_tasks 筛选
+        }
+        for real_image_path, text_path in tasks
+    ]
+    return _run_resource_pools(_caption_steps(_resource_workers()), items, desc)
+
+
+def _run_generation_tasks_pooled(tasks, desc: str):
+    items = [
+        {
+            "key": _job_key(text_file_path, config["text_image_path"]),
+            "text_path": text_file_path,
+            "output_path": image_path,
+            "meta_path": meta_path,
+            "force": True,
+        }
+        for text_file_path, image_path, meta_path in tasks
+    ]
+    return _run_resource_pools(_generation_steps(_resource_workers()), items, desc)
+
+
+def _build_stream_pipeline():
+    workers = _resource_workers(config.get("stream_stage_workers"))
+    pipeline = utils.StreamPipeline(
+        [("metadata", _stream_metadata_stage, workers["metadata"])]
+        + _caption_steps(workers)
+        + _generation_steps(workers),
+        queue_size=config.get("stream_queue_size", 64),
+    )
+    return pipeline
+
+
+def run_watch_mode(base_real_path: str, stop_event: Optional[threading.Event] = None):
+    """
+    常驻模式：监听源目录，新增或修改的图片写入完成后立即依次完成元数据、描述与生成。
+    各阶段线程、客户端与连接池在整个运行期间复用；Ctrl+C 后处理完在途任务再退出。
+    """
+    if not os.path.isdir(base_real_path):
+        print(f"Directory does not exist: {base_real_path}")
+        return
+
+    watcher = utils.DirectoryWatcher(
+        base_real_path,
+        SUPPORTED_IMAGE_EXTENSIONS,
+        debounce_seconds=float(config.get("watch_debounce_seconds", 2.0)),
+        poll_interval=float(config.get("watch_poll_interval_seconds", 5.0)),
+        rescan_interval=float(config.get("watch_rescan_interval_seconds", 300.0)),
+        use_inotify=config.get("watch_use_inotify", True),
+    )
+    ledger = _get_job_ledger()
+    failures = []
+
+    def items():
+        for image_path, changed in watcher.watch(stop_event):
+            key = _job_key(image_path, base_real_path)
+            if utils.work_lease.shard_of(key, int(config.get("shard_count", 1))) != int(config.get("shard_index", 0)):
+                if _get_lease_coordinator() is None or not config.get("lease_steal", True):
+                    continue
+            if changed and ledger is not None:
+                ledger.reset("metadata", [key])
+                ledger.reset("text", [key])
+                ledger.reset("image", [key])
+            yield _pipeline_item(key, image_path, force=changed)
+
+    def on_finished(item):
+        print(f"[watch] finished {item['key']}")
+
+    def on_error(identifier, message):
+        failures.append((identifier, message))
+        print(f"[watch] failed {identifier}: {message}")
+
+    print(f"Watching {base_real_path} for new images ({watcher.backend}); press Ctrl+C to stop.")
+    try:
+        _build_stream_pipeline().run(
+            items(), identify=lambda item: item["image_path"], on_finished=on_finished, on_error=on_error
+        )
+    except KeyboardInterrupt:
+        print("Stopping watch mode...")
+    _build_metadata_index()
+    _cleanup_uploaded_images()
+    _report_errors(failures, "Watch mode")
+
+
+def run_full_pipeline():
+    if config.get("pipeline_mode", "staged") == "streaming":
+        return run_streaming_pipeline(config["real_image_path"])
+    generate_metadata_for_images(config["real_image_path"])
+    generate_text_from_images(config["real_image_path"])
+    return generate_images_from_text(config["text_image_path"])
+
+
 def prefix_output_images(base_output_path: str):
     if not os.path.isdir(base_output_path):
         print(f"Directory does not exist: {base_output_path}")
@@ -604,6 +2044,8 @@ if __name__ == "__main__":
         "(4): prefix_output_images\n"
         "(5): run_full_pipeline\n"
         "(6): auto_retry_failed_text_to_image\n"
+        "(7): merge_metadata_parts\n"
+        "(8): run_watch_mode\n"
     )
     if action == "1":
         print("Generating metadata from images...")
@@ -619,11 +2061,15 @@ if __name__ == "__main__":
         prefix_output_images(config["output_path"])
     elif action == "5":
         print("Running full pipeline...")
-        generate_metadata_for_images(config["real_image_path"])
-        generate_text_from_images(config["real_image_path"])
-        generate_images_from_text(config["text_image_path"])
+        run_full_pipeline()
     elif action == "6":
         print("Running Text -> Images with auto retry on failed samples...")
         auto_retry_failed_text_to_image()
+    elif action == "7":
+        print("Merging per-node metadata parts...")
+        merge_metadata_parts()
+    elif action == "8":
+        print("Watching source images...")
+        run_watch_mode(config["real_image_path"])
     else:
         print("Invalid action")
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+import pytest
+
+# main.py 与 utils 位于仓库根目录，未作为包安装
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def ledger(monkeypatch, tmp_path):
+    """main 使用的临时任务账本：单节点、无租约、按目录遍历顺序派发。"""
+    import main
+    import utils
+
+    job_ledger = utils.JobLedger(str(tmp_path / "jobs.sqlite"))
+    monkeypatch.setattr(main, "_job_ledger", job_ledger)
+    monkeypatch.setitem(main.config, "job_ledger_enabled", True)
+    monkeypatch.setitem(main.config, "lease_mode", None)
+    monkeypatch.setitem(main.config, "shard_count", 1)
+    monkeypatch.setitem(main.config, "schedule_policy", "fifo")
+    monkeypatch.setitem(main.config, "schedule_priority_paths", [])
+    yield job_ledger
+    job_ledger.close()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("requests")
+
+from utils import download_image as dl  # noqa: E402
+
+CONTENT = {"/a.jpg": b"A" * 4000, "/b.jpg": b"B" * 5000}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        if self.path in self.server.fail_once:
+            self.server.fail_once.discard(self.path)
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = CONTENT.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        etag = f'"{self.server.etags.get(self.path, self.path)}"'
+        range_header = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if range_header and (if_range is None or if_range == etag):
+            start = int(range_header.split("=")[1].rstrip("-"))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+            body = body[start:]
+        else:
+            self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    httpd.requests = []
+    httpd.etags = {}
+    httpd.fail_once = set()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _url(server, path):
+    return f"http://127.0.0.1:{server.server_address[1]}{path}"
+
+
+def _leave_partial(save_path, url, data, validator):
+    with open(save_path + dl.PARTIAL_SUFFIX, "wb") as f:
+        f.write(data)
+    with open(save_path + dl.PARTIAL_STATE_SUFFIX, "w", encoding="utf-8") as f:
+        json.dump({"url": url, "validator": validator}, f)
+
+
+def test_resumes_partial_from_same_url(server, tmp_path):
+    save_path = str(tmp_path / "out.jpg")
+    url = _url(server, "/a.jpg")
+    _leave_partial(save_path, url, CONTENT["/a.jpg"][:1000], '"/a.jpg"')
+
+    assert dl.download_image(url, save_path) == 0
+
+    with open(save_path, "rb") as f:
+        assert f.read() == CONTENT["/a.jpg"]
+    assert server.requests[-1][1].get("Range") == "bytes=1000-"
+    assert not (tmp_path / ("out.jpg" + dl.PARTIAL_STATE_SUFFIX)).exists()
+
+
+def test_discards_partial_from_other_url(server, tmp_path):
+    save_path = str(tmp_path / "out.jpg")
+    _leave_partial(save_path, _url(server, "/a.jpg"), CONTENT["/a.jpg"][:1000], '"/a.jpg"')
+
+    assert dl.download_image(_url(server, "/b.jpg"), save_path) == 0
+
+    with open(save_path, "rb") as f:
+        assert f.read() == CONTENT["/b.jpg"]
+    assert "Range" not in server.requests[-1][1]
+
+
+def test_partial_without_source_record_is_discarded(server, tmp_path):
+    save_path = str(tmp_path / "out.jpg")
+    with open(save_path + dl.PARTIAL_SUFFIX, "wb") as f:
+        f.write(b"stale")
+
+    dl.download_image(_url(server, "/a.jpg"), save_path)
+
+    with open(save_path, "rb") as f:
+        assert f.read() == CONTENT["/a.jpg"]
+
+
+def test_changed_resource_is_downloaded_whole(server, tmp_path):
+    save_path = str(tmp_path / "out.jpg")
+    url = _url(server, "/a.jpg")
+    _leave_partial(save_path, url, b"X" * 1000, '"old-etag"')
+
+    dl.download_image(url, save_path)
+
+    with open(save_path, "rb") as f:
+        assert f.read() == CONTENT["/a.jpg"]
+    assert server.requests[-1][1].get("If-Range") == '"old-etag"'
+
+
+def test_client_errors_are_not_retried(server, tmp_path):
+    with pytest.raises(Exception, match="404"):
+        dl.download_image(_url(server, "/missing.jpg"), str(tmp_path / "out.jpg"), max_attempts=3)
+    assert len(server.requests) == 1
+
+
+def test_invalid_url_is_not_retried(monkeypatch, tmp_path):
+    attempts = []
+    resume_headers = dl._resume_headers
+    monkeypatch.setattr(dl, "_resume_headers", lambda *args: attempts.append(1) or resume_headers(*args))
+    with pytest.raises(Exception, match="Failed to download"):
+        dl.download_image("example.com/a.jpg", str(tmp_path / "out.jpg"), max_attempts=3)
+    assert len(attempts) == 1
+
+
+def _async_download(url, save_path, **kwargs):
+    aiohttp = pytest.importorskip("aiohttp")
+
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            return await dl.async_download_image(url, save_path, session=session, **kwargs)
+
+    return asyncio.run(run())
+
+
+def test_async_retries_server_errors_and_resumes(server, tmp_path):
+    save_path = str(tmp_path / "out.jpg")
+    url = _url(server, "/a.jpg")
+    _leave_partial(save_path, url, CONTENT["/a.jpg"][:1000], '"/a.jpg"')
+    server.fail_once.add("/a.jpg")
+
+    assert _async_download(url, save_path) == 0
+
+    with open(save_path, "rb") as f:
+        assert f.read() == CONTENT["/a.jpg"]
+    assert len(server.requests) == 2
+    assert server.requests[-1][1].get("Range") == "bytes=1000-"
+
+
+def test_async_client_errors_are_not_retried(server, tmp_path):
+    with pytest.raises(Exception, match="404"):
+        _async_download(_url(server, "/missing.jpg"), str(tmp_path / "out.jpg"), max_attempts=3)
+    assert len(server.requests) == 1
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+oss2 = pytest.importorskip("oss2")
+pytest.importorskip("numpy")
+pytest.importorskip("PIL")
+
+from utils.image_hosting_service import AliyunOSSImageHost  # noqa: E402
+
+PART = 100 * 1024
+
+
+class _FakeBucket:
+    """内存中的 bucket，只实现分片上传用到的接口。"""
+
+    bucket_name = "test-bucket"
+    endpoint = "https://oss.example.com"
+
+    def __init__(self):
+        self.uploads = {}
+        self.objects = {}
+        self.aborted = []
+        self.fail_part = None
+        self._next_id = 0
+
+    def init_multipart_upload(self, key):
+        self._next_id += 1
+        upload_id = f"upload-{self._next_id}"
+        self.uploads[upload_id] = (key, {})
+        return types.SimpleNamespace(upload_id=upload_id)
+
+    def upload_part(self, key, upload_id, part_number, data):
+        if part_number == self.fail_part:
+            raise RuntimeError("connection reset")
+        etag = '"' + hashlib.md5(data).hexdigest().upper() + '"'
+        self.uploads[upload_id][1][part_number] = (etag, data)
+        return types.SimpleNamespace(etag=etag)
+
+    def list_parts(self, key, upload_id, marker="0", max_parts=1000, headers=None):
+        if upload_id not in self.uploads or self.uploads[upload_id][0] != key:
+            raise oss2.exceptions.NoSuchUpload(404, {}, b"", {})
+        parts = [
+            types.SimpleNamespace(part_number=number, etag=etag, size=len(data))
+            for number, (etag, data) in sorted(self.uploads[upload_id][1].items())
+        ]
+        return types.SimpleNamespace(parts=parts, is_truncated=False, next_marker="")
+
+    def complete_multipart_upload(self, key, upload_id, parts):
+        stored = self.uploads.pop(upload_id)[1]
+        self.objects[key] = b"".join(stored[part.part_number][1] for part in parts)
+        return types.SimpleNamespace(status=200)
+
+    def put_object(self, key, data):
+        self.objects[key] = bytes(data)
+        return types.SimpleNamespace(status=200)
+
+    def abort_multipart_upload(self, key, upload_id):
+        self.aborted.append(upload_id)
+        if self.uploads.pop(upload_id, None) is None:
+            raise oss2.exceptions.NoSuchUpload(404, {}, b"", {})
+
+
+def _host(tmp_path, bucket):
+    host = AliyunOSSImageHost(
+        "id", "secret", bucket.bucket_name, bucket.endpoint,
+        multipart_threshold=PART, multipart_part_size=PART, multipart_threads=1,
+        checkpoint_dir=str(tmp_path / "checkpoints"),
+    )
+    host.bucket = bucket
+    return host
+
+
+def _checkpoints(tmp_path):
+    directory = tmp_path / "checkpoints" / "multipart"
+    return os.listdir(directory) if directory.is_dir() else []
+
+
+def test_interrupted_upload_resumes_in_a_later_run(tmp_path):
+    bucket = _FakeBucket()
+    data = os.urandom(3 * PART + 10)
+    bucket.fail_part = 3
+    with pytest.raises(RuntimeError):
+        _host(tmp_path, bucket).upload_bytes(data, "big.png", folder="run-1")
+    assert len(_checkpoints(tmp_path)) == 1
+
+    bucket.fail_part = None
+    uploaded = []
+    original = bucket.upload_part
+    bucket.upload_part = lambda *args: uploaded.append(args[2]) or original(*args)
+    url = _host(tmp_path, bucket).upload_bytes(data, "big.png", folder="run-2")
+
+    # 上次运行的分片被复用，对象完成到上次的 key
+    assert uploaded == [3]
+    assert url.endswith("/run-1/big.png")
+    assert bucket.objects["run-1/big.png"] == data
+    assert _checkpoints(tmp_path) == []
+
+
+def test_stale_checkpoint_is_aborted(tmp_path):
+    bucket = _FakeBucket()
+    bucket.fail_part = 2
+    with pytest.raises(RuntimeError):
+        _host(tmp_path, bucket).upload_bytes(os.urandom(2 * PART), "old.png")
+    (checkpoint,) = _checkpoints(tmp_path)
+    old = tmp_path / "checkpoints" / "multipart" / checkpoint
+    os.utime(old, (0, 0))
+
+    bucket.fail_part = None
+    _host(tmp_path, bucket).upload_bytes(os.urandom(2 * PART), "new.png")
+
+    assert bucket.aborted == ["upload-1"]
+    assert bucket.uploads == {}
+    assert _checkpoints(tmp_path) == []
+
+
+class _SlowCache:
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        time.sleep(0.001)
+
+
+def test_concurrent_uploads_return_their_own_url(tmp_path):
+    host = _host(tmp_path, _FakeBucket())
+    host.upload_cache = _SlowCache()
+    payloads = [f"img_{i}".encode() for i in range(64)]
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        urls = list(executor.map(lambda data: host.upload_bytes(data, "x.png"), payloads))
+    assert [url.rsplit("/", 1)[1] for url in urls] == [hashlib.sha256(data).hexdigest() + ".png" for data in payloads]
+
+
+def test_upload_iter_bounds_in_flight_items(tmp_path):
+    host = _host(tmp_path, _FakeBucket())
+    consumed = []
+
+    def items():
+        for i in range(40):
+            consumed.append(i)
+            yield f"img_{i}.png", f"data-{i}".encode()
+
+    results = {}
+    backlog = []
+    for name, url in host.upload_iter(items(), max_workers=2):
+        backlog.append(len(consumed) - len(results))
+        results[name] = url
+    assert max(backlog) <= 2 * 2
+    assert results == {f"img_{i}.png": host._object_url(f"img_{i}.png") for i in range(40)}
+
+
+def test_upload_many_reports_failures_as_none(tmp_path):
+    bucket = _FakeBucket()
+    host = _host(tmp_path, bucket)
+    put_object = bucket.put_object
+    bucket.put_object = lambda key, data: put_object(key, data) if key != "bad.png" else 1 / 0
+
+    assert host.upload_many([("ok.png", b"1"), ("bad.png", b"2")]) == {
+        "ok.png": host._object_url("ok.png"),
+        "bad.png": None,
+    }
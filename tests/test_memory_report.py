@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+import main
+
+pytest.importorskip("resource")
+
+
+def test_report_includes_prep_pool_peak_rss(monkeypatch, capsys):
+    monkeypatch.setitem(main.config, "prep_process_workers", 1)
+    monkeypatch.setattr(main, "_memory_budget", None)
+    main._get_prep_pool().submit(os.getpid).result()
+
+    main._report_memory()
+
+    assert main._prep_pool is None
+    assert "finished child processes" in capsys.readouterr().out
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+from utils import metadata_store
+from utils.metadata_store import MetadataStore
+
+
+def _node_store(base, node, refresh_interval):
+    return MetadataStore(
+        metadata_store.part_path(base, node),
+        read_paths=lambda: [base] + metadata_store.list_part_paths(base),
+        refresh_interval=refresh_interval,
+    )
+
+
+def test_miss_picks_up_records_written_later_by_other_nodes(tmp_path):
+    base = str(tmp_path / "metadata.jsonl")
+    a = _node_store(base, "a", refresh_interval=0)
+    b = _node_store(base, "b", refresh_interval=0)
+
+    b.put("x/1", {"width": 10})
+    assert a.get("x/1") == {"width": 10}
+
+    b.put("x/2", {"width": 20})
+    assert "x/2" in a
+
+    # 自己的记录优先于其他节点的记录
+    a.put("x/1", {"width": 11})
+    b.put("x/1", {"width": 12})
+    assert a.get("x/3") is None
+    assert a.get("x/1") == {"width": 11}
+
+
+def test_refresh_is_rate_limited_and_skips_partial_lines(tmp_path):
+    base = str(tmp_path / "metadata.jsonl")
+    a = _node_store(base, "a", refresh_interval=3600)
+    b = _node_store(base, "b", refresh_interval=None)
+    b.put("k", {"v": 1})
+    assert a.get("k") is None
+
+    a.refresh_interval = 0
+    with open(metadata_store.part_path(base, "c"), "w", encoding="utf-8") as f:
+        f.write('{"key": "c1", "v": 1}\n{"key": "c2", "v"')
+    assert a.get("k") == {"v": 1}
+    assert a.get("c1") == {"v": 1}
+    assert a.get("c2") is None
+
+    with open(metadata_store.part_path(base, "c"), "a", encoding="utf-8") as f:
+        f.write(": 2}\n")
+    assert a.get("c2") == {"v": 2}
+
+
+def test_partial_last_line_does_not_swallow_next_put(tmp_path):
+    path = str(tmp_path / "metadata.jsonl")
+    store = MetadataStore(path)
+    store.put("a", {"v": 1})
+    store.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"key": "b", "v"')
+
+    store = MetadataStore(path)
+    store.put("c", {"v": 3})
+    store.close()
+
+    reloaded = MetadataStore(path)
+    assert reloaded.get("a") == {"v": 1}
+    assert reloaded.get("b") is None
+    assert reloaded.get("c") == {"v": 3}
+
+
+def test_complete_last_line_without_newline_is_kept(tmp_path):
+    path = str(tmp_path / "metadata.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{"key": "a", "v": 1}')
+
+    store = MetadataStore(path)
+    store.put("b", {"v": 2})
+    store.close()
+
+    reloaded = MetadataStore(path)
+    assert reloaded.get("a") == {"v": 1}
+    assert reloaded.get("b") == {"v": 2}
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import os
+
+import main
+import utils
+
+
+def _write(path, content=b"x"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def test_done_job_with_deleted_output_is_requeued(ledger, monkeypatch, tmp_path):
+    output_root = str(tmp_path / "text")
+    _write(os.path.join(output_root, "a", "kept.txt"))
+    ledger.register("text", ["a/kept", "a/deleted"], status=utils.job_ledger.STATUS_DONE)
+
+    candidates = [("a/kept", "task-kept"), ("a/deleted", "task-deleted")]
+    pending = main._filter_pending_tasks(
+        "text",
+        candidates,
+        False,
+        lambda task: False,
+        existing_outputs=main._existing_output_keys(output_root, (".txt",)),
+    )
+
+    assert pending == ["task-deleted"]
+    assert ledger.statuses("text") == {"a/kept": "done", "a/deleted": "pending"}
+
+
+def test_prefixed_output_counts_as_existing(ledger, monkeypatch, tmp_path):
+    output_root = str(tmp_path / "out")
+    _write(os.path.join(output_root, "a", "F_img.jpg"))
+    ledger.register("image", ["a/img"], status=utils.job_ledger.STATUS_DONE)
+
+    pending = main._filter_pending_tasks(
+        "image",
+        [("a/img", "task")],
+        False,
+        lambda task: False,
+        existing_outputs=main._existing_output_keys(output_root, main.SUPPORTED_IMAGE_EXTENSIONS),
+    )
+
+    assert pending == []
+    assert ledger.statuses("image") == {"a/img": "done"}
+
+
+def test_done_rows_trusted_without_output_scan(ledger):
+    ledger.register("text", ["a/b"], status=utils.job_ledger.STATUS_DONE)
+
+    assert main._filter_pending_tasks("text", [("a/b", "task")], False, lambda task: False) == []
+
+
+def _scan_text_tree(monkeypatch, tmp_path, root):
+    monkeypatch.setitem(main.config, "dataset_index_dir", str(tmp_path / "index"))
+    monkeypatch.setattr(main, "_dataset_snapshots", {})
+    return main._scan_dataset(root, (".txt",), ("image",), content_hash=main._text_file_hash)
+
+
+def test_rewritten_text_with_same_content_keeps_image(ledger, monkeypatch, tmp_path):
+    root = str(tmp_path / "text")
+    text_path = os.path.join(root, "a", "b.txt")
+    _write(text_path, b"a cat\n")
+    _scan_text_tree(monkeypatch, tmp_path, root)
+    with ledger.track("image", "a/b", main._text_content_hash("a cat")):
+        pass
+
+    # 重试/流式阶段以相同内容重写文本：mtime 变化但不应重新生成图片
+    _write(text_path, b"a cat")
+    os.utime(text_path, ns=(1, 1))
+    snapshot = _scan_text_tree(monkeypatch, tmp_path, root)
+    assert snapshot.changed == ["a/b.txt"]
+    assert ledger.statuses("image") == {"a/b": "done"}
+
+    _write(text_path, b"a dog")
+    _scan_text_tree(monkeypatch, tmp_path, root)
+    assert ledger.statuses("image") == {"a/b": "pending"}
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import json
+
+from utils.persistent_cache import PersistentCache
+
+
+def _records(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_flush_appends_only_changed_entries(tmp_path):
+    path = str(tmp_path / "cache.json")
+    cache = PersistentCache(path, flush_every=2, compact_min_records=1000)
+    for i in range(4):
+        cache.set(f"k{i}", {"url": f"u{i}", "size": 1})
+    assert len(_records(path)) == 4
+
+    cache.set("k0", {"url": "new", "size": 1})
+    cache.delete("k1")
+    cache.save()
+    assert len(_records(path)) == 6
+
+    reloaded = PersistentCache(path)
+    assert reloaded.get("k0") == {"url": "new", "size": 1}
+    assert reloaded.get("k1") is None
+    assert len(reloaded) == 3
+
+
+def test_log_is_compacted(tmp_path):
+    path = str(tmp_path / "cache.json")
+    cache = PersistentCache(path, flush_every=1, compact_min_records=10)
+    for i in range(30):
+        cache.set("same", {"n": i})
+    assert len(_records(path)) <= 10
+    assert PersistentCache(path).get("same") == {"n": 29}
+
+
+def test_legacy_json_file_is_migrated(tmp_path):
+    path = str(tmp_path / "cache.json")
+    legacy = {"a": {"value": {"url": "x"}, "created_at": 1e12, "last_used": 1e12}}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(legacy, f)
+
+    cache = PersistentCache(path)
+    assert cache.get("a") == {"url": "x"}
+    cache.save()
+    assert _records(path) == [{"k": "a", "v": cache._entries["a"]}]
+
+
+def test_eviction_is_persisted(tmp_path):
+    path = str(tmp_path / "cache.json")
+    cache = PersistentCache(path, max_entries=2, flush_every=1)
+    for i in range(3):
+        cache.set(f"k{i}", {"n": i})
+    assert len(cache) == 2
+    assert PersistentCache(path).get("k0") is None
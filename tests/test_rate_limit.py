@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+
+from utils.rate_limit import AIMDLimiter
+
+
+def _fixed(limit):
+    return AIMDLimiter(initial=limit, minimum=limit, maximum=limit)
+
+
+def test_async_waiters_respect_limit():
+    limiter = _fixed(2)
+    active = []
+    peak = []
+
+    async def worker():
+        await limiter.acquire_async()
+        active.append(1)
+        peak.append(len(active))
+        await asyncio.sleep(0.001)
+        active.pop()
+        limiter.release()
+
+    async def main():
+        await asyncio.wait_for(asyncio.gather(*(worker() for _ in range(50))), timeout=5)
+
+    asyncio.run(main())
+    assert max(peak) == 2
+    assert limiter.in_flight == 0
+
+
+def test_release_from_thread_wakes_coroutine():
+    limiter = _fixed(1)
+    limiter.acquire()
+
+    async def main():
+        waiter = asyncio.ensure_future(limiter.acquire_async())
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        threading.Timer(0.05, limiter.release).start()
+        await asyncio.wait_for(waiter, timeout=2)
+
+    asyncio.run(main())
+    assert limiter.in_flight == 1
+
+
+def test_cancelled_waiter_passes_slot_on():
+    limiter = _fixed(1)
+    limiter.acquire()
+
+    async def main():
+        first = asyncio.ensure_future(limiter.acquire_async())
+        second = asyncio.ensure_future(limiter.acquire_async())
+        await asyncio.sleep(0.01)
+        limiter.release()
+        # 第一个等待者被唤醒后、重新获取名额前被取消
+        first.cancel()
+        await asyncio.wait_for(second, timeout=2)
+
+    asyncio.run(main())
+    assert limiter.in_flight == 1
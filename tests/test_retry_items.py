@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+import main
+
+
+def _item():
+    return main._RetryItem("a/b", "/tmp/text/a/b.txt", "/tmp/real/a/b.jpg")
+
+
+def test_transient_image_failure_regenerates_image_only():
+    item = _item()
+    item.record_failure("image", "Request timed out.")
+    assert item.needs_recaption is False
+
+
+def test_rejected_image_failure_needs_recaption():
+    item = _item()
+    item.record_failure("image", "prompt rejected by content filter")
+    assert item.needs_recaption is True
+
+
+def test_transient_text_failure_still_needs_recaption():
+    item = _item()
+    item.record_failure("image", "Request timed out.")
+    item.record_failure("text", "Request timed out.")
+    assert item.needs_recaption is True
+    assert item.attempts == 2
+    assert item.reason.startswith("[text]")
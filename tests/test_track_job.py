@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+
+import pytest
+
+import main
+
+
+def test_async_tracking_writes_ledger_off_the_event_loop(ledger, monkeypatch):
+    writer_threads = []
+    mark_running = ledger.mark_running
+    monkeypatch.setattr(
+        ledger, "mark_running", lambda *args: writer_threads.append(threading.get_ident()) or mark_running(*args)
+    )
+
+    async def run():
+        async with main._track_job_async("image", "a/ok", "hash"):
+            await asyncio.sleep(0)
+        with pytest.raises(RuntimeError):
+            async with main._track_job_async("image", "a/bad"):
+                raise RuntimeError("boom")
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+    assert writer_threads and loop_thread not in writer_threads
+    assert ledger.statuses("image") == {"a/ok": "done", "a/bad": "failed"}
+    assert ledger.input_hashes("image")["a/ok"] == "hash"
+
+
+def test_multi_node_ledger_is_per_node(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "_job_ledger", None)
+    monkeypatch.setitem(main.config, "job_ledger_enabled", True)
+    monkeypatch.setitem(main.config, "job_ledger_path", str(tmp_path / "jobs.sqlite3"))
+    monkeypatch.setitem(main.config, "shard_count", 2)
+    monkeypatch.setitem(main.config, "node_id", "host/a")
+
+    ledger = main._get_job_ledger()
+    try:
+        assert ledger.path == str(tmp_path / "jobs.host_a.sqlite3")
+    finally:
+        ledger.close()
+
+
+def test_async_runner_keeps_a_bounded_number_of_coroutines(monkeypatch):
+    monkeypatch.setitem(main.config, "async_max_concurrency", 4)
+    monkeypatch.setitem(main.config, "enable_progress_bar", False)
+    started = []
+    peak = []
+
+    async def worker(task, clients):
+        started.append(task)
+        peak.append(len(asyncio.all_tasks()))
+        await asyncio.sleep(0)
+        return task % 7 != 0, task, "failed"
+
+    errors = asyncio.run(main._run_tasks_async(list(range(100)), worker, "test"))
+    assert started[:4] == [0, 1, 2, 3]
+    assert sorted(started) == list(range(100))
+    # 主协程 + 4 个工作协程
+    assert max(peak) <= 5
+    assert [identifier for identifier, _ in errors] == list(range(0, 100, 7))
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import time
+
+from utils import work_lease
+
+
+def _expire(lock_path):
+    with open(lock_path, "r", encoding="utf-8") as f:
+        holder = json.load(f)
+    holder["expires_at"] = time.time() - 1
+    with open(lock_path, "w", encoding="utf-8") as f:
+        json.dump(holder, f)
+
+
+def test_lockfile_claim_is_exclusive(tmp_path):
+    a = work_lease.LockFileLeaseCoordinator(str(tmp_path), "a", ttl_seconds=60)
+    b = work_lease.LockFileLeaseCoordinator(str(tmp_path), "b", ttl_seconds=60)
+    assert a.try_claim("image", "k")
+    assert not b.try_claim("image", "k")
+    a.release("image", "k", done=False)
+    assert b.try_claim("image", "k")
+
+
+def test_lockfile_expired_lock_is_taken_over_once(tmp_path):
+    a = work_lease.LockFileLeaseCoordinator(str(tmp_path), "a", ttl_seconds=60)
+    b = work_lease.LockFileLeaseCoordinator(str(tmp_path), "b", ttl_seconds=60)
+    c = work_lease.LockFileLeaseCoordinator(str(tmp_path), "c", ttl_seconds=60)
+    assert a.try_claim("image", "k")
+    lock_path, _done_path = a._paths("image", "k")
+    _expire(lock_path)
+    with open(lock_path, "r", encoding="utf-8") as f:
+        expired = f.read()
+
+    # b 与 c 读到了同一个过期的锁，只有先完成接管的一方成功
+    assert b._take_over(lock_path, expired)
+    assert not c._take_over(lock_path, expired)
+    with open(lock_path, "r", encoding="utf-8") as f:
+        assert json.load(f)["owner"] == "b"
+    assert not [name for name in os.listdir(os.path.dirname(lock_path)) if ".takeover-" in name]
+
+
+def test_lockfile_takeover_blocked_by_concurrent_marker(tmp_path):
+    a = work_lease.LockFileLeaseCoordinator(str(tmp_path), "a", ttl_seconds=60)
+    b = work_lease.LockFileLeaseCoordinator(str(tmp_path), "b", ttl_seconds=60)
+    assert a.try_claim("image", "k")
+    lock_path, _done_path = a._paths("image", "k")
+    _expire(lock_path)
+    with open(lock_path, "r", encoding="utf-8") as f:
+        expired = f.read()
+    marker = f"{lock_path}.takeover-{hashlib.sha1(expired.encode('utf-8')).hexdigest()[:16]}"
+    open(marker, "w").close()
+    assert not b.try_claim("image", "k")
+
+
+def test_lockfile_renew_extends_expiry(tmp_path):
+    a = work_lease.LockFileLeaseCoordinator(str(tmp_path), "a", ttl_seconds=60)
+    b = work_lease.LockFileLeaseCoordinator(str(tmp_path), "b", ttl_seconds=60)
+    assert a.try_claim("image", "k")
+    assert a.renew("image", "k")
+    assert not b.renew("image", "k")
+    assert not b.try_claim("image", "k")
+
+
+def test_sqlite_renew_keeps_lease_from_expiring(tmp_path):
+    path = str(tmp_path / "leases.sqlite3")
+    a = work_lease.SQLiteLeaseCoordinator(path, "a", ttl_seconds=0.2)
+    b = work_lease.SQLiteLeaseCoordinator(path, "b", ttl_seconds=0.2)
+    assert a.try_claim("image", "k")
+    a._stop_heartbeat()  # 模拟停止响应的节点，只手动续期
+    time.sleep(0.1)
+    assert a.renew("image", "k") is True
+    time.sleep(0.15)
+    assert not b.try_claim("image", "k")
+    time.sleep(0.3)
+    # 未续期的租约过期后可被接手，原持有者续期失败
+    assert b.try_claim("image", "k")
+    assert a.renew("image", "k") is False
+    a.close()
+    b.close()
+
+
+def test_heartbeat_renews_held_leases(tmp_path):
+    path = str(tmp_path / "leases.sqlite3")
+    a = work_lease.SQLiteLeaseCoordinator(path, "a", ttl_seconds=0.6)
+    b = work_lease.SQLiteLeaseCoordinator(path, "b", ttl_seconds=0.6)
+    assert a.try_claim("image", "k")
+    # 任务运行时间超过 ttl，心跳续期使其他节点无法接手
+    time.sleep(1.2)
+    assert not b.try_claim("image", "k")
+    a.release("image", "k", done=False)
+    time.sleep(0.7)
+    assert b.try_claim("image", "k")
+    a.close()
+    b.close()
@@ -9,28 +9,125 @@
 """
 
 
+import importlib
 import json
 import os
+import threading
+from typing import TYPE_CHECKING
 
 # Load OSS credentials from configuration file
 file_path = os.path.abspath(__file__)
 # Get the directory of the current file, then go up one level to the parent directory
 parent_dir = os.path.dirname(os.path.dirname(file_path))
-# Load the keys.json file from the parent directory
-oss_dict = json.load(open(os.path.join(parent_dir, "keys.json"), "r"))
 
-# Default OSS parameters with clearer names
-default_access_key_id = oss_dict["oss"]["access_key_id"]
-default_access_key_secret = oss_dict["oss"]["access_key_secret"]
-default_bucket_name = oss_dict["oss"]["bucket_name"]
-default_endpoint = oss_dict["oss"]["endpoint"]
+# Classes are imported from their submodule on first attribute access (PEP 562),
+# so `import utils` does not pull in oss2 / numpy / PIL / the Ark SDK.
+_LAZY_ATTRIBUTES = {
+    "DatasetIndexer": "dataset_index",
+    "DatasetSnapshot": "dataset_index",
+    "DirectoryWatcher": "dir_watcher",
+    "JobLedger": "job_ledger",
+    "MemoryBudget": "memory_budget",
+    "MetadataStore": "metadata_store",
+    "MetricsRegistry": "metrics",
+    "PersistentCache": "persistent_cache",
+    "EndpointRateLimiter": "rate_limit",
+    "RateLimitController": "rate_limit",
+    "StreamPipeline": "stream_pipeline",
+    "AliyunOSSImageHost": "image_hosting_service",
+    "AsyncAliyunOSSImageHost": "image_hosting_service",
+    "AsyncImageToTextGenerator": "image_to_text",
+    "ImageToTextGenerator": "image_to_text",
+    "AsyncTextToImageGenerator": "text_to_image",
+    "TextToImageGenerator": "text_to_image",
+}
+_LAZY_SUBMODULES = {
+    "dataset_index",
+    "dir_watcher",
+    "download_image",
+    "image_hosting_service",
+    "image_prep",
+    "image_to_text",
+    "job_ledger",
+    "memory_budget",
+    "metadata_store",
+    "metrics",
+    "perceptual_hash",
+    "persistent_cache",
+    "rate_limit",
+    "stream_pipeline",
+    "text_to_image",
+    "work_lease",
+}
+# Default credentials with clearer names, read from keys.json on first use
+_CREDENTIALS = {
+    "default_access_key_id": ("oss", "access_key_id"),
+    "default_access_key_secret": ("oss", "access_key_secret"),
+    "default_bucket_name": ("oss", "bucket_name"),
+    "default_endpoint": ("oss", "endpoint"),
+    "default_ark_api_key": ("ark", "api_key"),
+    "default_volc_ak": ("volc", "ak"),
+    "default_volc_sk": ("volc", "sk"),
+}
 
-default_ark_api_key = oss_dict["ark"]["api_key"]
+__all__ = sorted(_LAZY_ATTRIBUTES) + sorted(_CREDENTIALS)
 
-default_volc_ak = oss_dict["volc"]["ak"]
-default_volc_sk = oss_dict["volc"]["sk"]
+_keys = None
+_keys_lock = threading.Lock()
 
-# Import at the end to avoid circular imports
-from .image_hosting_service import AliyunOSSImageHost
-from .image_to_text import ImageToTextGenerator
-from .text_to_image import TextToImageGenerator
+
+def keys_path():
+    """Location of keys.json: IMG_TEXT_IMG_KEYS, or keys.json next to the utils package."""
+    return os.environ.get("IMG_TEXT_IMG_KEYS") or os.path.join(parent_dir, "keys.json")
+
+
+def load_keys():
+    """Read and cache keys.json; only called when a credential is actually needed."""
+    global _keys
+    with _keys_lock:
+        if _keys is None:
+            path = keys_path()
+            try:
+                with open(path, "r") as f:
+                    _keys = json.load(f)
+            except FileNotFoundError as exc:
+                raise RuntimeError(
+                    f"Credentials file not found: {path}. Create it or point IMG_TEXT_IMG_KEYS at one."
+                ) from exc
+        return _keys
+
+
+def __getattr__(name):
+    if name in _CREDENTIALS:
+        section, key = _CREDENTIALS[name]
+        value = load_keys()[section][key]
+    elif name == "oss_dict":
+        value = load_keys()
+    elif name in _LAZY_ATTRIBUTES:
+        value = getattr(importlib.import_module(f".{_LAZY_ATTRIBUTES[name]}", __name__), name)
+    elif name in _LAZY_SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES) | set(_CREDENTIALS) | _LAZY_SUBMODULES)
+
+
+if TYPE_CHECKING:  # pragma: no cover - static analysis only
+    from . import image_prep, memory_budget, perceptual_hash, persistent_cache, work_lease
+    from .dataset_index import DatasetIndexer, DatasetSnapshot
+    from .dir_watcher import DirectoryWatcher
+    from .image_hosting_service import AliyunOSSImageHost, AsyncAliyunOSSImageHost
+    from .image_to_text import AsyncImageToTextGenerator, ImageToTextGenerator
+    from .job_ledger import JobLedger
+    from .memory_budget import MemoryBudget
+    from .metadata_store import MetadataStore
+    from .metrics import MetricsRegistry
+    from .persistent_cache import PersistentCache
+    from .rate_limit import EndpointRateLimiter, RateLimitController
+    from .stream_pipeline import StreamPipeline
+    from .text_to_image import AsyncTextToImageGenerator, TextToImageGenerator
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+@File    :   dataset_index.py
+@Time    :   2026/10/16 13:30:55
+@Author  :   tyqqj
+@Version :   1.0
+@Contact :   tyqqj0@163.com
+@Desc    :   os.scandir based dataset indexer with change detection between runs
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+from typing import Dict, List, Optional, Sequence, Tuple
+
+FileSignature = Tuple[int, int]  # (size, mtime_ns)
+
+
+class DatasetSnapshot:
+    """Result of one scan: every matching file plus the diff against the previous run."""
+
+    def __init__(
+        self,
+        root: str,
+        entries: Dict[str, FileSignature],
+        added: List[str],
+        changed: List[str],
+        deleted: List[str],
+    ) -> None:
+        self.root = root
+        self.entries = entries
+        self.added = added
+        self.changed = changed
+        self.deleted = deleted
+
+    def paths(self) -> List[str]:
+        """Relative paths (``/``-separated) in a stable order."""
+        return sorted(self.entries)
+
+    def absolute_path(self, relative_path: str) -> str:
+        return os.path.join(self.root, *relative_path.split("/"))
+
+
+class DatasetIndexer:
+    """
+    Walk a directory tree once with ``os.scandir`` and remember each file's
+    ``(size, mtime_ns)`` in ``cache_path`` so the next scan can report which
+    files were added, changed or deleted in between.
+    """
+
+    def __init__(self, root: str, extensions: Sequence[str], cache_path: Optional[str] = None) -> None:
+        self.root = root
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.cache_path = cache_path
+
+    def _walk(self) -> Dict[str, FileSignature]:
+        entries: Dict[str, FileSignature] = {}
+        stack = [("", self.root)]
+        while stack:
+            relative_dir, directory = stack.pop()
+            try:
+                iterator = os.scandir(directory)
+            except OSError as exc:
+                print(f"Failed to scan directory {directory}: {exc}")
+                continue
+            with iterator:
+                for entry in iterator:
+                    relative_path = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append((relative_path, entry.path))
+                            continue
+                        if not entry.name.lower().endswith(self.extensions):
+                            continue
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries[relative_path] = (stat.st_size, stat.st_mtime_ns)
+        return entries
+
+    def _load_previous(self) -> Optional[Dict[str, FileSignature]]:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return None
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return {path: (int(size), int(mtime)) for path, (size, mtime) in data.items()}
+        except Exception as exc:
+            print(f"Failed to load dataset index {self.cache_path}, treating all files as new: {exc}")
+            return None
+
+    def _save(self, entries: Dict[str, FileSignature]) -> None:
+        directory = os.path.dirname(os.path.abspath(self.cache_path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix=".index_", suffix=".json", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(temp_path, self.cache_path)
+        except Exception as exc:
+            print(f"Failed to write dataset index {self.cache_path}: {exc}")
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+
+    def scan(self) -> DatasetSnapshot:
+        entries = self._walk()
+        previous = self._load_previous()
+        if previous is None:
+            added, changed, deleted = sorted(entries), [], []
+        else:
+            added = sorted(path for path in entries if path not in previous)
+            changed = sorted(
+                path for path, signature in entries.items() if path in previous and previous[path] != signature
+            )
+            deleted = sorted(path for path in previous if path not in entries)
+        if self.cache_path:
+            self._save(entries)
+        return DatasetSnapshot(self.root, entries, added, changed, deleted)
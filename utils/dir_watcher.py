@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+@File    :   dir_watcher.py
+@Time    :   2026/10/16 19:40:31
+@Author  :   tyqqj
+@Version :   1.0
+@Contact :   tyqqj0@163.com
+@Desc    :   Watch a dataset tree (inotify or polling) and yield files once they stop changing
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Dict, Iterator, Optional, Sequence, Set, Tuple
+
+from .dataset_index import DatasetIndexer, FileSignature
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags  # type: ignore[import]
+except ImportError:  # pragma: no cover - optional dependency (Linux only)
+    INotify = None
+    inotify_flags = None
+
+
+class _InotifyBackend:
+    """Recursive inotify watches; reports paths touched since the last ``poll``."""
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self._inotify = INotify()
+        self._dir_mask = (
+            inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO | inotify_flags.CREATE
+            | inotify_flags.DELETE_SELF | inotify_flags.MOVE_SELF
+        )
+        self._dirs: Dict[int, str] = {}
+        self.overflowed = False
+        self._watch_tree(root)
+
+    def _watch_tree(self, directory: str) -> Set[str]:
+        """Watch ``directory`` and its sub-directories; return files already inside them."""
+        found = set()
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            try:
+                wd = self._inotify.add_watch(current, self._dir_mask)
+            except OSError as exc:
+                print(f"Failed to watch directory {current}: {exc}")
+                continue
+            self._dirs[wd] = current
+            try:
+                with os.scandir(current) as iterator:
+                    for entry in iterator:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        else:
+                            found.add(entry.path)
+            except OSError:
+                continue
+        return found
+
+    def poll(self, timeout: float) -> Set[str]:
+        touched: Set[str] = set()
+        for event in self._inotify.read(timeout=int(timeout * 1000)):
+            if event.mask & inotify_flags.Q_OVERFLOW:
+                self.overflowed = True
+                continue
+            directory = self._dirs.get(event.wd)
+            if directory is None:
+                continue
+            if event.mask & inotify_flags.IGNORED:
+                self._dirs.pop(event.wd, None)
+                continue
+            if not event.name:
+                continue
+            path = os.path.join(directory, event.name)
+            if event.mask & inotify_flags.ISDIR:
+                if event.mask & (inotify_flags.CREATE | inotify_flags.MOVED_TO):
+                    # 目录被移入时其中的文件不会产生事件，需要补扫
+                    touched |= self._watch_tree(path)
+                continue
+            if event.mask & (inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO | inotify_flags.CREATE):
+                touched.add(path)
+        return touched
+
+    def close(self) -> None:
+        self._inotify.close()
+
+
+class DirectoryWatcher:
+    """
+    Yield ``(path, changed)`` for image files that appear or change under ``root``.
+
+    A file is only reported once its ``(size, mtime_ns)`` has stayed the same
+    for ``debounce_seconds``, so copies still in progress are not picked up.
+    ``changed`` is True when a previously reported file was modified. The
+    first scan reports every existing file so a restarted service catches up.
+
+    Uses inotify (``pip install inotify_simple``) when available and falls
+    back to polling with ``DatasetIndexer`` every ``poll_interval`` seconds;
+    with inotify a full rescan still runs every ``rescan_interval`` seconds
+    to cover missed or overflowed events.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        extensions: Sequence[str],
+        debounce_seconds: float = 2.0,
+        poll_interval: float = 5.0,
+        rescan_interval: float = 300.0,
+        use_inotify: bool = True,
+    ) -> None:
+        self.root = root
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.debounce_seconds = debounce_seconds
+        self.poll_interval = poll_interval
+        self.rescan_interval = rescan_interval
+        self.use_inotify = use_inotify and INotify is not None
+        self._indexer = DatasetIndexer(root, extensions)
+        self._reported: Dict[str, FileSignature] = {}
+        self._pending: Dict[str, Tuple[FileSignature, float]] = {}
+
+    @property
+    def backend(self) -> str:
+        return "inotify" if self.use_inotify else "polling"
+
+    def _wanted(self, path: str) -> bool:
+        name = os.path.basename(path)
+        return not name.startswith(".") and name.lower().endswith(self.extensions)
+
+    def _rescan(self) -> None:
+        now = time.monotonic()
+        settled_before = time.time() - self.debounce_seconds
+        for relative_path, signature in self._indexer.scan().entries.items():
+            path = os.path.join(self.root, *relative_path.split("/"))
+            if not self._wanted(path) or self._reported.get(path) == signature or path in self._pending:
+                continue
+            # 修改时间早于防抖窗口的文件已经稳定，无需再等待
+            settled = signature[1] / 1e9 <= settled_before
+            self._pending[path] = (signature, now - self.debounce_seconds if settled else now)
+
+    def _touch(self, paths) -> None:
+        now = time.monotonic()
+        for path in paths:
+            if not self._wanted(path):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            self._pending[path] = ((stat.st_size, stat.st_mtime_ns), now)
+
+    def _ready(self) -> Iterator[Tuple[str, bool]]:
+        now = time.monotonic()
+        for path, (signature, since) in list(self._pending.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self._pending[path]  # 被删除或移走
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != signature:
+                self._pending[path] = (current, now)
+                continue
+            if now - since < self.debounce_seconds:
+                continue
+            del self._pending[path]
+            if self._reported.get(path) == current:
+                continue
+            changed = path in self._reported
+            self._reported[path] = current
+            yield path, changed
+
+    def watch(self, stop_event: Optional[threading.Event] = None) -> Iterator[Tuple[str, bool]]:
+        stop_event = stop_event or threading.Event()
+        backend = _InotifyBackend(self.root) if self.use_inotify else None
+        try:
+            self._rescan()
+            last_rescan = time.monotonic()
+            while not stop_event.is_set():
+                # 有待稳定的文件时缩短等待，以便及时产出
+                wait = self.poll_interval
+                if self._pending:
+                    wait = min(wait, max(0.1, self.debounce_seconds / 2))
+                if backend is not None:
+                    self._touch(backend.poll(wait))
+                    if backend.overflowed or time.monotonic() - last_rescan >= self.rescan_interval:
+                        backend.overflowed = False
+                        self._rescan()
+                        last_rescan = time.monotonic()
+                else:
+                    stop_event.wait(wait)
+                    if time.monotonic() - last_rescan >= self.poll_interval:
+                        self._rescan()
+                        last_rescan = time.monotonic()
+                yield from self._ready()
+        finally:
+            if backend is not None:
+                backend.close()
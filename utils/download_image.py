@@ -8,23 +8,141 @@
 @Desc    :   None
 """
 
+import asyncio
+import contextlib
+import json
 import os
+import threading
+
 import requests
+import requests.adapters
 from urllib.parse import urlparse
 
+try:
+    import aiohttp  # type: ignore[import]
+except ImportError:  # pragma: no cover - optional dependency
+    aiohttp = None
+
 code = {
     "success": 0,
     "error": 1,
 }
 
 
-def download_image(image_url, save_path):
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+DOWNLOAD_TIMEOUT = (10, 60)  # (connect, read) seconds
+PARTIAL_SUFFIX = ".part"
+# .part 旁边记录其来源 URL 与校验值（ETag / Last-Modified），只有同一资源才续传
+PARTIAL_STATE_SUFFIX = ".part.json"
+# 这些 4xx 状态码表示稍后重试可能成功，其余 4xx（如签名 URL 过期的 403/404）立即失败
+RETRYABLE_CLIENT_ERRORS = (408, 429)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_pool_size = 32
+
+
+def configure_download_pool(pool_size):
+    """设置之后新建的每主机连接池大小（线程引擎下应不小于下载并发数）。"""
+    global _pool_size
+    _pool_size = max(1, int(pool_size))
+
+
+def _get_session(image_url):
+    """每个主机复用一个 keep-alive 会话，避免每次下载都重新建立 TCP/TLS 连接。"""
+    host = urlparse(image_url).netloc
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=_pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[host] = session
+        return session
+
+
+def _expected_total_length(status_code, headers):
+    """Total file size announced by the server, or None if unknown."""
+    if status_code == 206:
+        content_range = headers.get("Content-Range", "")
+        total = content_range.rsplit("/", 1)[-1]
+        return int(total) if total.isdigit() else None
+    content_length = headers.get("Content-Length")
+    return int(content_length) if content_length and content_length.isdigit() else None
+
+
+def _discard_partial(save_path):
+    for suffix in (PARTIAL_SUFFIX, PARTIAL_STATE_SUFFIX):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(save_path + suffix)
+
+
+def _resume_headers(image_url, save_path):
+    """
+    续传请求头。残留的 .part 只有在来源 URL 与记录一致时才续传，并带上 If-Range，
+    资源已变化时服务端返回 200 整个文件；来源不明或 URL 不同（例如重新生成得到的新图片）时丢弃残留文件。
+    """
+    partial_path = save_path + PARTIAL_SUFFIX
+    if not os.path.exists(partial_path):
+        return {}
+    try:
+        with open(save_path + PARTIAL_STATE_SUFFIX, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = None
+    resume_from = os.path.getsize(partial_path)
+    if not state or state.get("url") != image_url or not resume_from:
+        _discard_partial(save_path)
+        return {}
+    headers = {"Range": f"bytes={resume_from}-"}
+    if state.get("validator"):
+        headers["If-Range"] = state["validator"]
+    return headers
+
+
+def _record_partial_source(image_url, save_path, headers):
+    state = {"url": image_url, "validator": headers.get("ETag") or headers.get("Last-Modified")}
+    with open(save_path + PARTIAL_STATE_SUFFIX, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+
+
+def _finalize_download(partial_path, save_path, expected_length):
+    written = os.path.getsize(partial_path)
+    if expected_length is not None and written != expected_length:
+        raise IOError(f"incomplete download: got {written} of {expected_length} bytes")
+    os.replace(partial_path, save_path)
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(save_path + PARTIAL_STATE_SUFFIX)
+
+
+def _should_retry(attempt, max_attempts, status=None):
+    """
+    同步与异步下载共用的重试判定。status 为 HTTP 状态码；连接中断、超时与本地写入错误传 None。
+    """
+    if attempt >= max_attempts:
+        return False
+    return status is None or not (400 <= status < 500) or status in RETRYABLE_CLIENT_ERRORS
+
+
+def download_image(image_url, save_path, rate_limiter=None, max_attempts=3):
     """
     Download an image from a URL and save it to the specified path.
+
+    The body is streamed into ``save_path + ".part"`` over a pooled keep-alive
+    session. An interrupted transfer is resumed with an HTTP Range request
+    (also across runs, since the partial file is kept) only when the partial
+    file came from the same URL; ``If-Range`` with the recorded ETag makes the
+    server send the whole file if it changed. The final size is checked
+    against the server's length, and only then is the file renamed into
+    place, so ``save_path`` never holds a truncated or mixed image. HTTP 4xx
+    errors other than 408/429 fail immediately instead of being retried.
     
     Args:
         image_url (str): The URL of the image to download
         save_path (str): The path where the image should be saved
+        rate_limiter (EndpointRateLimiter, optional): Limiter shared by all downloads
+        max_attempts (int): Transfer attempts, each resuming where the last stopped
     
     Returns:
         str: The path where the image was saved
@@ -32,27 +150,133 @@ def download_image(image_url, save_path):
     Raises:
         Exception: If the download fails or the image cannot be saved
     """
+    partial_path = save_path + PARTIAL_SUFFIX
+    session = _get_session(image_url)
     try:
         # Create directory if it doesn't exist
         os.makedirs(os.path.dirname(save_path), exist_ok=True)
-        
-        # Send a GET request to the image URL
-        response = requests.get(image_url, stream=True)
-        response.raise_for_status()  # Raise an exception for HTTP errors
-        
-        # Save the image to the specified path
-        with open(save_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        
-        return code["success"]
-    
+
+        for attempt in range(1, max_attempts + 1):
+            headers = _resume_headers(image_url, save_path)
+            limited = rate_limiter.limit() if rate_limiter is not None else contextlib.nullcontext()
+            try:
+                with limited:
+                    with session.get(image_url, stream=True, headers=headers, timeout=DOWNLOAD_TIMEOUT) as response:
+                        if response.status_code == 416:
+                            # 服务端不接受续传位置，丢弃残留文件重新下载
+                            _discard_partial(save_path)
+                            continue
+                        response.raise_for_status()  # Raise an exception for HTTP errors
+                        expected_length = _expected_total_length(response.status_code, response.headers)
+                        # 200 表示服务端返回完整文件（不支持续传或 If-Range 校验失败），覆盖残留内容
+                        mode = "ab" if response.status_code == 206 else "wb"
+                        if mode == "wb":
+                            _record_partial_source(image_url, save_path, response.headers)
+                        with open(partial_path, mode) as f:
+                            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                                f.write(chunk)
+                _finalize_download(partial_path, save_path, expected_length)
+                return code["success"]
+            except requests.exceptions.HTTPError as e:
+                if not _should_retry(attempt, max_attempts, e.response.status_code if e.response is not None else None):
+                    raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError):
+                if not _should_retry(attempt, max_attempts):
+                    raise
+            except requests.exceptions.RequestException:
+                # InvalidURL、MissingSchema 等同样是 IOError 的子类，但重试不会成功
+                raise
+            except OSError:
+                # 本地文件写入或 _finalize_download 的长度校验失败
+                if not _should_retry(attempt, max_attempts):
+                    raise
+
+        raise IOError(f"gave up after {max_attempts} attempts")
+
     except requests.exceptions.RequestException as e:
         raise Exception(f"Failed to download image from {image_url}: {str(e)}")
     except IOError as e:
         raise Exception(f"Failed to save image to {save_path}: {str(e)}")
 
 
+def create_async_download_session(max_connections=100):
+    """
+    创建供 async_download_image 复用的 aiohttp 会话；未安装 aiohttp 时返回 None。
+    需在事件循环中调用。
+    """
+    if aiohttp is None:
+        return None
+    connector = aiohttp.TCPConnector(limit=max_connections)
+    return aiohttp.ClientSession(connector=connector)
+
+
+async def _write_response_async(response, partial_path, mode):
+    """把响应体写入 .part 文件，文件操作放到线程中执行，不阻塞事件循环。"""
+    f = await asyncio.to_thread(open, partial_path, mode)
+    try:
+        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+            await asyncio.to_thread(f.write, chunk)
+    finally:
+        await asyncio.to_thread(f.close)
+
+
+async def async_download_image(image_url, save_path, session=None, rate_limiter=None, max_attempts=3):
+    """
+    download_image 的 asyncio 版本，同样写入 .part 临时文件、校验长度后原子重命名，
+    按相同规则续传与重试（_should_retry），并使用相同的 DOWNLOAD_TIMEOUT。
+
+    传入 aiohttp 会话时在事件循环中直接下载（文件读写放到线程中），否则退回到线程中执行同步版本。
+    """
+    if session is None:
+        return await asyncio.to_thread(download_image, image_url, save_path, rate_limiter, max_attempts)
+
+    partial_path = save_path + PARTIAL_SUFFIX
+    connect_timeout, read_timeout = DOWNLOAD_TIMEOUT
+    timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+    try:
+        await asyncio.to_thread(os.makedirs, os.path.dirname(save_path), exist_ok=True)
+
+        for attempt in range(1, max_attempts + 1):
+            headers = await asyncio.to_thread(_resume_headers, image_url, save_path)
+            limited = rate_limiter.limit_async() if rate_limiter is not None else contextlib.nullcontext()
+            try:
+                async with limited:
+                    async with session.get(image_url, headers=headers, timeout=timeout) as response:
+                        if response.status == 416:
+                            # 服务端不接受续传位置，丢弃残留文件重新下载
+                            await asyncio.to_thread(_discard_partial, save_path)
+                            continue
+                        response.raise_for_status()
+                        expected_length = _expected_total_length(response.status, response.headers)
+                        mode = "ab" if response.status == 206 else "wb"
+                        if mode == "wb":
+                            await asyncio.to_thread(_record_partial_source, image_url, save_path, response.headers)
+                        await _write_response_async(response, partial_path, mode)
+                await asyncio.to_thread(_finalize_download, partial_path, save_path, expected_length)
+                return code["success"]
+            except aiohttp.ClientResponseError as e:
+                if not _should_retry(attempt, max_attempts, e.status):
+                    raise
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError):
+                if not _should_retry(attempt, max_attempts):
+                    raise
+            except aiohttp.ClientError:
+                raise
+            except OSError:
+                if not _should_retry(attempt, max_attempts):
+                    raise
+
+        raise IOError(f"gave up after {max_attempts} attempts")
+
+    except aiohttp.ClientError as e:
+        raise Exception(f"Failed to download image from {image_url}: {str(e)}")
+    except asyncio.TimeoutError:
+        raise Exception(f"Failed to download image from {image_url}: timed out")
+    except IOError as e:
+        raise Exception(f"Failed to save image to {save_path}: {str(e)}")
+
+
 def download_image_auto_filename(image_url, save_dir):
     """
     Download an image from a URL and save it to the specified directory,
@@ -10,7 +10,16 @@
 
 
 
+import asyncio
+import contextlib
+import functools
+import hashlib
+import json
+import math
+import os
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 import numpy as np
 
@@ -20,42 +29,82 @@ from PIL import Image
 import io
 import oss2
 
-# Import default values from package initialization
-from . import (
-    default_access_key_id,
-    default_access_key_secret,
-    default_bucket_name,
-    default_endpoint,
-)
+from .persistent_cache import PersistentCache, hash_bytes, hash_file
+
+DEFAULT_MULTIPART_THRESHOLD = 10 * 1024 * 1024
+DEFAULT_MULTIPART_PART_SIZE = 2 * 1024 * 1024
+# OSS 单个分片上传最多 10000 个分片
+_MAX_PARTS = 10000
+# batch_delete_objects 单次最多 1000 个对象
+_MAX_BATCH_DELETE = 1000
+DEFAULT_CHECKPOINT_MAX_AGE = 7 * 86400
 
 
 class AliyunOSSImageHost:
+    """
+    上传图片到阿里云 OSS 并返回可访问的 URL。
+
+    实例可在多个线程间共享：所有请求复用同一个 oss2.Session 连接池（pool_size 个连接），
+    不必每个线程各建一个实例和连接池。
+    """
+
     def __init__(
         self,
         access_key_id=None,
         access_key_secret=None,
         bucket_name=None,
         endpoint=None,
+        upload_cache: PersistentCache = None,
+        rate_limiter=None,
+        multipart_threshold=DEFAULT_MULTIPART_THRESHOLD,
+        multipart_part_size=DEFAULT_MULTIPART_PART_SIZE,
+        multipart_threads=4,
+        checkpoint_dir=None,
+        checkpoint_max_age_seconds=DEFAULT_CHECKPOINT_MAX_AGE,
+        pool_size=None,
     ):
+        # Default values from package initialization (keys.json is read on first use)
         if access_key_id is None:
-            access_key_id = default_access_key_id
+            from . import default_access_key_id as access_key_id
         if access_key_secret is None:
-            access_key_secret = default_access_key_secret
+            from . import default_access_key_secret as access_key_secret
         if bucket_name is None:
-            bucket_name = default_bucket_name
+            from . import default_bucket_name as bucket_name
         if endpoint is None:
-            endpoint = default_endpoint
+            from . import default_endpoint as endpoint
 
         # 记录开始时间的文本
         self.start_time = time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime())
 
         self.auth = oss2.Auth(access_key_id, access_key_secret)
-        self.bucket = oss2.Bucket(self.auth, endpoint, bucket_name)
+        # None 表示 oss2 默认的连接池大小
+        self.session = oss2.Session(pool_size=pool_size)
+        self.bucket = oss2.Bucket(self.auth, endpoint, bucket_name, session=self.session)
+        # 最近一次上传的 URL，仅供 get_cache_url 兼容旧调用；实例在线程间共享，上传方法不读回该字段
         self.cache_url = None
+        # 内容哈希 -> 已上传对象的缓存，可在多个实例/多次运行之间共享
+        self.upload_cache = upload_cache
+        # 可选的 EndpointRateLimiter，所有上传共享同一配额/并发限制
+        self.rate_limiter = rate_limiter
+        # 不小于 multipart_threshold 的对象分片并行上传；None 表示始终单次 PUT
+        self.multipart_threshold = multipart_threshold
+        self.multipart_part_size = max(100 * 1024, int(multipart_part_size))
+        self.multipart_threads = max(1, int(multipart_threads))
+        # 断点记录目录，按 (bucket, 内容哈希) 记录未完成的分片上传，之后任一次运行上传相同内容时从已完成的分片继续；
+        # None 表示不续传。超过 checkpoint_max_age_seconds 的断点视为废弃，取消其分片上传并删除记录
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_max_age_seconds = checkpoint_max_age_seconds
+        self._checkpoint_sweep_lock = threading.Lock()
+        self._checkpoints_swept = False
+        # 续传到之前运行文件夹中的对象，delete_folder() 清理本次运行时一并删除
+        self._resumed_keys = []
 
-    def upload_image(self, image_path, folder=None):
-        print("Uploading image to Aliyun OSS...")
-        file_key = image_path.split("/")[-1]
+    def _limited(self):
+        if self.rate_limiter is None:
+            return contextlib.nullcontext()
+        return self.rate_limiter.limit()
+
+    def _apply_folder(self, file_key, folder):
         if folder is not None:
             if isinstance(folder, str):
                 if not folder.endswith("/"):
@@ -69,18 +118,229 @@ class AliyunOSSImageHost:
                 raise ValueError(
                     "Invalid folder parameter. Expected a string or a boolean"
                 )
-        result = self.bucket.put_object_from_file(file_key, image_path)
+        return file_key
+
+    def _object_url(self, file_key):
+        bucket_endpoint = self.bucket.endpoint
         # 假设原始的endpoint可能包含'http://'
-        if "http://" in self.bucket.endpoint:
-            bucket_endpoint = self.bucket.endpoint.replace("http://", "")
+        if "http://" in bucket_endpoint:
+            bucket_endpoint = bucket_endpoint.replace("http://", "")
 
         # 或者如果包含'https://'
-        elif "https://" in self.bucket.endpoint:
-            bucket_endpoint = self.bucket.endpoint.replace("https://", "")
+        elif "https://" in bucket_endpoint:
+            bucket_endpoint = bucket_endpoint.replace("https://", "")
+        return f"http://{self.bucket.bucket_name}.{bucket_endpoint}/{file_key}"
+
+    def _use_multipart(self, size):
+        return self.multipart_threshold is not None and size >= self.multipart_threshold
+
+    def _put_file(self, file_key, image_path, content_hash=None):
+        """上传本地文件，返回 (实际写入的对象 key, 结果)；续传时 key 为断点记录中的对象。"""
+        size = os.path.getsize(image_path)
+        if not self._use_multipart(size):
+            return file_key, self.bucket.put_object_from_file(file_key, image_path)
+
+        def read_chunk(offset, length):
+            with open(image_path, "rb") as f:
+                f.seek(offset)
+                return f.read(length)
+
+        if content_hash is None and self.checkpoint_dir:
+            content_hash = hash_file(image_path)
+        return self._multipart_put(file_key, size, read_chunk, content_hash)
+
+    def _put_bytes(self, file_key, data, content_hash=None):
+        """上传内存数据，返回值同 _put_file。"""
+        if not self._use_multipart(len(data)):
+            return file_key, self.bucket.put_object(file_key, data)
+        view = memoryview(data).cast("B")
+        if content_hash is None and self.checkpoint_dir:
+            content_hash = hash_bytes(view)
+        return self._multipart_put(
+            file_key, len(view), lambda offset, length: bytes(view[offset:offset + length]), content_hash
+        )
+
+    def _checkpoint_path(self, content_hash):
+        if not self.checkpoint_dir or content_hash is None:
+            return None
+        name = hashlib.sha1(f"{self.bucket.bucket_name}/{content_hash}".encode("utf-8")).hexdigest()
+        return os.path.join(self.checkpoint_dir, "multipart", name + ".json")
+
+    @staticmethod
+    def _load_checkpoint(checkpoint_path):
+        try:
+            with open(checkpoint_path, "r", encoding="utf-8") as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(checkpoint, dict) or "key" not in checkpoint or "upload_id" not in checkpoint:
+            return None
+        return checkpoint
+
+    def _abort_upload(self, checkpoint):
+        try:
+            self.bucket.abort_multipart_upload(checkpoint["key"], checkpoint["upload_id"])
+        except oss2.exceptions.NoSuchUpload:
+            pass
+        except Exception as exc:
+            print(f"Failed to abort multipart upload {checkpoint['upload_id']} of {checkpoint['key']}: {exc}")
+
+    def _sweep_stale_checkpoints(self):
+        """每个实例首次分片上传时执行一次：取消并删除超过 checkpoint_max_age_seconds 的断点。"""
+        with self._checkpoint_sweep_lock:
+            if self._checkpoints_swept or not self.checkpoint_dir or self.checkpoint_max_age_seconds is None:
+                return
+            self._checkpoints_swept = True
+        directory = os.path.join(self.checkpoint_dir, "multipart")
+        if not os.path.isdir(directory):
+            return
+        cutoff = time.time() - self.checkpoint_max_age_seconds
+        for name in os.listdir(directory):
+            checkpoint_path = os.path.join(directory, name)
+            try:
+                if os.path.getmtime(checkpoint_path) >= cutoff:
+                    continue
+            except OSError:
+                continue
+            checkpoint = self._load_checkpoint(checkpoint_path)
+            if checkpoint is not None:
+                self._abort_upload(checkpoint)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(checkpoint_path)
+
+    def _resume_parts(self, checkpoint, size, part_size, read_chunk):
+        """
+        返回断点记录中 (upload_id, 已完成且内容一致的分片)；没有可续传的上传时返回 (None, {})，
+        参数不一致的旧上传会被取消。分片 ETag 即其内容的 MD5，据此确认服务端已有的分片与本次数据相同。
+        """
+        if checkpoint.get("size") != size or checkpoint.get("part_size") != part_size:
+            self._abort_upload(checkpoint)
+            return None, {}
+        upload_id = checkpoint["upload_id"]
+        done = {}
+        try:
+            for part in oss2.PartIterator(self.bucket, checkpoint["key"], upload_id):
+                chunk = read_chunk((part.part_number - 1) * part_size, part_size)
+                if part.size == len(chunk) and part.etag.strip('"').upper() == hashlib.md5(chunk).hexdigest().upper():
+                    done[part.part_number] = oss2.models.PartInfo(part.part_number, part.etag, size=part.size)
+        except oss2.exceptions.NoSuchUpload:
+            return None, {}
+        return upload_id, done
+
+    def _multipart_put(self, file_key, size, read_chunk, content_hash):
+        part_size = max(self.multipart_part_size, math.ceil(size / _MAX_PARTS))
+        self._sweep_stale_checkpoints()
+        checkpoint_path = self._checkpoint_path(content_hash)
+        upload_id, done = None, {}
+        checkpoint = self._load_checkpoint(checkpoint_path) if checkpoint_path is not None else None
+        if checkpoint is not None:
+            upload_id, done = self._resume_parts(checkpoint, size, part_size, read_chunk)
+            if upload_id is not None and checkpoint["key"] != file_key:
+                # 分片上传绑定对象 key，续传只能完成到上次的 key（通常位于之前运行的 start_time 文件夹）
+                file_key = checkpoint["key"]
+                self._resumed_keys.append(file_key)
+        if upload_id is None:
+            upload_id = self.bucket.init_multipart_upload(file_key).upload_id
+            if checkpoint_path is not None:
+                os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+                with open(checkpoint_path, "w", encoding="utf-8") as f:
+                    json.dump({"key": file_key, "upload_id": upload_id, "size": size, "part_size": part_size}, f)
+
+        def upload_part(part_number):
+            chunk = read_chunk((part_number - 1) * part_size, part_size)
+            result = self.bucket.upload_part(file_key, upload_id, part_number, chunk)
+            return oss2.models.PartInfo(part_number, result.etag, size=len(chunk))
+
+        pending = [number for number in range(1, math.ceil(size / part_size) + 1) if number not in done]
+        # 失败时保留断点记录与已上传的分片，之后上传相同内容时续传；长期未续传的由 _sweep_stale_checkpoints 取消
+        with ThreadPoolExecutor(max_workers=min(self.multipart_threads, max(1, len(pending)))) as executor:
+            for part in executor.map(upload_part, pending):
+                done[part.part_number] = part
+        result = self.bucket.complete_multipart_upload(file_key, upload_id, [done[n] for n in sorted(done)])
+        if checkpoint_path is not None:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(checkpoint_path)
+        return file_key, result
+
+    def _lookup_cached_upload(self, content_hash):
+        """
+        Return the URL of a previously uploaded object with the same content,
+        or None if it is unknown or no longer present in the bucket.
+        """
+        if self.upload_cache is None:
+            return None
+        entry = self.upload_cache.get(content_hash)
+        if not entry:
+            return None
+        try:
+            exists = self.bucket.object_exists(entry["key"])
+        except Exception as exc:
+            print(f"Failed to verify cached OSS object {entry.get('key')}: {exc}")
+            exists = False
+        if not exists:
+            self.upload_cache.delete(content_hash)
+            return None
+        return entry["url"]
+
+    def _remember_upload(self, content_hash, file_key, url, size):
+        if self.upload_cache is None:
+            return
+        self.upload_cache.set(content_hash, {"key": file_key, "url": url, "size": size})
+
+    def upload_image(self, image_path, folder=None):
+        content_hash = None
+        file_key = image_path.split("/")[-1]
+        if self.upload_cache is not None:
+            content_hash = hash_file(image_path)
+            cached_url = self._lookup_cached_upload(content_hash)
+            if cached_url:
+                self.cache_url = cached_url
+                return cached_url
+            # 以内容哈希命名，避免同名文件在同一文件夹下互相覆盖导致缓存指向错误内容
+            file_key = content_hash + os.path.splitext(file_key)[1].lower()
+
+        print("Uploading image to Aliyun OSS...")
+        file_key = self._apply_folder(file_key, folder)
+        with self._limited():
+            file_key, result = self._put_file(file_key, image_path, content_hash)
 
         if result.status == 200:
-            self.cache_url = f"http://{self.bucket.bucket_name}.{bucket_endpoint}/{file_key}"
-            return self.cache_url
+            url = self._object_url(file_key)
+            self.cache_url = url
+            if content_hash is not None:
+                self._remember_upload(content_hash, file_key, url, os.path.getsize(image_path))
+            return url
+        else:
+            return None
+
+    def upload_bytes(self, data, file_name, folder=None):
+        """
+        直接从内存上传图片字节到OSS，不经过临时文件。
+        :param data: bytes / bytearray / memoryview
+        :param file_name: 保存在OSS上的文件名（启用上传缓存时仅使用其扩展名）
+        :return: 图片在OSS上的URL或上传失败时返回None
+        """
+        content_hash = None
+        file_key = file_name.split("/")[-1]
+        if self.upload_cache is not None:
+            content_hash = hash_bytes(data)
+            cached_url = self._lookup_cached_upload(content_hash)
+            if cached_url:
+                self.cache_url = cached_url
+                return cached_url
+            file_key = content_hash + os.path.splitext(file_key)[1].lower()
+
+        print("Uploading image to Aliyun OSS...")
+        file_key = self._apply_folder(file_key, folder)
+        with self._limited():
+            file_key, result = self._put_bytes(file_key, data, content_hash)
+
+        if result.status == 200:
+            url = self._object_url(file_key)
+            self.cache_url = url
+            if content_hash is not None:
+                self._remember_upload(content_hash, file_key, url, len(data))
+            return url
         else:
             return None
 
@@ -101,19 +361,7 @@ class AliyunOSSImageHost:
         if array.ndim != 2:
             raise ValueError("Only 2D arrays are supported.")
 
-        if folder is not None:
-            if isinstance(folder, str):
-                if not folder.endswith("/"):
-                    folder += "/"
-                file_name = folder + file_name
-            elif isinstance(folder, bool):
-                if folder:
-                    folder = self.start_time
-                    file_name = folder + "/" + file_name
-            else:
-                raise ValueError(
-                    "Invalid folder parameter. Expected a string or a boolean"
-                )
+        file_name = self._apply_folder(file_name, folder)
 
         # 将NumPy数组转换为Pillow图像
         image = Image.fromarray(np.uint8(array))
@@ -124,19 +372,113 @@ class AliyunOSSImageHost:
         img_byte_arr = img_byte_arr.getvalue()
 
         # 上传到OSS
-        result = self.bucket.put_object(file_name, img_byte_arr)
-        # 假设原始的endpoint可能包含'http://'
-        if "http://" in self.bucket.endpoint:
-            bucket_endpoint = self.bucket.endpoint.replace("http://", "")
-
-        # 或者如果包含'https://'
-        elif "https://" in self.bucket.endpoint:
-            bucket_endpoint = self.bucket.endpoint.replace("https://", "")
+        with self._limited():
+            file_name, result = self._put_bytes(file_name, img_byte_arr)
         if result.status == 200:
-            self.cache_url = f"http://{self.bucket.bucket_name}.{bucket_endpoint}/{file_name}"
-            return self.cache_url
+            url = self._object_url(file_name)
+            self.cache_url = url
+            return url
         else:
             return None
 
+    def _upload_item(self, item, folder):
+        if isinstance(item, str):
+            return item, self.upload_image(item, folder=folder)
+        file_name, data = item
+        return file_name, self.upload_bytes(data, file_name, folder=folder)
+
+    def upload_iter(self, items, folder=None, max_workers=8):
+        """
+        并发上传，每完成一个就产出 (path, url)，顺序为完成顺序。
+
+        :param items: 可迭代对象，元素为本地文件路径，或 (file_name, bytes) 形式的内存数据；
+                      按需读取，同时在途的任务不超过 2 * max_workers 个
+        :param max_workers: 上传线程数，与调用方的线程数无关；所有请求共享本实例的连接池
+        :return: 生成器；上传失败时 url 为 None
+        """
+        max_workers = max(1, int(max_workers))
+        iterator = iter(items)
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="oss-upload") as executor:
+            in_flight = {}
+            exhausted = object()
+
+            def submit_next():
+                item = next(iterator, exhausted)
+                if item is exhausted:
+                    return False
+                in_flight[executor.submit(self._upload_item, item, folder)] = item
+                return True
+
+            while len(in_flight) < 2 * max_workers and submit_next():
+                pass
+            while in_flight:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    item = in_flight.pop(future)
+                    try:
+                        yield future.result()
+                    except Exception as exc:
+                        name = item if isinstance(item, str) else item[0]
+                        print(f"Failed to upload {name} to Aliyun OSS: {exc}")
+                        yield name, None
+                    submit_next()
+
+    def upload_many(self, items, folder=None, max_workers=8):
+        """upload_iter 的阻塞版本，返回 {path: url}（失败为 None）。"""
+        return dict(self.upload_iter(items, folder=folder, max_workers=max_workers))
+
+    def delete_folder(self, folder=None):
+        """
+        批量删除某个文件夹下的全部对象，每次请求最多 1000 个。
+        :param folder: 文件夹前缀，None 表示本实例上传时使用的 start_time 文件夹（以及本实例续传到其他文件夹的对象）
+        :return: 删除的对象数量
+        """
+        prefix = folder if folder is not None else self.start_time
+        if not prefix.endswith("/"):
+            prefix += "/"
+        deleted = 0
+        batch = []
+        if folder is None:
+            for start in range(0, len(self._resumed_keys), _MAX_BATCH_DELETE):
+                keys = self._resumed_keys[start:start + _MAX_BATCH_DELETE]
+                deleted += len(self.bucket.batch_delete_objects(keys).deleted_keys)
+            self._resumed_keys = []
+        for obj in oss2.ObjectIterator(self.bucket, prefix=prefix, max_keys=_MAX_BATCH_DELETE):
+            batch.append(obj.key)
+            if len(batch) == _MAX_BATCH_DELETE:
+                deleted += len(self.bucket.batch_delete_objects(batch).deleted_keys)
+                batch = []
+        if batch:
+            deleted += len(self.bucket.batch_delete_objects(batch).deleted_keys)
+        return deleted
+
     def get_cache_url(self):
         return self.cache_url
+
+
+class AsyncAliyunOSSImageHost:
+    """
+    AliyunOSSImageHost 的 asyncio 接口。
+
+    oss2 只提供同步传输，这里把上传放到一个专用的小线程池中执行，
+    上传并发由 max_concurrency 决定，与调用方的协程数量无关。
+    """
+
+    def __init__(self, host: AliyunOSSImageHost = None, max_concurrency=16, **host_kwargs):
+        self.host = host if host is not None else AliyunOSSImageHost(**host_kwargs)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, int(max_concurrency)), thread_name_prefix="oss-upload"
+        )
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def upload_image(self, image_path, folder=None):
+        return await self._run(self.host.upload_image, image_path, folder=folder)
+
+    async def upload_bytes(self, data, file_name, folder=None):
+        return await self._run(self.host.upload_bytes, data, file_name, folder=folder)
+
+    async def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+@File    :   image_prep.py
+@Time    :   2026/10/16 15:02:44
+@Author  :   tyqqj
+@Version :   1.0
+@Contact :   tyqqj0@163.com
+@Desc    :   CPU-bound image preparation (downscale / JPEG re-encode) before captioning
+"""
+
+import io
+import math
+import os
+
+try:
+    from PIL import Image  # type: ignore[import]
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+
+def physical_cpu_count():
+    """物理核心数；未安装 psutil 时退回逻辑核心数。"""
+    try:
+        import psutil  # type: ignore[import]
+
+        count = psutil.cpu_count(logical=False)
+        if count:
+            return count
+    except ImportError:
+        pass
+    return os.cpu_count() or 1
+
+
+def needs_reencode(image_path, max_total_pixels, max_file_size_bytes):
+    """
+    只读取文件大小与图片头判断是否需要缩放/重编码，开销很小，可在 I/O 线程中调用。
+    """
+    file_size = os.path.getsize(image_path)
+    if Image is None:
+        if file_size > max_file_size_bytes:
+            print(
+                "Install Pillow to automatically downscale oversized images for text generation "
+                "(pip install pillow)."
+            )
+        return False
+    if file_size > max_file_size_bytes:
+        return True
+    with Image.open(image_path) as img:
+        width, height = img.size
+    return width * height > max_total_pixels
+
+
+def _target_size(width, height, max_total_pixels):
+    total_pixels = width * height
+    if total_pixels <= max_total_pixels:
+        return width, height
+    scale_factor = math.sqrt(max_total_pixels / float(total_pixels))
+    return max(1, int(width * scale_factor)), max(1, int(height * scale_factor))
+
+
+def _draft_scale(width, height, target_size):
+    """与 Pillow JpegImageFile.draft 相同的缩小倍数：不超过目标比例的 8/4/2/1。"""
+    scale = min(width // target_size[0], height // target_size[1])
+    for candidate in (8, 4, 2, 1):
+        if scale >= candidate:
+            return candidate
+    return 1
+
+
+def _bytes_per_pixel(mode):
+    # Pillow 内部以 32 位存储多通道像素（RGB 也占 4 字节）
+    if mode in ("1", "L", "P"):
+        return 1
+    if mode.startswith("I;16"):
+        return 2
+    return 4
+
+
+def estimate_peak_bytes(image_path, max_total_pixels, max_file_size_bytes):
+    """
+    只读取图片头，预估 encode_image_for_upload 的峰值内存（字节）：
+    解码结果（JPEG 按 draft 后的尺寸）、最多两份目标尺寸的 RGB 副本与 JPEG 编码缓冲。
+    """
+    if Image is None:
+        return 0
+    with Image.open(image_path) as img:
+        width, height = img.size
+        mode, image_format = img.mode, img.format
+    target_size = _target_size(width, height, max_total_pixels)
+    scale = _draft_scale(width, height, target_size) if image_format == "JPEG" else 1
+    decoded = math.ceil(width / scale) * math.ceil(height / scale) * _bytes_per_pixel(mode)
+    working = target_size[0] * target_size[1] * 4
+    return decoded + 2 * working + 2 * max_file_size_bytes
+
+
+def _encode_jpeg(image, quality, optimize):
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", optimize=optimize, quality=quality)
+    return buffer
+
+
+def encode_jpeg_to_size(image, max_file_size_bytes, min_quality=50, max_quality=95):
+    """
+    Encode ``image`` as JPEG at the highest quality in [min_quality, max_quality]
+    that fits ``max_file_size_bytes``.
+
+    Tries max_quality first (the common case after a resize), then bisects,
+    so at most ~7 trial encodes instead of a linear sweep. Trials skip
+    ``optimize`` and only the final encode uses it; optimized Huffman tables
+    never make the output larger, so the result still fits. Falls back to
+    min_quality if even that is too large.
+    """
+    if _encode_jpeg(image, max_quality, False).tell() <= max_file_size_bytes:
+        chosen = max_quality
+    else:
+        chosen = min_quality
+        low, high = min_quality, max_quality - 1
+        while low <= high:
+            mid = (low + high) // 2
+            if _encode_jpeg(image, mid, False).tell() <= max_file_size_bytes:
+                chosen = mid
+                low = mid + 1
+            else:
+                high = mid - 1
+    return _encode_jpeg(image, chosen, True).getvalue()
+
+
+def encode_image_for_upload(image_path, max_total_pixels, max_file_size_bytes):
+    """
+    Downscale/re-encode an image so it fits the pixel and byte limits.
+
+    JPEGs are decoded with ``draft`` straight to the nearest 1/2, 1/4 or 1/8
+    scale above the target size, and the rest of the reduction uses
+    ``reducing_gap`` before the final Lanczos pass, so a 40 MP source is
+    never fully decoded when a much smaller output is wanted. Other formats
+    are box-reduced by an integer factor first and the full-size decode is
+    released before converting and resampling.
+
+    Module-level and free of global state so it can run in a process pool.
+    Returns the JPEG bytes, or None when the original file can be sent as is.
+    """
+    if Image is None:
+        return None
+
+    file_size = os.path.getsize(image_path)
+    source = Image.open(image_path)
+    try:
+        width, height = source.size
+        target_size = _target_size(width, height, max_total_pixels)
+        needs_resize = target_size != (width, height)
+        needs_reencode = file_size > max_file_size_bytes
+
+        if not needs_resize and not needs_reencode:
+            return None
+
+        prepared = source
+        if needs_resize:
+            source.draft("RGB", target_size)
+            factor = min(source.size[0] // target_size[0], source.size[1] // target_size[1])
+            if factor >= 2:
+                try:
+                    prepared = source.reduce(factor)
+                except ValueError:
+                    pass  # 该模式不支持 reduce，交给 resize 处理
+                else:
+                    source.close()  # 尽早释放全尺寸解码结果
+        if prepared.mode != "RGB":
+            prepared = prepared.convert("RGB")
+        if prepared.size != target_size:
+            resample_filter = getattr(getattr(Image, "Resampling", Image), "LANCZOS", getattr(Image, "LANCZOS"))
+            prepared = prepared.resize(target_size, resample_filter, reducing_gap=3.0)
+
+        return encode_jpeg_to_size(prepared, max_file_size_bytes)
+    finally:
+        source.close()
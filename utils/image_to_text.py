@@ -8,24 +8,95 @@
 @Desc    :   None
 """
 
-from volcenginesdkarkruntime import Ark
+import asyncio
+import base64
+import mimetypes
+import time
+
+from volcenginesdkarkruntime import Ark, AsyncArk
+
+from .rate_limit import retry_delay_seconds
 
 
 
 class ImageToTextGenerator:
-    def __init__(self, api_key=None):
+    def __init__(
+        self,
+        api_key=None,
+        base_url=None,
+        model_name="doubao-seed-1-6-flash-250828",
+        max_retries=3,
+        retry_interval_seconds=1.5,
+        rate_limiter=None,
+        estimated_tokens=0,
+    ):
+        """
+        :param rate_limiter: 可选的 EndpointRateLimiter，用于配额与自适应并发控制
+        :param estimated_tokens: 每次请求预估消耗的 token 数，用于 TPM 配额预扣
+        """
         if api_key is None:
             from . import default_ark_api_key
             self.api_key = default_ark_api_key
         else:
             self.api_key = api_key
-        self.client = Ark(api_key=self.api_key)
+        self.model_name = model_name
+        self.max_retries = max(1, max_retries)
+        self.retry_interval_seconds = retry_interval_seconds
+        self.rate_limiter = rate_limiter
+        self.estimated_tokens = estimated_tokens
+        self.client = self._create_client(self.api_key, base_url)
+
+    @staticmethod
+    def _create_client(api_key, base_url=None):
+        if base_url is None:
+            return Ark(api_key=api_key)
+        return Ark(api_key=api_key, base_url=base_url)
+
+    @staticmethod
+    def to_data_url(data: bytes, file_name: str = None, mime_type: str = None) -> str:
+        """
+        将图片字节编码为 base64 data URL，可直接作为 generate 的 image_url 使用，
+        从而跳过图床上传。
+        """
+        if mime_type is None:
+            mime_type = mimetypes.guess_type(file_name or "")[0] or "image/jpeg"
+        encoded = base64.b64encode(data).decode("ascii")
+        return f"data:{mime_type};base64,{encoded}"
 
     def generate(self, image_url: str, text_prompt=None) -> str:
+        """
+        :param image_url: 图片的 http(s) URL 或 to_data_url 生成的 data URL
+        """
+        request = self._build_request(image_url, text_prompt)
+        last_error = None
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                if self.rate_limiter is None:
+                    resp = self.client.chat.completions.create(**request)
+                else:
+                    with self.rate_limiter.limit(tokens=self.estimated_tokens):
+                        resp = self.client.chat.completions.create(**request)
+                    self._record_usage(resp)
+                return resp.choices[0].message.content
+            except Exception as exc:  # pragma: no cover - network dependent
+                last_error = exc
+                if attempt == self.max_retries:
+                    break
+                time.sleep(retry_delay_seconds(attempt, exc, self.retry_interval_seconds))
+
+        raise RuntimeError(f"Failed to generate text after {self.max_retries} attempts: {last_error}")
+
+    def _record_usage(self, resp):
+        usage = getattr(resp, "usage", None)
+        total_tokens = getattr(usage, "total_tokens", None)
+        if total_tokens is not None:
+            self.rate_limiter.record_tokens(total_tokens - self.estimated_tokens)
+
+    def _build_request(self, image_url: str, text_prompt=None) -> dict:
         if text_prompt is None:
             text_prompt = "图片主要讲了什么?"
-        resp = self.client.chat.completions.create(
-            model="doubao-seed-1-6-flash-250828",
+        return dict(
+            model=self.model_name,
             messages=[
                 {
                     "content": [
@@ -41,4 +112,38 @@ class ImageToTextGenerator:
                 }
             ],
         )
-        return resp.choices[0].message.content
+
+
+class AsyncImageToTextGenerator(ImageToTextGenerator):
+    """ImageToTextGenerator 的 asyncio 版本，基于 AsyncArk，需在事件循环中使用。"""
+
+    @staticmethod
+    def _create_client(api_key, base_url=None):
+        if base_url is None:
+            return AsyncArk(api_key=api_key)
+        return AsyncArk(api_key=api_key, base_url=base_url)
+
+    async def generate(self, image_url: str, text_prompt=None) -> str:
+        request = self._build_request(image_url, text_prompt)
+        last_error = None
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                if self.rate_limiter is None:
+                    resp = await self.client.chat.completions.create(**request)
+                else:
+                    async with self.rate_limiter.limit_async(tokens=self.estimated_tokens):
+                        resp = await self.client.chat.completions.create(**request)
+                    self._record_usage(resp)
+                return resp.choices[0].message.content
+            except Exception as exc:  # pragma: no cover - network dependent
+                last_error = exc
+                if attempt == self.max_retries:
+                    break
+                await asyncio.sleep(retry_delay_seconds(attempt, exc, self.retry_interval_seconds))
+
+        raise RuntimeError(f"Failed to generate text after {self.max_retries} attempts: {last_error}")
+
+    async def close(self):
+        close = getattr(self.client, "close", None)
+        if close is not None:
+            await close()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+@File    :   job_ledger.py
+@Time    :   2026/10/16 12:41:08
+@Author  :   tyqqj
+@Version :   1.0
+@Contact :   tyqqj0@163.com
+@Desc    :   Durable per-stage job state stored in SQLite
+"""
+
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    key TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    input_hash TEXT,
+    started_at REAL,
+    finished_at REAL,
+    duration REAL,
+    error TEXT,
+    PRIMARY KEY (stage, key)
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_stage_status ON jobs (stage, status);
+"""
+
+
+class JobLedger:
+    """
+    Per-stage job state keyed by the item's relative path (without extension).
+
+    A job left in ``running`` by a killed process is treated like ``pending``,
+    so the next run resumes exactly the unfinished items.
+
+    The database runs in WAL mode, which only works for processes on one
+    host; nodes sharing a network filesystem need one ledger file each.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def statuses(self, stage: str) -> Dict[str, str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT key, status FROM jobs WHERE stage = ?", (stage,)).fetchall()
+        return dict(rows)
+
+    def input_hashes(self, stage: str) -> Dict[str, Optional[str]]:
+        """The input hash each job was last started with (``None`` when it was never recorded)."""
+        with self._lock:
+            rows = self._conn.execute("SELECT key, input_hash FROM jobs WHERE stage = ?", (stage,)).fetchall()
+        return dict(rows)
+
+    def pending(self, stage: str) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key FROM jobs WHERE stage = ? AND status != ?", (stage, STATUS_DONE)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def register(self, stage: str, keys: Iterable[str], status: str = STATUS_PENDING) -> None:
+        """Insert jobs that are not tracked yet; existing rows are left untouched."""
+        rows = [(key, stage, status) for key in keys]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany("INSERT OR IGNORE INTO jobs (key, stage, status) VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+    def reset(self, stage: str, keys: Iterable[str]) -> None:
+        """Force jobs back to pending, e.g. after their output was deleted or invalidated."""
+        rows = [(key, stage, STATUS_PENDING) for key in keys]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO jobs (key, stage, status) VALUES (?, ?, ?) "
+                "ON CONFLICT (stage, key) DO UPDATE SET status = excluded.status, error = NULL",
+                rows,
+            )
+            self._conn.commit()
+
+    def mark_running(self, stage: str, key: str, input_hash: Optional[str] = None) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (key, stage, status, attempts, input_hash, started_at) VALUES (?, ?, ?, 1, ?, ?) "
+                "ON CONFLICT (stage, key) DO UPDATE SET status = excluded.status, attempts = attempts + 1, "
+                "input_hash = COALESCE(excluded.input_hash, input_hash), started_at = excluded.started_at",
+                (key, stage, STATUS_RUNNING, input_hash, time.time()),
+            )
+            self._conn.commit()
+
+    def mark_finished(self, stage: str, key: str, error: Optional[str] = None) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, duration = ? - COALESCE(started_at, ?), error = ? "
+                "WHERE stage = ? AND key = ?",
+                (STATUS_FAILED if error else STATUS_DONE, now, now, now, error, stage, key),
+            )
+            self._conn.commit()
+
+    @contextmanager
+    def track(self, stage: str, key: str, input_hash: Optional[str] = None):
+        """Mark the job running, then done or failed depending on how the block exits."""
+        self.mark_running(stage, key, input_hash)
+        try:
+            yield
+        except Exception as exc:
+            self.mark_finished(stage, key, error=str(exc) or type(exc).__name__)
+            raise
+        self.mark_finished(stage, key)
+
+    def summary(self, stage: str) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM jobs WHERE stage = ? GROUP BY status", (stage,)
+            ).fetchall()
+        return dict(rows)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+@File    :   memory_budget.py
+@Time    :   2026/10/16 21:12:05
+@Author  :   tyqqj
+@Version :   1.0
+@Contact :   tyqqj0@163.com
+@Desc    :   Process-wide memory budget for image decoding, plus memory limit / peak RSS probes
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - Windows
+    resource = None
+
+_CGROUP_LIMIT_FILES = (
+    "/sys/fs/cgroup/memory.max",  # cgroup v2
+    "/sys/fs/cgroup/memory/memory.limit_in_bytes",  # cgroup v1
+)
+
+
+def detect_memory_limit() -> Optional[int]:
+    """容器（cgroup）内存上限；未设置时返回物理内存大小，都无法获取时返回 None。"""
+    physical = None
+    try:
+        physical = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        pass
+    for path in _CGROUP_LIMIT_FILES:
+        try:
+            with open(path, "r") as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit():
+            limit = int(value)
+            # cgroup v1 未设置上限时是一个接近 2^63 的值
+            if physical is None or limit < physical:
+                return limit
+    return physical
+
+
+def peak_rss_bytes() -> Dict[str, Optional[int]]:
+    """
+    本进程与已退出子进程的峰值 RSS（ru_maxrss）。仍在运行的子进程
+    （例如 prep 进程池）要等进程池关闭后才计入 children。
+    """
+    if resource is None:
+        return {"self": None, "children": None}
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    unit = 1 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit,
+    }
+
+
+class MemoryBudget:
+    """
+    A counting budget of bytes shared by all worker threads.
+
+    ``acquire(n)`` blocks until ``n`` bytes are free, so decoding many large
+    images at once waits for memory instead of running the container out of
+    it. A single reservation larger than the whole budget is admitted once
+    nothing else is reserved, so an oversized image cannot deadlock the run.
+    Waiters are admitted in arrival order to keep large images from starving.
+    """
+
+    def __init__(self, limit_bytes: int) -> None:
+        self.limit_bytes = max(1, int(limit_bytes))
+        self._condition = threading.Condition()
+        self._in_use = 0
+        self._queue = []
+        self.peak_bytes = 0
+        self.reservations = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def _fits(self, size: int) -> bool:
+        return self._in_use == 0 or self._in_use + size <= self.limit_bytes
+
+    def acquire(self, size: int) -> None:
+        size = max(0, int(size))
+        with self._condition:
+            self.reservations += 1
+            if not self._queue and self._fits(size):
+                self._grant(size)
+                return
+            ticket = object()
+            self._queue.append(ticket)
+            self.waits += 1
+            started = time.monotonic()
+            try:
+                while self._queue[0] is not ticket or not self._fits(size):
+                    self._condition.wait()
+            finally:
+                self._queue.remove(ticket)
+                self._condition.notify_all()
+            self.wait_seconds += time.monotonic() - started
+            self._grant(size)
+
+    def _grant(self, size: int) -> None:
+        self._in_use += size
+        self.peak_bytes = max(self.peak_bytes, self._in_use)
+
+    def release(self, size: int) -> None:
+        with self._condition:
+            self._in_use -= max(0, int(size))
+            self._condition.notify_all()
+
+    def stats(self) -> Dict[str, float]:
+        with self._condition:
+            return {
+                "limit_bytes": self.limit_bytes,
+                "in_use_bytes": self._in_use,
+                "peak_bytes": self.peak_bytes,
+                "reservations": self.reservations,
+                "waits": self.waits,
+                "wait_seconds": self.wait_seconds,
+            }
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+@File    :   metadata_store.py
+@Time    :   2026/10/16 14:18:21
+@Author  :   tyqqj
+@Version :   1.0
+@Contact :   tyqqj0@163.com
+@Desc    :   Single append-only metadata store loaded once into memory
+"""
+
+from __future__ import annotations
+
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
+
+
+def _read_records(
+    path: str, offset: int = 0, whole_lines: bool = False
+) -> Tuple[Dict[str, Dict[str, Any]], int, int]:
+    """
+    Last record per key from a JSON Lines file starting at byte ``offset``, its
+    valid line count and the offset read up to; missing files read as empty.
+    ``whole_lines`` stops before a trailing line another process is still writing.
+    """
+    records: Dict[str, Dict[str, Any]] = {}
+    lines = 0
+    if not os.path.exists(path):
+        return records, lines, offset
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line_no, raw in enumerate(f, 1):
+            if whole_lines and not raw.endswith(b"\n"):
+                break
+            offset += len(raw)
+            line = raw.decode("utf-8", errors="replace").strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+                key = record.pop("key")
+            except Exception as exc:
+                # 进程被杀时最后一行可能只写了一半
+                print(f"Skipping corrupt metadata line {line_no} in {path}: {exc}")
+                continue
+            records[key] = record
+            lines += 1
+    return records, lines, offset
+
+
+def part_path(path: str, node_id: str) -> str:
+    """Per-node part file next to ``path``: ``metadata.jsonl`` -> ``metadata.part-<node>.jsonl``."""
+    stem, ext = os.path.splitext(path)
+    safe_node = "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in node_id)
+    return f"{stem}.part-{safe_node}{ext or '.jsonl'}"
+
+
+def list_part_paths(path: str) -> List[str]:
+    stem, ext = os.path.splitext(path)
+    return sorted(glob.glob(f"{glob.escape(stem)}.part-*{ext or '.jsonl'}"))
+
+
+def merge_parts(path: str, remove_parts: bool = True) -> int:
+    """
+    Fold every per-node part into ``path`` (parts applied oldest first, so the
+    newest record per key wins) and rewrite it compacted. Only run this while
+    no node is writing.
+    """
+    parts = sorted(list_part_paths(path), key=os.path.getmtime)
+    records = _read_records(path)[0]
+    for part in parts:
+        records.update(_read_records(part)[0])
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix=".metadata_", suffix=".jsonl", dir=directory)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        for key, record in records.items():
+            f.write(json.dumps({"key": key, **record}, ensure_ascii=False) + "\n")
+    os.replace(temp_path, path)
+    if remove_parts:
+        for part in parts:
+            os.remove(part)
+    return len(records)
+
+
+class MetadataStore:
+    """
+    Image metadata kept in one append-only JSON Lines file.
+
+    Each ``put`` appends a ``{"key": ..., **record}`` line; on load the last
+    line per key wins, so lookups afterwards are plain dict hits. ``compact``
+    rewrites the file without superseded lines once they make up more than
+    half of it.
+
+    ``read_paths`` are loaded read-only underneath (e.g. the merged store and
+    other nodes' parts when this store is one node's part); only records of
+    ``path`` itself are written back by ``compact``. ``read_paths`` may be a
+    callable so that parts created later are found too: with ``refresh_interval``
+    set, a lookup miss re-reads what was appended to them since the last read,
+    at most once per interval.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        read_paths: Union[Sequence[str], Callable[[], Sequence[str]]] = (),
+        refresh_interval: Optional[float] = None,
+    ) -> None:
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self._read_paths = read_paths
+        # 只读文件 -> (inode, 已读到的字节偏移)
+        self._read_offsets: Dict[str, Tuple[int, int]] = {}
+        self._last_refresh = 0.0
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._owned: Set[str] = set()
+        self._log_lines = 0
+        self._lock = threading.Lock()
+        self._load()
+        # 其他节点写出的分片只读加载，自己的记录优先
+        self._refresh_locked()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _load(self) -> None:
+        records, self._log_lines, end = _read_records(self.path, whole_lines=True)
+        self._records.update(records)
+        self._owned.update(records)
+        self._repair_tail(end)
+
+    def _repair_tail(self, end: int) -> None:
+        """
+        进程在写入中途被杀时文件末尾会留下没有换行的半行，之后追加的记录会接在它后面而无法解析。
+        末尾是完整记录时补上换行，否则截断到最后一个换行。
+        """
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == end:
+            return
+        with open(self.path, "r+b") as f:
+            f.seek(end)
+            tail = f.read()
+            try:
+                record = json.loads(tail.decode("utf-8"))
+                key = record.pop("key")
+            except Exception:
+                print(f"Dropping incomplete trailing metadata line in {self.path}.")
+                f.truncate(end)
+                return
+            f.write(b"\n")
+        self._records[key] = record
+        self._owned.add(key)
+        self._log_lines += 1
+
+    def _refresh_locked(self) -> None:
+        """增量读取只读文件新追加的记录；文件被替换（例如被压缩）时从头重读。"""
+        self._last_refresh = time.monotonic()
+        read_paths = self._read_paths() if callable(self._read_paths) else self._read_paths
+        own_path = os.path.abspath(self.path)
+        for read_path in read_paths:
+            if os.path.abspath(read_path) == own_path:
+                continue
+            try:
+                stat = os.stat(read_path)
+            except OSError:
+                continue
+            inode, offset = self._read_offsets.get(read_path, (stat.st_ino, 0))
+            if inode != stat.st_ino or stat.st_size < offset:
+                offset = 0
+            elif stat.st_size == offset:
+                continue
+            records, _, offset = _read_records(read_path, offset, whole_lines=True)
+            self._read_offsets[read_path] = (stat.st_ino, offset)
+            for key, record in records.items():
+                if key not in self._owned:
+                    self._records[key] = record
+
+    def _lookup_locked(self, key: str) -> Optional[Dict[str, Any]]:
+        record = self._records.get(key)
+        if (
+            record is None
+            and self.refresh_interval is not None
+            and time.monotonic() - self._last_refresh >= self.refresh_interval
+        ):
+            self._refresh_locked()
+            record = self._records.get(key)
+        return record
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._lookup_locked(key)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return self._lookup_locked(key) is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._records)
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            snapshot = list(self._records.items())
+        return iter(snapshot)
+
+    def put(self, key: str, record: Dict[str, Any]) -> None:
+        line = json.dumps({"key": key, **record}, ensure_ascii=False)
+        with self._lock:
+            self._records[key] = dict(record)
+            self._owned.add(key)
+            self._file.write(line + "\n")
+            self._file.flush()
+            self._log_lines += 1
+
+    def compact(self, force: bool = False) -> None:
+        with self._lock:
+            if not force and self._log_lines <= 2 * len(self._owned):
+                return
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, temp_path = tempfile.mkstemp(prefix=".metadata_", suffix=".jsonl", dir=directory)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                for key in self._owned:
+                    f.write(json.dumps({"key": key, **self._records[key]}, ensure_ascii=False) + "\n")
+            self._file.close()
+            os.replace(temp_path, self.path)
+            self._file = open(self.path, "a", encoding="utf-8")
+            self._log_lines = len(self._owned)
+
+    def export_json(self, path: str, key_suffix: str = "") -> int:
+        """Write every record into a single JSON object keyed by ``key + key_suffix``."""
+        index = {key + key_suffix: record for key, record in self.items()}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False, indent=2)
+        return len(index)
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+@File    :   metrics.py
+@Time    :   2026/10/16 17:48:26
+@Author  :   tyqqj
+@Version :   1.0
+@Contact :   tyqqj0@163.com
+@Desc    :   Per-stage latency histograms with Prometheus textfile / JSONL export
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+QUANTILES = (0.5, 0.95, 0.99)
+METRIC_PREFIX = "img_text_img"
+
+
+class Span:
+    """Handle yielded by ``MetricsRegistry.span``; set ``bytes`` once the payload size is known."""
+
+    __slots__ = ("bytes",)
+
+    def __init__(self) -> None:
+        self.bytes = 0
+
+
+class StageHistogram:
+    """
+    Latency samples of one stage plus byte and error totals.
+
+    Quantiles are computed from a uniform reservoir of at most ``max_samples``
+    durations, so memory stays bounded on very long runs.
+    """
+
+    def __init__(self, max_samples: int = 20_000) -> None:
+        self.max_samples = max_samples
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.total_bytes = 0
+        self._samples: List[float] = []
+        self._rng = random.Random(0)
+
+    def observe(self, seconds: float, nbytes: int = 0, error: bool = False) -> None:
+        self.count += 1
+        self.total_seconds += seconds
+        self.total_bytes += nbytes
+        if error:
+            self.errors += 1
+        if len(self._samples) < self.max_samples:
+            self._samples.append(seconds)
+            return
+        slot = self._rng.randrange(self.count)
+        if slot < self.max_samples:
+            self._samples[slot] = seconds
+
+    def quantiles(self) -> Dict[float, float]:
+        if not self._samples:
+            return {q: 0.0 for q in QUANTILES}
+        ordered = sorted(self._samples)
+        last = len(ordered) - 1
+        return {q: ordered[min(last, int(round(q * last)))] for q in QUANTILES}
+
+    def to_dict(self) -> Dict[str, Any]:
+        quantiles = self.quantiles()
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "total_seconds": self.total_seconds,
+            "bytes": self.total_bytes,
+            "p50": quantiles[0.5],
+            "p95": quantiles[0.95],
+            "p99": quantiles[0.99],
+        }
+
+
+class MetricsRegistry:
+    """
+    Thread-safe collection of ``StageHistogram`` keyed by stage name.
+
+    ``span`` times a block (including ``await`` inside it) and records it as
+    an error when the block raises. A disabled registry keeps the same API
+    but records nothing.
+    """
+
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._stages: Dict[str, StageHistogram] = {}
+        self._started = time.time()
+
+    def observe(self, stage: str, seconds: float, nbytes: int = 0, error: bool = False) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = StageHistogram()
+            histogram.observe(seconds, nbytes, error)
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[Span]:
+        handle = Span()
+        started = time.perf_counter()
+        try:
+            yield handle
+        except BaseException:
+            self.observe(stage, time.perf_counter() - started, handle.bytes, error=True)
+            raise
+        self.observe(stage, time.perf_counter() - started, handle.bytes)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {stage: histogram.to_dict() for stage, histogram in self._stages.items()}
+
+    def report(self, title: Optional[str] = None) -> None:
+        summary = self.summary()
+        if not summary:
+            return
+        print(f"Stage timings{f' ({title})' if title else ''}:")
+        for stage, stats in sorted(summary.items(), key=lambda item: -item[1]["total_seconds"]):
+            line = (
+                f" - {stage:<16} n={stats['count']:<6} p50={stats['p50'] * 1000:.0f}ms "
+                f"p95={stats['p95'] * 1000:.0f}ms p99={stats['p99'] * 1000:.0f}ms "
+                f"total={stats['total_seconds']:.1f}s"
+            )
+            if stats["bytes"]:
+                line += f" bytes={stats['bytes'] / (1024 * 1024):.1f}MB"
+            if stats["errors"]:
+                line += f" errors={stats['errors']}"
+            print(line)
+
+    def write_prometheus(self, path: str, labels: Optional[Dict[str, str]] = None) -> None:
+        """Write a node_exporter textfile-collector file, replacing it atomically."""
+        summary = self.summary()
+        extra = "".join(f',{key}="{value}"' for key, value in (labels or {}).items())
+        seconds = f"{METRIC_PREFIX}_stage_seconds"
+        lines = [
+            f"# HELP {seconds} Wall time spent in each pipeline stage.",
+            f"# TYPE {seconds} summary",
+        ]
+        for stage, stats in sorted(summary.items()):
+            for q, key in zip(QUANTILES, ("p50", "p95", "p99")):
+                lines.append(f'{seconds}{{stage="{stage}"{extra},quantile="{q}"}} {stats[key]:.6f}')
+            lines.append(f'{seconds}_sum{{stage="{stage}"{extra}}} {stats["total_seconds"]:.6f}')
+            lines.append(f'{seconds}_count{{stage="{stage}"{extra}}} {stats["count"]}')
+        for name, key, help_text in (
+            ("stage_bytes_total", "bytes", "Payload bytes handled by each pipeline stage."),
+            ("stage_errors_total", "errors", "Failed spans per pipeline stage."),
+        ):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} counter")
+            for stage, stats in sorted(summary.items()):
+                lines.append(f'{METRIC_PREFIX}_{name}{{stage="{stage}"{extra}}} {stats[key]}')
+        lines.append(f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge")
+        run_labels = f"{{{extra.lstrip(',')}}}" if extra else ""
+        lines.append(f"{METRIC_PREFIX}_last_run_timestamp_seconds{run_labels} {time.time():.0f}")
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # textfile collector 可能随时读取，先写临时文件再替换
+        fd, temp_path = tempfile.mkstemp(prefix=".metrics_", suffix=".prom", dir=directory)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temp_path, path)
+
+    def write_jsonl(self, path: str, labels: Optional[Dict[str, str]] = None) -> None:
+        """Append one line per run with every stage's summary."""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        record = {
+            "started_at": self._started,
+            "finished_at": time.time(),
+            **(labels or {}),
+            "stages": self.summary(),
+        }
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
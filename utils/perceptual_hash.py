@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+@File    :   perceptual_hash.py
+@Time    :   2026/10/16 16:25:03
+@Author  :   tyqqj
+@Version :   1.0
+@Contact :   tyqqj0@163.com
+@Desc    :   DCT perceptual hashes and BK-tree near-duplicate clustering
+"""
+
+from __future__ import annotations
+
+import math
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    from PIL import Image  # type: ignore[import]
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+HASH_SIZE = 8
+SAMPLE_SIZE = HASH_SIZE * 4
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """Orthonormal DCT-II matrix, so ``D @ X @ D.T`` is the 2-D DCT of ``X``."""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(math.pi * (2 * i + 1) * k / (2 * n)) * math.sqrt(2.0 / n)
+    matrix[0, :] = math.sqrt(1.0 / n)
+    return matrix
+
+
+_DCT = _dct_matrix(SAMPLE_SIZE)
+
+
+def _load_thumbnail(image_path: str) -> np.ndarray:
+    if Image is None:
+        raise ImportError("Pillow is required for perceptual hashing (pip install pillow).")
+    with Image.open(image_path) as img:
+        # JPEG 直接按 1/8 缩放解码，避免完整解码大图
+        img.draft("L", (SAMPLE_SIZE * 4, SAMPLE_SIZE * 4))
+        gray = img.convert("L").resize((SAMPLE_SIZE, SAMPLE_SIZE), getattr(Image, "BILINEAR"))
+    return np.asarray(gray, dtype=np.float32)
+
+
+def phash_batch(image_paths: Sequence[str]) -> List[Optional[int]]:
+    """
+    64-bit DCT perceptual hashes for ``image_paths``. The DCT, median threshold
+    and bit packing run vectorized over the whole batch. Unreadable images get None.
+    """
+    thumbnails = []
+    valid_index = []
+    for idx, path in enumerate(image_paths):
+        try:
+            thumbnails.append(_load_thumbnail(path))
+            valid_index.append(idx)
+        except Exception as exc:
+            print(f"Failed to hash image {path}: {exc}")
+
+    hashes: List[Optional[int]] = [None] * len(image_paths)
+    if not thumbnails:
+        return hashes
+
+    stack = np.stack(thumbnails)  # (N, 32, 32)
+    coefficients = np.einsum("ij,njk,lk->nil", _DCT, stack, _DCT)[:, :HASH_SIZE, :HASH_SIZE]
+    flat = coefficients.reshape(len(thumbnails), -1)
+    # 直流分量不参与中位数计算，否则整体亮度会主导阈值
+    medians = np.median(flat[:, 1:], axis=1, keepdims=True)
+    bits = np.packbits(flat > medians, axis=1)  # (N, 8) uint8, big-endian
+    for idx, packed in zip(valid_index, bits):
+        hashes[idx] = int.from_bytes(packed.tobytes(), "big")
+    return hashes
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """Burkhard-Keller tree over integer hashes with Hamming distance."""
+
+    def __init__(self) -> None:
+        self._root: Optional[Tuple[int, Any, Dict[int, Any]]] = None
+
+    def add(self, value: int, item: Any) -> None:
+        if self._root is None:
+            self._root = (value, item, {})
+            return
+        node = self._root
+        while True:
+            distance = hamming_distance(value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, item, {})
+                return
+            node = child
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, Any]]:
+        """Return ``(distance, item)`` for every stored hash within ``max_distance``."""
+        if self._root is None:
+            return []
+        matches = []
+        stack = [self._root]
+        while stack:
+            node_value, node_item, children = stack.pop()
+            distance = hamming_distance(value, node_value)
+            if distance <= max_distance:
+                matches.append((distance, node_item))
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return matches
+
+
+def cluster_near_duplicates(hashes: Sequence[Tuple[Hashable, Optional[int]]], max_distance: int) -> Dict[Hashable, List[Hashable]]:
+    """
+    Greedily group items whose hashes are within ``max_distance`` bits.
+
+    Items are visited in order; each joins the nearest existing representative
+    or becomes a new one. Returns ``{representative: [members...]}`` where
+    members exclude the representative itself. Items without a hash are
+    always their own representative.
+    """
+    tree = BKTree()
+    groups: Dict[Hashable, List[Hashable]] = {}
+    for item, value in hashes:
+        if value is None:
+            groups[item] = []
+            continue
+        matches = tree.search(value, max_distance)
+        if matches:
+            _, representative = min(matches, key=lambda match: match[0])
+            groups[representative].append(item)
+            continue
+        tree.add(value, item)
+        groups[item] = []
+    return groups
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+@File    :   persistent_cache.py
+@Time    :   2026/10/16 09:12:40
+@Author  :   tyqqj
+@Version :   1.0
+@Contact :   tyqqj0@163.com
+@Desc    :   JSON Lines-backed key/value cache with age and size eviction
+"""
+
+from __future__ import annotations
+
+import atexit
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+_SET = "set"
+_TOUCH = "touch"
+_DELETE = "delete"
+
+
+def _is_log_record(record: Dict[str, Any]) -> bool:
+    return isinstance(record.get("k"), str) and len(record) == 2 and ("v" in record or "t" in record or "d" in record)
+
+
+class PersistentCache:
+    """
+    Thread-safe cache persisted as an append-only JSON Lines log.
+
+    Each entry stores its value together with creation/last-use timestamps and
+    an optional ``size`` (taken from ``value["size"]``) so the cache can be
+    bounded by age, entry count and total payload bytes. Updates are batched
+    and appended every ``flush_every`` changes, on ``save()`` and at exit; only
+    the changed entries are serialised, outside the lock. Once the log holds
+    far more records than live entries it is compacted into a fresh snapshot.
+    A legacy single-object JSON file is read as-is and rewritten on first save.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        max_entries: Optional[int] = None,
+        max_total_bytes: Optional[int] = None,
+        max_age_seconds: Optional[float] = None,
+        flush_every: int = 50,
+        compact_min_records: int = 1000,
+    ) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.max_total_bytes = max_total_bytes
+        self.max_age_seconds = max_age_seconds
+        self.flush_every = max(1, flush_every)
+        self.compact_min_records = max(1, compact_min_records)
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._total_bytes = 0
+        # 尚未写入日志的变更：key -> _SET / _TOUCH / _DELETE
+        self._pending: Dict[str, str] = {}
+        self._dirty = 0
+        self._log_records = 0
+        self._needs_compaction = False
+        self._lock = threading.Lock()
+        # 保证日志追加与压缩按取出批次的顺序落盘
+        self._io_lock = threading.Lock()
+        self._load()
+        atexit.register(self.save)
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        except Exception as exc:
+            print(f"Failed to load cache file {self.path}, starting empty: {exc}")
+            return
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 进程被终止时最后一行可能不完整
+                self._needs_compaction = True
+                continue
+            if not isinstance(record, dict):
+                continue
+            if not _is_log_record(record):
+                # 旧版本整个文件是一个 {key: entry} 对象
+                self._entries.update((key, entry) for key, entry in record.items() if isinstance(entry, dict))
+                self._needs_compaction = True
+                continue
+            self._log_records += 1
+            key = record["k"]
+            if "v" in record:
+                self._entries[key] = record["v"]
+            elif "t" in record:
+                if key in self._entries:
+                    self._entries[key]["last_used"] = record["t"]
+            else:
+                self._entries.pop(key, None)
+        self._total_bytes = sum(self._entry_size(entry) for entry in self._entries.values())
+
+    def _is_expired(self, entry: Dict[str, Any], now: float) -> bool:
+        if self.max_age_seconds is None:
+            return False
+        return now - float(entry.get("created_at", 0)) > self.max_age_seconds
+
+    @staticmethod
+    def _entry_size(entry: Dict[str, Any]) -> int:
+        value = entry.get("value")
+        if isinstance(value, dict):
+            try:
+                return int(value.get("size", 0))
+            except (TypeError, ValueError):
+                return 0
+        return 0
+
+    def _remove_locked(self, key: str) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self._total_bytes -= self._entry_size(entry)
+        self._pending[key] = _DELETE
+        return True
+
+    def _over_limits_locked(self) -> bool:
+        over_count = self.max_entries is not None and len(self._entries) > self.max_entries
+        over_bytes = self.max_total_bytes is not None and self._total_bytes > self.max_total_bytes
+        return over_count or over_bytes
+
+    def _evict_locked(self, expire: bool) -> None:
+        if expire and self.max_age_seconds is not None:
+            now = time.time()
+            for key in [key for key, entry in self._entries.items() if self._is_expired(entry, now)]:
+                self._remove_locked(key)
+        if not self._over_limits_locked():
+            return
+        # 按最近使用时间从旧到新淘汰
+        by_last_used = sorted(self._entries.items(), key=lambda item: float(item[1].get("last_used", 0)))
+        for key, _entry in by_last_used:
+            if not self._over_limits_locked():
+                break
+            self._remove_locked(key)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._is_expired(entry, time.time()):
+                if entry is not None:
+                    self._remove_locked(key)
+                    self._dirty += 1
+                self.misses += 1
+                return None
+            entry["last_used"] = time.time()
+            self._pending.setdefault(key, _TOUCH)
+            self.hits += 1
+            return entry.get("value")
+
+    def set(self, key: str, value: Any) -> None:
+        now = time.time()
+        entry = {"value": value, "created_at": now, "last_used": now}
+        with self._lock:
+            previous = self._entries.get(key)
+            if previous is not None:
+                self._total_bytes -= self._entry_size(previous)
+            self._entries[key] = entry
+            self._total_bytes += self._entry_size(entry)
+            self._pending[key] = _SET
+            self._dirty += 1
+            should_flush = self._dirty >= self.flush_every
+        if should_flush:
+            self.save()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if self._remove_locked(key):
+                self._dirty += 1
+
+    def save(self) -> None:
+        with self._io_lock:
+            with self._lock:
+                if not self._pending and not self._needs_compaction:
+                    return
+                compact = self._needs_compaction or self._log_records + len(self._pending) > max(
+                    self.compact_min_records, 2 * len(self._entries)
+                )
+                self._evict_locked(expire=compact)
+                if compact:
+                    # 浅拷贝条目（值本身不会被原地修改），序列化在锁外进行
+                    batch = [(key, dict(entry)) for key, entry in self._entries.items()]
+                else:
+                    batch = []
+                    for key, op in self._pending.items():
+                        entry = self._entries.get(key)
+                        if op == _DELETE or entry is None:
+                            batch.append((key, None))
+                        elif op == _TOUCH:
+                            batch.append((key, entry["last_used"]))
+                        else:
+                            batch.append((key, dict(entry)))
+                self._pending = {}
+                self._dirty = 0
+                self._needs_compaction = False
+            if compact:
+                self._write_snapshot(batch)
+            else:
+                self._append(batch)
+
+    def _append(self, batch) -> None:
+        lines = []
+        for key, item in batch:
+            if item is None:
+                record = {"k": key, "d": 1}
+            elif isinstance(item, dict):
+                record = {"k": key, "v": item}
+            else:
+                record = {"k": key, "t": item}
+            lines.append(json.dumps(record, ensure_ascii=False))
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            self._log_records += len(lines)
+        except Exception as exc:
+            print(f"Failed to append to cache file {self.path}: {exc}")
+
+    def _write_snapshot(self, batch) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix=".cache_", suffix=".jsonl", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                for key, entry in batch:
+                    f.write(json.dumps({"k": key, "v": entry}, ensure_ascii=False))
+                    f.write("\n")
+            os.replace(temp_path, self.path)
+            self._log_records = len(batch)
+        except Exception as exc:
+            print(f"Failed to write cache file {self.path}: {exc}")
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+@File    :   rate_limit.py
+@Time    :   2026/10/16 11:20:37
+@Author  :   tyqqj
+@Version :   1.0
+@Contact :   tyqqj0@163.com
+@Desc    :   Token-bucket quotas and AIMD concurrency control per endpoint
+"""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, Optional
+
+_THROTTLE_MARKERS = (
+    "429",
+    "too many requests",
+    "toomanyrequests",
+    "rate limit",
+    "ratelimit",
+    "throttl",
+    "slowdown",
+    "qps limit",
+    "serveroverloaded",
+)
+
+
+def is_throttle_message(message: str) -> bool:
+    message = message.lower()
+    return any(marker in message for marker in _THROTTLE_MARKERS)
+
+
+def is_throttle_error(exc: BaseException) -> bool:
+    """Best-effort detection of quota/throttling errors from Ark, oss2 and requests."""
+    for attr in ("status_code", "status"):
+        if getattr(exc, attr, None) == 429:
+            return True
+    response = getattr(exc, "response", None)
+    if response is not None and getattr(response, "status_code", None) == 429:
+        return True
+    return is_throttle_message(f"{type(exc).__name__} {exc}")
+
+
+def retry_delay_seconds(attempt: int, exc: BaseException, base: float = 1.0, cap: float = 60.0) -> float:
+    """
+    Delay before retrying after ``exc`` on the given 1-based attempt: a fixed
+    ``base`` for ordinary errors, exponential backoff with jitter for throttling.
+    """
+    if not is_throttle_error(exc):
+        return base
+    return min(cap, base * (2 ** max(0, attempt - 1))) * random.uniform(0.5, 1.0)
+
+
+def _resolve_waiter(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class TokenBucket:
+    """
+    Per-minute quota (RPM/TPM). ``reserve`` takes tokens immediately, letting
+    the balance go negative, and returns how long the caller must wait before
+    proceeding, so both threads and coroutines can share one bucket.
+    """
+
+    def __init__(self, per_minute: float, burst: Optional[float] = None) -> None:
+        if per_minute <= 0:
+            raise ValueError("per_minute must be positive.")
+        self.rate = per_minute / 60.0
+        self.capacity = float(burst if burst is not None else per_minute)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill_locked(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        with self._lock:
+            self._refill_locked()
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def adjust(self, delta: float) -> None:
+        """Correct an earlier reservation once the real cost (e.g. token usage) is known."""
+        with self._lock:
+            self._refill_locked()
+            self._tokens = min(self.capacity, self._tokens - delta)
+
+
+class AIMDLimiter:
+    """
+    Additive-increase / multiplicative-decrease concurrency limit.
+
+    Every successful call grows the limit by ``increase / limit`` (about +1 per
+    window of ``limit`` calls). A throttle signal multiplies it by
+    ``decrease_factor``, and a call slower than ``latency_target_seconds``
+    by ``latency_decrease_factor``. At most one decrease is applied per
+    ``cooldown_seconds``, so one burst of 429s counts as a single signal.
+
+    Threads wait on a condition; coroutines (possibly on several event loops)
+    wait on futures that ``release`` resolves, one per slot that became free.
+    """
+
+    def __init__(
+        self,
+        initial: float = 4,
+        minimum: float = 1,
+        maximum: float = 64,
+        increase: float = 1.0,
+        decrease_factor: float = 0.5,
+        latency_target_seconds: Optional[float] = None,
+        latency_decrease_factor: float = 0.9,
+        cooldown_seconds: float = 1.0,
+    ) -> None:
+        self.minimum = max(1.0, float(minimum))
+        self.maximum = max(self.minimum, float(maximum))
+        self.limit = min(self.maximum, max(self.minimum, float(initial)))
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.latency_target_seconds = latency_target_seconds
+        self.latency_decrease_factor = latency_decrease_factor
+        self.cooldown_seconds = cooldown_seconds
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        # 等待名额的协程：(事件循环, future)，按到达顺序唤醒
+        self._async_waiters = collections.deque()
+
+    def try_acquire(self) -> bool:
+        with self._condition:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    async def acquire_async(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                waiter = (loop, loop.create_future())
+                self._async_waiters.append(waiter)
+            try:
+                await waiter[1]
+            except asyncio.CancelledError:
+                with self._condition:
+                    try:
+                        self._async_waiters.remove(waiter)
+                    except ValueError:
+                        # 已被唤醒但随即被取消，把名额让给下一个等待者
+                        self._wake_async_locked(1)
+                raise
+            # 被唤醒后重新竞争名额（可能被线程抢先，此时重新排队）
+
+    def _wake_async_locked(self, count: int) -> None:
+        while count > 0 and self._async_waiters:
+            loop, future = self._async_waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(_resolve_waiter, future)
+            except RuntimeError:
+                # 事件循环已关闭
+                continue
+            count -= 1
+
+    def _decrease_locked(self, factor: float) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown_seconds:
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit * factor)
+
+    def release(self, latency: Optional[float] = None, throttled: bool = False) -> None:
+        with self._condition:
+            self.in_flight = max(0, self.in_flight - 1)
+            if throttled:
+                self._decrease_locked(self.decrease_factor)
+            elif (
+                self.latency_target_seconds is not None
+                and latency is not None
+                and latency > self.latency_target_seconds
+            ):
+                self._decrease_locked(self.latency_decrease_factor)
+            else:
+                self.limit = min(self.maximum, self.limit + self.increase / max(1.0, self.limit))
+            self._condition.notify_all()
+            self._wake_async_locked(int(self.limit) - self.in_flight)
+
+
+class EndpointRateLimiter:
+    """
+    Combines request/token quotas with an AIMD concurrency limit for one endpoint.
+
+    Use ``with limiter.limit(tokens=...):`` around each call (or
+    ``async with limiter.limit_async(...)``). Exceptions raised inside the block
+    are classified with ``is_throttle_error`` and fed back to the AIMD limit.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        initial_concurrency: float = 4,
+        min_concurrency: float = 1,
+        max_concurrency: float = 64,
+        latency_target_seconds: Optional[float] = None,
+        decrease_factor: float = 0.5,
+    ) -> None:
+        self.name = name
+        self.request_bucket = TokenBucket(rpm) if rpm else None
+        self.token_bucket = TokenBucket(tpm) if tpm else None
+        self.concurrency = AIMDLimiter(
+            initial=initial_concurrency,
+            minimum=min_concurrency,
+            maximum=max_concurrency,
+            decrease_factor=decrease_factor,
+            latency_target_seconds=latency_target_seconds,
+        )
+        self.requests = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def _quota_wait(self, tokens: float) -> float:
+        wait = 0.0
+        if self.request_bucket is not None:
+            wait = max(wait, self.request_bucket.reserve(1))
+        if self.token_bucket is not None and tokens:
+            wait = max(wait, self.token_bucket.reserve(tokens))
+        return wait
+
+    def _finish(self, started: float, throttled: bool) -> None:
+        with self._lock:
+            self.requests += 1
+            if throttled:
+                self.throttled += 1
+        self.concurrency.release(time.monotonic() - started, throttled=throttled)
+
+    def record_tokens(self, delta: float) -> None:
+        """Charge (or refund, if negative) the difference between estimated and actual tokens."""
+        if self.token_bucket is not None and delta:
+            self.token_bucket.adjust(delta)
+
+    @contextmanager
+    def limit(self, tokens: float = 0):
+        wait = self._quota_wait(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        self.concurrency.acquire()
+        started = time.monotonic()
+        try:
+            yield self
+        except BaseException as exc:
+            self._finish(started, is_throttle_error(exc))
+            raise
+        self._finish(started, False)
+
+    @asynccontextmanager
+    async def limit_async(self, tokens: float = 0):
+        wait = self._quota_wait(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        await self.concurrency.acquire_async()
+        started = time.monotonic()
+        try:
+            yield self
+        except BaseException as exc:
+            self._finish(started, is_throttle_error(exc))
+            raise
+        self._finish(started, False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "concurrency_limit": round(self.concurrency.limit, 2),
+            }
+
+
+class RateLimitController:
+    """Registry of per-endpoint limiters shared by every worker in the process."""
+
+    def __init__(self, endpoints: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
+        self._limiters: Dict[str, EndpointRateLimiter] = {}
+        for name, options in (endpoints or {}).items():
+            self._limiters[name] = EndpointRateLimiter(name, **(options or {}))
+
+    def get(self, name: str) -> Optional[EndpointRateLimiter]:
+        return self._limiters.get(name)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: limiter.stats() for name, limiter in self._limiters.items()}
+
+    def report(self) -> None:
+        for name, stats in self.stats().items():
+            print(
+                f"Rate limit [{name}]: {stats['requests']} request(s), {stats['throttled']} throttled, "
+                f"concurrency limit {stats['concurrency_limit']}"
+            )
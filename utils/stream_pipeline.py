@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+@File    :   stream_pipeline.py
+@Time    :   2026/10/16 10:05:12
+@Author  :   tyqqj
+@Version :   1.0
+@Contact :   tyqqj0@163.com
+@Desc    :   Per-item streaming pipeline with bounded queues between stages
+"""
+
+from __future__ import annotations
+
+import queue
+import threading
+from typing import Any, Callable, Iterable, List, Optional, Sequence, Tuple
+
+_SENTINEL = object()
+
+
+class StreamPipeline:
+    """
+    Push items through a chain of stages, each served by its own worker threads.
+
+    ``stages`` is a sequence of ``(name, fn, workers)``. ``fn(item)`` returns
+    the item handed to the next stage, or None when the item is finished early
+    (e.g. its output already exists). Stages are connected by queues of at most
+    ``queue_size`` items, so a slow stage throttles the ones feeding it instead
+    of letting work pile up in memory.
+    """
+
+    def __init__(self, stages: Sequence[Tuple[str, Callable[[Any], Any], int]], queue_size: int = 64) -> None:
+        if not stages:
+            raise ValueError("StreamPipeline requires at least one stage.")
+        self.stages = [(name, fn, max(1, int(workers))) for name, fn, workers in stages]
+        self.queue_size = max(1, int(queue_size))
+
+    def run(
+        self,
+        items: Iterable[Any],
+        identify: Callable[[Any], str] = str,
+        on_finished: Optional[Callable[[Any], None]] = None,
+        on_error: Optional[Callable[[str, str], None]] = None,
+    ) -> List[Tuple[str, str]]:
+        """
+        Run all items through the pipeline and block until every stage drains.
+
+        ``on_finished(item)`` is called once per item when it leaves the
+        pipeline, whether it completed, was dropped or failed. When
+        ``on_error(identifier, message)`` is given, failures are passed to it
+        as they happen instead of being collected (for unbounded item streams).
+
+        :return: list of ``(identifier, message)`` for failed items
+        """
+        stage_count = len(self.stages)
+        queues: List[queue.Queue] = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        remaining = [workers for _, _, workers in self.stages]
+        errors: List[Tuple[str, str]] = []
+        lock = threading.Lock()
+
+        def finish(item):
+            if on_finished is not None:
+                on_finished(item)
+
+        def worker(index: int) -> None:
+            name, fn, _ = self.stages[index]
+            in_queue = queues[index]
+            while True:
+                item = in_queue.get()
+                if item is _SENTINEL:
+                    break
+                try:
+                    result = fn(item)
+                except Exception as exc:
+                    if on_error is not None:
+                        on_error(identify(item), f"[{name}] {exc}")
+                    else:
+                        with lock:
+                            errors.append((identify(item), f"[{name}] {exc}"))
+                    finish(item)
+                    continue
+                if result is None or index == stage_count - 1:
+                    finish(item if result is None else result)
+                else:
+                    queues[index + 1].put(result)
+
+            # 本阶段最后一个退出的线程负责通知下一阶段结束
+            with lock:
+                remaining[index] -= 1
+                last_out = remaining[index] == 0
+            if last_out and index + 1 < stage_count:
+                for _ in range(self.stages[index + 1][2]):
+                    queues[index + 1].put(_SENTINEL)
+
+        threads = []
+        for index, (name, _, workers) in enumerate(self.stages):
+            for worker_idx in range(workers):
+                thread = threading.Thread(
+                    target=worker, args=(index,), name=f"{name}-{worker_idx}", daemon=True
+                )
+                thread.start()
+                threads.append(thread)
+
+        try:
+            for item in items:
+                queues[0].put(item)
+        finally:
+            for _ in range(self.stages[0][2]):
+                queues[0].put(_SENTINEL)
+            for thread in threads:
+                thread.join()
+
+        return errors
@@ -12,16 +12,20 @@
 
 from __future__ import annotations
 
+import asyncio
 import os
 import time
 from typing import Any, Optional, Sequence
 
+from .rate_limit import EndpointRateLimiter, retry_delay_seconds
+
 _ark_import_error: Optional[ImportError]
 try:
-    from volcenginesdkarkruntime import Ark  # type: ignore[import]
+    from volcenginesdkarkruntime import Ark, AsyncArk  # type: ignore[import]
     from volcenginesdkarkruntime.types.images.images import SequentialImageGenerationOptions  # type: ignore[import]
 except ImportError as exc:  # pragma: no cover - optional dependency
     Ark = None  # type: ignore[assignment]
+    AsyncArk = None  # type: ignore[assignment]
     SequentialImageGenerationOptions = None  # type: ignore[assignment]
     _ark_import_error = exc
 else:
@@ -42,6 +46,7 @@ class TextToImageGenerator:
         retry_interval_seconds: float = 1.5,
         watermark: bool = True,
         response_format: str = "url",
+        rate_limiter: Optional[EndpointRateLimiter] = None,
     ) -> None:
         if Ark is None or SequentialImageGenerationOptions is None:
             raise ImportError(
@@ -49,14 +54,15 @@ class TextToImageGenerator:
                 "Install it via `pip install volcenginesdkarkruntime`."
             ) from _ark_import_error
 
-        from . import default_ark_api_key
+        resolved_api_key = api_key or os.environ.get("ARK_API_KEY")
+        if not resolved_api_key:
+            from . import default_ark_api_key
 
-        resolved_api_key = api_key or os.environ.get("ARK_API_KEY") or default_ark_api_key
+            resolved_api_key = default_ark_api_key
         if not resolved_api_key:
             raise RuntimeError("Missing Ark API key. Set ARK_API_KEY or provide api_key explicitly.")
 
-        assert Ark is not None  # narrow for type checkers
-        self.client: Any = Ark(base_url=base_url, api_key=resolved_api_key)
+        self.client: Any = self._create_client(base_url, resolved_api_key)
         self.model_name = model_name
         self.default_size = default_size
         self.sequential_mode = sequential_mode
@@ -65,6 +71,12 @@ class TextToImageGenerator:
         self.retry_interval_seconds = retry_interval_seconds
         self.response_format = response_format
         self.watermark = watermark
+        self.rate_limiter = rate_limiter
+
+    @staticmethod
+    def _create_client(base_url: str, api_key: str) -> Any:
+        assert Ark is not None  # narrow for type checkers
+        return Ark(base_url=base_url, api_key=api_key)
 
     def _prepare_payload(
         self,
@@ -111,12 +123,56 @@ class TextToImageGenerator:
         last_error: Optional[Exception] = None
         for attempt in range(1, self.max_retries + 1):
             try:
-                response = self.client.images.generate(**payload)
+                if self.rate_limiter is None:
+                    response = self.client.images.generate(**payload)
+                else:
+                    with self.rate_limiter.limit():
+                        response = self.client.images.generate(**payload)
+                return self._extract_first_image_url(response)
+            except Exception as exc:  # pragma: no cover - network dependent
+                last_error = exc
+                if attempt == self.max_retries:
+                    break
+                time.sleep(retry_delay_seconds(attempt, exc, self.retry_interval_seconds))
+
+        raise RuntimeError(f"Failed to generate image after {self.max_retries} attempts: {last_error}")
+
+
+class AsyncTextToImageGenerator(TextToImageGenerator):
+    """TextToImageGenerator 的 asyncio 版本，重试等待不占用线程。"""
+
+    @staticmethod
+    def _create_client(base_url: str, api_key: str) -> Any:
+        assert AsyncArk is not None  # narrow for type checkers
+        return AsyncArk(base_url=base_url, api_key=api_key)
+
+    async def generate(  # type: ignore[override]
+        self,
+        prompt: str,
+        *,
+        size: Optional[str] = None,
+        reference_images: Optional[Sequence[str]] = None,
+    ) -> str:
+        payload = self._prepare_payload(prompt, size, reference_images)
+
+        last_error: Optional[Exception] = None
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                if self.rate_limiter is None:
+                    response = await self.client.images.generate(**payload)
+                else:
+                    async with self.rate_limiter.limit_async():
+                        response = await self.client.images.generate(**payload)
                 return self._extract_first_image_url(response)
             except Exception as exc:  # pragma: no cover - network dependent
                 last_error = exc
                 if attempt == self.max_retries:
                     break
-                time.sleep(self.retry_interval_seconds)
+                await asyncio.sleep(retry_delay_seconds(attempt, exc, self.retry_interval_seconds))
 
         raise RuntimeError(f"Failed to generate image after {self.max_retries} attempts: {last_error}")
+
+    async def close(self) -> None:
+        close = getattr(self.client, "close", None)
+        if close is not None:
+            await close()
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+@File    :   work_lease.py
+@Time    :   2026/10/16 18:55:12
+@Author  :   tyqqj
+@Version :   1.0
+@Contact :   tyqqj0@163.com
+@Desc    :   Shard assignment and lease-based work claiming across nodes sharing data/
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import suppress
+from typing import Dict, Set, Tuple
+
+
+class LeaseUnavailable(RuntimeError):
+    """The item is currently claimed by another node (or was just finished by one)."""
+
+
+def shard_of(key: str, shard_count: int) -> int:
+    """Deterministic shard of a relative-path key, identical on every host and Python run."""
+    if shard_count <= 1:
+        return 0
+    digest = hashlib.sha1(key.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shard_count
+
+
+class _LeaseStats:
+    """
+    Claim counters plus a heartbeat shared by both coordinators.
+
+    Every lease this process holds is renewed every ``ttl_seconds / 3`` by one
+    daemon thread until it is released, so a stage that runs longer than the
+    TTL keeps its claim. A crashed process stops renewing and its leases
+    expire ``ttl_seconds`` later.
+    """
+
+    ttl_seconds = 900.0
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.claimed = 0
+        self.skipped = 0
+        self._held: Set[Tuple[str, str]] = set()
+        self._heartbeat = None
+        self._stopped = threading.Event()
+
+    def count(self, claimed: bool) -> bool:
+        with self._lock:
+            if claimed:
+                self.claimed += 1
+            else:
+                self.skipped += 1
+        return claimed
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"claimed": self.claimed, "skipped": self.skipped}
+
+    def renew(self, stage: str, key: str) -> bool:
+        raise NotImplementedError
+
+    def _hold(self, stage: str, key: str) -> None:
+        with self._lock:
+            self._held.add((stage, key))
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._renew_loop, name="lease-heartbeat", daemon=True)
+                self._heartbeat.start()
+
+    def _drop(self, stage: str, key: str) -> None:
+        with self._lock:
+            self._held.discard((stage, key))
+
+    def _renew_loop(self) -> None:
+        while not self._stopped.wait(max(0.05, self.ttl_seconds / 3)):
+            with self._lock:
+                held = list(self._held)
+            for stage, key in held:
+                try:
+                    if not self.renew(stage, key):
+                        print(f"Lease {stage}/{key} was taken over by another node.")
+                        self._drop(stage, key)
+                except Exception as exc:
+                    print(f"Failed to renew lease {stage}/{key}: {exc}")
+
+    def _stop_heartbeat(self) -> None:
+        self._stopped.set()
+
+
+_LEASE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    stage TEXT NOT NULL,
+    key TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    status TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (stage, key)
+);
+"""
+
+
+class SQLiteLeaseCoordinator(_LeaseStats):
+    """
+    Leases stored in one SQLite file that every node opens.
+
+    ``try_claim`` is a single upsert that only takes over a row when it is
+    ours, its lease has expired, or it was finished before this node started
+    (finished items from earlier runs are already excluded when tasks are
+    collected). Uses the rollback journal, since WAL does not work across
+    hosts; the shared filesystem must support POSIX locks. Held leases are
+    renewed by the heartbeat, so ``ttl_seconds`` only bounds how long a
+    crashed node's items stay blocked. Expiry compares wall clocks, so hosts
+    should be NTP-synced well within ``ttl_seconds``.
+    """
+
+    def __init__(self, path: str, owner: str, ttl_seconds: float = 900.0) -> None:
+        super().__init__()
+        self.path = path
+        self.owner = owner
+        self.ttl_seconds = ttl_seconds
+        self.started_at = time.time()
+        self._db_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self._conn.executescript(_LEASE_SCHEMA)
+        self._conn.commit()
+
+    def try_claim(self, stage: str, key: str) -> bool:
+        now = time.time()
+        with self._db_lock:
+            cursor = self._conn.execute(
+                "INSERT INTO leases (stage, key, owner, status, expires_at, updated_at) "
+                "VALUES (?, ?, ?, 'active', ?, ?) "
+                "ON CONFLICT (stage, key) DO UPDATE SET owner = excluded.owner, status = 'active', "
+                "expires_at = excluded.expires_at, updated_at = excluded.updated_at "
+                "WHERE leases.owner = excluded.owner "
+                "OR (leases.status = 'active' AND leases.expires_at < ?) "
+                "OR (leases.status = 'done' AND leases.updated_at < ?)",
+                (stage, key, self.owner, now + self.ttl_seconds, now, now, self.started_at),
+            )
+            self._conn.commit()
+        if cursor.rowcount == 1:
+            self._hold(stage, key)
+        return self.count(cursor.rowcount == 1)
+
+    def renew(self, stage: str, key: str) -> bool:
+        with self._db_lock:
+            cursor = self._conn.execute(
+                "UPDATE leases SET expires_at = ? WHERE stage = ? AND key = ? AND owner = ? AND status = 'active'",
+                (time.time() + self.ttl_seconds, stage, key, self.owner),
+            )
+            self._conn.commit()
+            return cursor.rowcount == 1
+
+    def release(self, stage: str, key: str, done: bool) -> None:
+        self._drop(stage, key)
+        with self._db_lock:
+            if done:
+                self._conn.execute(
+                    "UPDATE leases SET status = 'done', updated_at = ? WHERE stage = ? AND key = ? AND owner = ?",
+                    (time.time(), stage, key, self.owner),
+                )
+            else:
+                # 失败的任务立即释放，其他节点可以接手
+                self._conn.execute(
+                    "DELETE FROM leases WHERE stage = ? AND key = ? AND owner = ?", (stage, key, self.owner)
+                )
+            self._conn.commit()
+
+    def close(self) -> None:
+        self._stop_heartbeat()
+        with self._db_lock:
+            self._conn.close()
+
+
+class LockFileLeaseCoordinator(_LeaseStats):
+    """
+    One ``<stage>/<sha1>.lock`` file per claimed item, created with
+    ``O_CREAT | O_EXCL`` so it works on any shared filesystem. A finished
+    item leaves a ``.done`` marker. An expired lock is taken over only by the
+    node that creates the ``O_EXCL`` takeover marker for that exact lock
+    generation (every lock carries a unique token), and only if the lock
+    still holds that generation when it is removed, so two nodes that both
+    saw the same expired lock cannot both win.
+    """
+
+    def __init__(self, directory: str, owner: str, ttl_seconds: float = 900.0) -> None:
+        super().__init__()
+        self.directory = directory
+        self.owner = owner
+        self.ttl_seconds = ttl_seconds
+        self.started_at = time.time()
+
+    def _paths(self, stage: str, key: str):
+        stage_dir = os.path.join(self.directory, stage)
+        os.makedirs(stage_dir, exist_ok=True)
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        base = os.path.join(stage_dir, name)
+        return base + ".lock", base + ".done"
+
+    def _lock_content(self, token: str) -> str:
+        return json.dumps({"owner": self.owner, "token": token, "expires_at": time.time() + self.ttl_seconds})
+
+    def _create(self, lock_path: str) -> bool:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(self._lock_content(uuid.uuid4().hex))
+        return True
+
+    @staticmethod
+    def _read(path: str) -> str:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def _take_over(self, lock_path: str, expired: str) -> bool:
+        marker = f"{lock_path}.takeover-{hashlib.sha1(expired.encode('utf-8')).hexdigest()[:16]}"
+        try:
+            os.close(os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+        except FileExistsError:
+            # 另一个节点正在接管同一代锁；接管中途崩溃留下的标记在 ttl 后清理
+            with suppress(OSError):
+                if time.time() - os.path.getmtime(marker) > self.ttl_seconds:
+                    os.remove(marker)
+            return False
+        try:
+            try:
+                current = self._read(lock_path)
+            except FileNotFoundError:
+                current = None
+            if current != expired:
+                return False  # 已被释放、续期或由其他节点接管
+            with suppress(FileNotFoundError):
+                os.remove(lock_path)
+            return self._create(lock_path)
+        finally:
+            with suppress(FileNotFoundError):
+                os.remove(marker)
+
+    def try_claim(self, stage: str, key: str) -> bool:
+        lock_path, done_path = self._paths(stage, key)
+        try:
+            if os.path.getmtime(done_path) >= self.started_at:
+                return self.count(False)
+        except FileNotFoundError:
+            pass
+        if self._create(lock_path):
+            self._hold(stage, key)
+            return self.count(True)
+        try:
+            content = self._read(lock_path)
+            holder = json.loads(content)
+        except (FileNotFoundError, ValueError):
+            # 锁刚被释放或正在写入，交给下一轮收集处理
+            return self.count(False)
+        if holder.get("owner") == self.owner:
+            self._hold(stage, key)
+            return self.count(True)
+        if holder.get("expires_at", 0) >= time.time() or not self._take_over(lock_path, content):
+            return self.count(False)
+        self._hold(stage, key)
+        return self.count(True)
+
+    def renew(self, stage: str, key: str) -> bool:
+        lock_path, _done_path = self._paths(stage, key)
+        try:
+            holder = json.loads(self._read(lock_path))
+        except (FileNotFoundError, ValueError):
+            return False
+        # 已过期的锁可能正被其他节点接管，不再续期
+        if holder.get("owner") != self.owner or holder.get("expires_at", 0) < time.time():
+            return False
+        # 先写临时文件再原子替换，其他节点不会读到写了一半的锁
+        temp_path = f"{lock_path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self._lock_content(holder.get("token") or uuid.uuid4().hex))
+        os.replace(temp_path, lock_path)
+        return True
+
+    def release(self, stage: str, key: str, done: bool) -> None:
+        self._drop(stage, key)
+        lock_path, done_path = self._paths(stage, key)
+        if done:
+            with open(done_path, "w", encoding="utf-8") as f:
+                f.write(self.owner)
+        try:
+            with open(lock_path, "r", encoding="utf-8") as f:
+                if json.load(f).get("owner") != self.owner:
+                    return  # 租约已过期并被其他节点接管
+            os.remove(lock_path)
+        except (FileNotFoundError, ValueError):
+            pass
+
+    def close(self) -> None:
+        self._stop_heartbeat()
+
+
+def create_lease_coordinator(mode: str, path: str, owner: str, ttl_seconds: float):
+    if mode == "sqlite":
+        return SQLiteLeaseCoordinator(path, owner, ttl_seconds)
+    if mode == "lockfile":
+        return LockFileLeaseCoordinator(path, owner, ttl_seconds)
+    raise ValueError(f"Unknown lease mode: {mode!r} (expected 'sqlite' or 'lockfile')")